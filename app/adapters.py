@@ -0,0 +1,151 @@
+"""
+Gestion des adapters LoRA d'un pipeline : diff entre le jeu demande et l'etat
+actif (aucun appel PEFT si rien ne change) et LRU borne des adapters charges,
+avec eviction adapter par adapter (delete_adapters) au lieu de
+unload_lora_weights() global.
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Composants qui portent des couches LoRA
+LORA_COMPONENTS = ("unet", "text_encoder", "text_encoder_2")
+
+
+def adapter_size_bytes(pipe: Any, adapter_name: str) -> int:
+    """Taille des poids PEFT d'un adapter (parametres '...lora_A.<name>.weight')"""
+    marker = f".{adapter_name}."
+    total = 0
+    for component_name in LORA_COMPONENTS:
+        component = getattr(pipe, component_name, None)
+        named_parameters = getattr(component, "named_parameters", None)
+        if not callable(named_parameters):
+            continue
+        for param_name, param in named_parameters():
+            if marker in param_name:
+                total += param.numel() * param.element_size()
+    return total
+
+
+class AdapterManager:
+    """Etat LoRA d'un pipeline resident"""
+
+    def __init__(
+        self,
+        pipe: Any,
+        loader: Callable[[Any, str, Any], None],
+        max_adapters: int,
+        max_bytes: int,
+    ):
+        self.pipe = pipe
+        self.loader = loader
+        self.max_adapters = max(1, max_adapters)
+        self.max_bytes = max_bytes
+        # name -> LoRAConfig, ordre LRU (le plus recent en fin)
+        self.loaded: "OrderedDict[str, Any]" = OrderedDict()
+        self.sizes: Dict[str, int] = {}
+        self.active: Tuple[Tuple[str, float], ...] = ()
+        self.enabled = True
+        self.loads = 0
+        self.evictions = 0
+        self.applies = 0
+        self.skips = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.sizes.values())
+
+    def apply(self, requested: List[Tuple[str, float, Any]]) -> bool:
+        """
+        Active exactement le jeu demande [(name, weight, config), ...].
+
+        Returns:
+            False si l'etat actif correspondait deja (aucun appel au pipeline)
+        """
+        target = tuple(sorted((name, float(weight)) for name, weight, _ in requested))
+        if target == self.active:
+            self.skips += 1
+            return False
+
+        keep = {name for name, _, _ in requested}
+        names, weights = [], []
+        for name, weight, config in requested:
+            if name not in self.loaded:
+                self._make_room(keep)
+                if not self._load(name, config):
+                    continue
+            self.loaded.move_to_end(name)
+            names.append(name)
+            weights.append(weight)
+
+        self._evict_over_budget(keep)
+
+        if names:
+            if not self.enabled:
+                self.pipe.enable_lora()
+                self.enabled = True
+            self.pipe.set_adapters(names, adapter_weights=weights)
+        elif self.enabled and self.loaded:
+            # Adapters gardes en memoire pour les prochains jobs
+            self.pipe.disable_lora()
+            self.enabled = False
+
+        self.active = tuple(sorted(zip(names, map(float, weights))))
+        self.applies += 1
+        return True
+
+    def disable(self) -> None:
+        """Desactive tous les adapters (ils restent charges)"""
+        if self.enabled and self.loaded:
+            self.pipe.disable_lora()
+            self.enabled = False
+        self.active = ()
+
+    def _load(self, name: str, config: Any) -> bool:
+        logger.info("Chargement LoRA: %s", config.name)
+        try:
+            self.loader(self.pipe, name, config)
+        except Exception:
+            logger.error("Erreur chargement LoRA %s", name, exc_info=True)
+            return False
+        self.loaded[name] = config
+        self.sizes[name] = adapter_size_bytes(self.pipe, name)
+        self.loads += 1
+        return True
+
+    def _make_room(self, keep: set) -> None:
+        while len(self.loaded) >= self.max_adapters and self._evict_one(keep):
+            pass
+
+    def _evict_over_budget(self, keep: set) -> None:
+        while (
+            len(self.loaded) > self.max_adapters or self.total_bytes > self.max_bytes
+        ) and self._evict_one(keep):
+            pass
+
+    def _evict_one(self, keep: set) -> bool:
+        """Decharge l'adapter le moins recent hors du jeu demande"""
+        for name in self.loaded:
+            if name in keep:
+                continue
+            self.pipe.delete_adapters([name])
+            del self.loaded[name]
+            size = self.sizes.pop(name, 0)
+            self.evictions += 1
+            logger.info("Eviction LoRA %s (%.0f Mo)", name, size / 1024**2)
+            return True
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": {name: self.sizes.get(name, 0) for name in self.loaded},
+            "active": [name for name, _ in self.active],
+            "total_bytes": self.total_bytes,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "applies": self.applies,
+            "skips": self.skips,
+        }
@@ -0,0 +1,92 @@
+"""
+Controle d'admission de la file de generation.
+
+Les jobs admis sont gardes dans un sorted set Redis (score = date
+d'admission) jusqu'a leur fin : ZCARD donne la profondeur en O(1), ZRANK la
+position en O(log n). Remplace celery_app.control.inspect(), qui diffuse une
+requete bloquante a tous les workers et ignore les messages encore dans le
+broker.
+
+Admission : ZADD puis ZCARD, retrait (ZREM) si la capacite est depassee.
+Sous une rafale concurrente a la limite, un job peut etre refuse alors qu'une
+place se libere a l'instant : la file ne depasse jamais MAX_QUEUE_SIZE.
+Les entrees plus anciennes que entry_ttl (worker tue) sont purgees.
+"""
+
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.config import ADMISSION_ENTRY_TTL, MAX_QUEUE_SIZE
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = "imagen:queue:jobs"
+
+
+class QueueFull(ValueError):
+    """File pleine (depth = jobs deja admis)"""
+
+    def __init__(self, depth: int, max_size: int):
+        super().__init__(f"File pleine: {depth}/{max_size}")
+        self.depth = depth
+        self.max_size = max_size
+
+
+class AdmissionController:
+    """Profondeur de file et admission en temps constant"""
+
+    def __init__(
+        self,
+        redis_client=None,
+        max_size: int = MAX_QUEUE_SIZE,
+        entry_ttl: int = ADMISSION_ENTRY_TTL,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._redis = redis_client
+        self.max_size = max_size
+        self.entry_ttl = entry_ttl
+        self.clock = clock
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    def admit(self, job_ids: List[str]) -> int:
+        """
+        Reserve une place par job (tout ou rien).
+
+        Returns:
+            Nombre de jobs deja en file avant ceux-ci
+
+        Raises:
+            QueueFull si la capacite serait depassee
+        """
+        now = self.clock()
+        self.redis.zremrangebyscore(QUEUE_KEY, "-inf", now - self.entry_ttl)
+        self.redis.zadd(QUEUE_KEY, {job_id: now for job_id in job_ids})
+        depth = self.redis.zcard(QUEUE_KEY)
+        if depth > self.max_size:
+            self.redis.zrem(QUEUE_KEY, *job_ids)
+            raise QueueFull(depth - len(job_ids), self.max_size)
+        return depth - len(job_ids)
+
+    def release(self, job_id: str) -> None:
+        """Libere la place d'un job termine (idempotent)"""
+        self.redis.zrem(QUEUE_KEY, job_id)
+
+    def depth(self) -> int:
+        return self.redis.zcard(QUEUE_KEY)
+
+    def position(self, job_id: str) -> Optional[int]:
+        """Position 1-based du job (None s'il n'est plus en file)"""
+        rank = self.redis.zrank(QUEUE_KEY, job_id)
+        return None if rank is None else rank + 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"depth": self.depth(), "max_size": self.max_size}
+
+
+# Instance partagee (API: admit, worker: release)
+admission = AdmissionController()
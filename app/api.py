@@ -1,16 +1,20 @@
+import hashlib
 import hmac
+import logging
 import os
+import random
+import stat
 import sys
+import uuid
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import json
-from datetime import datetime, timezone
-from typing import Dict, List, Optional
+from typing import Dict, List, Literal, Optional
 from celery.result import AsyncResult
-from fastapi import APIRouter, FastAPI, HTTPException, Query, Request, UploadFile, File
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request, UploadFile, File, WebSocket, WebSocketDisconnect
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.base import BaseHTTPMiddleware
 from pydantic import BaseModel, Field
@@ -27,36 +31,69 @@ from app.models_config import (
 )
 from app.model_manager import ModelManager
 from app.references import ReferenceManager, ReferenceRequest
+from app.admission import QueueFull, admission
+from app.blocking import limiter_stats, run_blocking
+from app.events import events, format_sse, make_event
+from app.install_index import install_index
+from app.progress import throughput
+from app.output_index import output_index
+from app.retention import retention
+from app.retrieval import retrievals
+from app.batching import batcher
+from app.dedup import dedup, request_key
+from app.derivatives import derivatives
+from app.encoding import available_formats, extension, format_of, media_type
+from app.http_cache import IMMUTABLE, etag_matches, file_response, not_modified, strong_etag
+from app.scheduler import scheduler
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Imagen API - SDXL Generation", version="2.0")
 v1_router = APIRouter(prefix="/v1")
 
 # Servir les images générées et les references
-app.mount("/outputs", StaticFiles(directory=OUTPUTS_DIR), name="outputs")
-app.mount("/reference", StaticFiles(directory=REFERENCE_DIR), name="reference")
-
-# Fichier de tracking des images recuperees
-RETRIEVAL_TRACKER = OUTPUTS_DIR / ".retrieved.json"
+def _has_hidden_segment(path: str) -> bool:
+    """Un segment du chemin commence par "." (fichier d'etat ou ecriture en cours)"""
+    return any(part.startswith(".") for part in path.replace(os.sep, "/").split("/"))
 
 
-def _load_retrieved() -> Dict[str, str]:
-    """Charge le tracker des images recuperees {filename: retrieved_at}"""
-    if not RETRIEVAL_TRACKER.exists():
-        return {}
-    try:
-        return json.loads(RETRIEVAL_TRACKER.read_text(encoding="utf-8"))
-    except (json.JSONDecodeError, Exception):
-        return {}
+class OutputsStaticFiles(StaticFiles):
+    """
+    /outputs/{filename} reste valide apres sharding (repli sur l'index des
+    sorties). Noms uniques jamais reecrits : ETag = hash du contenu, Range et
+    Cache-Control immutable (cache CDN / reverse proxy sans revalidation).
+    """
 
+    def lookup_path(self, path: str):
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is None:
+            located = output_index.locate(path)
+            if located is not None:
+                return str(located), os.stat(located)
+        return full_path, stat_result
+
+    def _resolve(self, path: str):
+        full_path, stat_result = self.lookup_path(path)
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+            return None
+        return full_path, stat_result, output_index.content_hash(os.path.basename(full_path), full_path)
+
+    async def get_response(self, path: str, scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        if _has_hidden_segment(path):
+            raise HTTPException(status_code=404)
+        resolved = await run_blocking("files", self._resolve, path)
+        if resolved is None:
+            raise HTTPException(status_code=404)
+        full_path, stat_result, digest = resolved
+        return file_response(
+            Request(scope), full_path, stat_result, etag=strong_etag(digest), headers={"Cache-Control": IMMUTABLE}
+        )
 
-def _mark_retrieved(filename: str) -> None:
-    """Marque une image comme recuperee"""
-    tracker = _load_retrieved()
-    tracker[filename] = datetime.now(timezone.utc).isoformat()
-    RETRIEVAL_TRACKER.write_text(
-        json.dumps(tracker, indent=2, ensure_ascii=False), encoding="utf-8"
-    )
 
+app.mount("/outputs", OutputsStaticFiles(directory=OUTPUTS_DIR), name="outputs")
+app.mount("/reference", StaticFiles(directory=REFERENCE_DIR), name="reference")
 
 # ============================================
 # ERROR HANDLING
@@ -117,6 +154,14 @@ class APIKeyMiddleware(BaseHTTPMiddleware):
             if request.method == method and request.url.path == path:
                 return await call_next(request)
 
+        # Fichiers caches de OUTPUTS_DIR (.state.db, .derivatives, .x.png.tmp
+        # en cours d'ecriture dans un shard) jamais servis
+        if request.url.path.startswith("/outputs/") and _has_hidden_segment(request.url.path):
+            return JSONResponse(
+                status_code=404,
+                content={"error": {"code": "NOT_FOUND", "message": "Not found", "detail": "", "status": 404}},
+            )
+
         # Exempt StaticFiles mounts
         if request.url.path.startswith("/outputs/") or request.url.path.startswith("/reference/"):
             return await call_next(request)
@@ -125,23 +170,26 @@ class APIKeyMiddleware(BaseHTTPMiddleware):
         if request.url.path in ("/openapi.json", "/docs", "/redoc"):
             return await call_next(request)
 
-        # Read key from file on every request (hot rotation support, no caching)
-        if not API_KEY_FILE.exists():
+        error = _api_key_error(request.headers.get("X-API-Key", ""))
+        if error:
             return JSONResponse(
                 status_code=401,
-                content={"error": {"code": "UNAUTHORIZED", "message": "API key not configured", "detail": "", "status": 401}},
+                content={"error": {"code": "UNAUTHORIZED", "message": error, "detail": "", "status": 401}},
             )
 
-        expected_key = API_KEY_FILE.read_text(encoding="utf-8").strip()
-        provided_key = request.headers.get("X-API-Key", "")
+        return await call_next(request)
 
-        if not provided_key or not hmac.compare_digest(provided_key, expected_key):
-            return JSONResponse(
-                status_code=401,
-                content={"error": {"code": "UNAUTHORIZED", "message": "Invalid or missing API key", "detail": "", "status": 401}},
-            )
 
-        return await call_next(request)
+def _api_key_error(provided_key: str) -> Optional[str]:
+    """Message d'erreur si la clé fournie est refusée, None si elle est valide"""
+    # Read key from file on every request (hot rotation support, no caching)
+    if not API_KEY_FILE.exists():
+        return "API key not configured"
+
+    expected_key = API_KEY_FILE.read_text(encoding="utf-8").strip()
+    if not provided_key or not hmac.compare_digest(provided_key, expected_key):
+        return "Invalid or missing API key"
+    return None
 
 
 app.add_middleware(APIKeyMiddleware)
@@ -222,6 +270,30 @@ class GenerationRequest(BaseModel):
         default=None,
         description="Seed pour reproductibilité (None = aléatoire)"
     )
+    num_images: int = Field(
+        default=1,
+        ge=1,
+        le=MAX_IMAGES_PER_JOB,
+        description="Nombre d'images du même prompt (seeds seed, seed+1, ...)"
+    )
+    seeds: Optional[List[int]] = Field(
+        default=None,
+        min_length=1,
+        max_length=MAX_IMAGES_PER_JOB,
+        description="Seeds explicites (une image par seed, prioritaire sur seed/num_images)"
+    )
+
+    # Encodage du fichier produit
+    output_format: Literal["png", "webp", "jpeg", "avif"] = Field(
+        default="png",
+        description="Format du fichier (png sans perte ; webp/jpeg/avif avec perte)"
+    )
+    quality: Optional[int] = Field(
+        default=None,
+        ge=1,
+        le=100,
+        description="Qualité des formats avec perte (None = défaut du format)"
+    )
 
     def __init__(self, **data):
         super().__init__(**data)
@@ -241,6 +313,236 @@ class GenerationResponse(BaseModel):
     message: str
 
 
+class BatchGenerationRequest(BaseModel):
+    """Requête de génération groupée (jobs compatibles exécutés en batch GPU)"""
+    items: List[GenerationRequest] = Field(
+        min_length=1,
+        max_length=MAX_BATCH_REQUEST_ITEMS,
+        description="Requêtes de génération (même modèle/LoRAs/steps/CFG pour un batch GPU)"
+    )
+
+
+class BatchGenerationResponse(BaseModel):
+    """Réponse de création de tâches groupées"""
+    jobs: List[GenerationResponse]
+    status: str
+    message: str
+
+
+def _prepare_job(request: GenerationRequest) -> Dict:
+    """Valide une requête et construit les kwargs de generate_image_task"""
+    # Valider le modèle demandé
+    if request.model not in AVAILABLE_MODELS:
+        raise ImagenAPIError(
+            code="MODEL_NOT_FOUND",
+            message=f"Model '{request.model}' not available",
+            detail=f"Available models: {list(AVAILABLE_MODELS.keys())}",
+            status=404,
+        )
+
+    # Valider les LoRAs demandés
+    all_loras = get_all_loras()
+    for lora_req in request.loras:
+        if lora_req.name not in all_loras:
+            raise ImagenAPIError(
+                code="LORA_NOT_FOUND",
+                message=f"LoRA '{lora_req.name}' not available",
+                detail=f"Available LoRAs: {list(all_loras.keys())}",
+                status=404,
+            )
+
+    # Valider les references et resoudre les chemins
+    resolved_refs = []
+    prompt = request.prompt
+    negative_prompt = request.negative_prompt or ""
+
+    if request.references and request.ip_strength > 0:
+        raise ImagenAPIError(
+            code="INVALID_PARAMETERS",
+            message="Cannot use both 'references' and 'ip_strength'",
+            detail="Use 'references' instead of 'ip_strength'.",
+            status=422,
+        )
+
+    if request.references:
+        try:
+            resolved_refs = ReferenceManager.resolve_references(
+                [ReferenceRequest(entity=r.entity, types=r.types, strength=r.strength)
+                 for r in request.references]
+            )
+        except ValueError as e:
+            raise ImagenAPIError(
+                code="REFERENCE_NOT_FOUND",
+                message="Reference resolution failed",
+                detail=str(e),
+                status=404,
+            )
+
+        # Auto-injection fond blanc pour references de type character
+        has_character_ref = any(r.get("category") == "character" for r in resolved_refs)
+        if has_character_ref:
+            if "white background" not in prompt.lower():
+                prompt = f"{prompt}, white background, simple background"
+            if "complex background" not in negative_prompt.lower():
+                negative_prompt = f"{negative_prompt}, complex background, detailed background"
+
+    # Plusieurs images : une seule tâche, une seed par image
+    seed = request.seed
+    seeds = None
+    if request.seeds:
+        if request.num_images not in (1, len(request.seeds)):
+            raise ImagenAPIError(
+                code="INVALID_PARAMETERS",
+                message="'num_images' does not match 'seeds'",
+                detail=f"num_images={request.num_images}, len(seeds)={len(request.seeds)}",
+                status=422,
+            )
+        seeds = list(request.seeds)
+    elif request.num_images > 1:
+        base_seed = seed if seed is not None else random.randint(0, 2**32 - 1)
+        seeds = [base_seed + i for i in range(request.num_images)]
+
+    if seeds and len(seeds) == 1:
+        seed, seeds = seeds[0], None
+
+    if request.output_format not in available_formats():
+        raise ImagenAPIError(
+            code="INVALID_PARAMETERS",
+            message=f"Output format '{request.output_format}' not available",
+            detail=f"Available formats: {available_formats()}",
+            status=422,
+        )
+
+    return dict(
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        model=request.model,
+        loras=[lora.dict() for lora in request.loras],
+        steps=request.steps,
+        guidance_scale=request.guidance_scale,
+        seed=seed,
+        seeds=seeds,
+        ip_strength=request.ip_strength,
+        references=[
+            {"path": r["path"], "strength": r["strength"], "embedding_path": r.get("embedding_path")}
+            for r in resolved_refs
+        ],
+        output_format=request.output_format,
+        quality=request.quality if request.output_format != "png" else None,
+    )
+
+
+def _check_queue(task_ids: List[str]) -> int:
+    """
+    Admission des jobs (protection contre burst CLI), retourne le nombre de
+    jobs déjà en attente. Compteur Redis en O(1), voir app.admission.
+    """
+    try:
+        return admission.admit(task_ids)
+    except QueueFull as e:
+        raise ImagenAPIError(
+            code="QUEUE_FULL",
+            message="Generation queue is saturated",
+            detail=f"Current queue size: {e.depth}/{e.max_size}. Retry after a few minutes.",
+            status=503,
+        )
+    except Exception as e:
+        # Redis indisponible : la publication Celery echouera de toute facon
+        logger.warning("Admission indisponible, jobs acceptes sans controle: %s", e)
+        return 0
+
+
+def _submit_job(job: Dict, task_id: str) -> str:
+    """Publie un job admis (scheduler + batching enregistrés avant publication)"""
+    # Le worker peut consommer le message immediatement
+    if SCHEDULER_ENABLED:
+        try:
+            scheduler.register(task_id, job["model"], job["loras"])
+        except Exception as e:
+            logger.warning("Scheduler indisponible, job %s en FIFO: %s", task_id, e)
+    try:
+        batcher.offer(task_id, job)
+    except Exception as e:
+        logger.warning("Batching indisponible pour le job %s: %s", task_id, e)
+
+    # Soumission tâche avec TOUS les paramètres
+    try:
+        generate_image_task.apply_async(kwargs=job, task_id=task_id)
+    except Exception:
+        _withdraw_job(task_id)
+        raise
+    return task_id
+
+
+def _withdraw_job(task_id: str) -> None:
+    """Publication echouee : le job ne doit etre ni batche ni attendu par le scheduler"""
+    admission.release(task_id)
+    try:
+        if not batcher.withdraw(task_id):
+            logger.warning("Job %s non publie deja reclame par un batch", task_id)
+    except Exception as e:
+        logger.warning("Batching indisponible, job %s non retire: %s", task_id, e)
+    if SCHEDULER_ENABLED:
+        try:
+            scheduler.finish(task_id)
+        except Exception as e:
+            logger.warning("Scheduler indisponible, job %s non retire: %s", task_id, e)
+
+
+def _cancel_published_job(task_id: str) -> None:
+    """Annule un job deja publie (lot en echec) : message revoque, puis retire"""
+    try:
+        celery_app.control.revoke(task_id)
+    except Exception as e:
+        logger.warning("Revocation du job %s impossible: %s", task_id, e)
+    _withdraw_job(task_id)
+
+
+def _dedup_key(request: GenerationRequest, job: Dict) -> Optional[str]:
+    """Cle de deduplication (seed explicite uniquement : sinon le rendu differe)"""
+    if not DEDUP_ENABLED or (request.seed is None and not request.seeds):
+        return None
+    try:
+        return request_key(job, legacy_reference=str(LEGACY_REFERENCE_IMAGE))
+    except OSError as e:
+        logger.warning("Cle de deduplication non calculee: %s", e)
+        return None
+
+
+def _deduplicate(key: str, task_id: str) -> Optional[GenerationResponse]:
+    """
+    Resultat identique encore sur disque : termine `task_id` sans GPU. Job
+    identique en cours : renvoie son job_id. Sinon reserve la cle pour task_id.
+    """
+    try:
+        entry = dedup.lookup(key)
+        if entry is not None:
+            result = {**entry["result"], "deduplicated_from": entry["task_id"]}
+            celery_app.backend.mark_as_done(task_id, result)
+            return GenerationResponse(
+                job_id=task_id,
+                status="completed",
+                message=f"Résultat identique réutilisé (job {entry['task_id']})",
+            )
+        existing = dedup.claim(key, task_id)
+        if existing is not None:
+            return GenerationResponse(
+                job_id=existing,
+                status="queued",
+                message="Tâche identique déjà en file d'attente",
+            )
+    except Exception as e:
+        logger.warning("Deduplication indisponible, job publie: %s", e)
+    return None
+
+
+def _release_dedup(key: str, task_id: str) -> None:
+    try:
+        dedup.release(key, task_id)
+    except Exception as e:
+        logger.warning("Reservation de deduplication non liberee: %s", e)
+
+
 @v1_router.post("/generate", response_model=GenerationResponse)
 async def create_generation_task(request: GenerationRequest):
     """
@@ -252,99 +554,82 @@ async def create_generation_task(request: GenerationRequest):
     - Paramètres configurables (steps, guidance_scale, seed)
     - Style transfer (IP-Adapter)
 
-    Retourne immédiatement un job_id pour polling.
+    Retourne immédiatement un job_id pour polling. Avec une seed explicite,
+    une requête identique déjà traitée est resservie sans GPU (status
+    "completed") et une requête identique en cours renvoie son job_id.
     """
     try:
-        # Valider le modèle demandé
-        if request.model not in AVAILABLE_MODELS:
-            raise ImagenAPIError(
-                code="MODEL_NOT_FOUND",
-                message=f"Model '{request.model}' not available",
-                detail=f"Available models: {list(AVAILABLE_MODELS.keys())}",
-                status=404,
-            )
-
-        # Valider les LoRAs demandés
-        all_loras = get_all_loras()
-        for lora_req in request.loras:
-            if lora_req.name not in all_loras:
-                raise ImagenAPIError(
-                    code="LORA_NOT_FOUND",
-                    message=f"LoRA '{lora_req.name}' not available",
-                    detail=f"Available LoRAs: {list(all_loras.keys())}",
-                    status=404,
-                )
-
-        # Valider les references et resoudre les chemins
-        resolved_refs = []
-        prompt = request.prompt
-        negative_prompt = request.negative_prompt or ""
-
-        if request.references and request.ip_strength > 0:
-            raise ImagenAPIError(
-                code="INVALID_PARAMETERS",
-                message="Cannot use both 'references' and 'ip_strength'",
-                detail="Use 'references' instead of 'ip_strength'.",
-                status=422,
-            )
+        job = await run_blocking("files", _prepare_job, request)
+        task_id = str(uuid.uuid4())
+        dedup_key = await run_blocking("files", _dedup_key, request, job)
+        if dedup_key:
+            reused = await run_blocking("redis", _deduplicate, dedup_key, task_id)
+            if reused is not None:
+                return reused
+
+        try:
+            total_pending = await run_blocking("redis", _check_queue, [task_id])
+            await run_blocking("redis", _submit_job, job, task_id)
+        except Exception:
+            if dedup_key:
+                await run_blocking("redis", _release_dedup, dedup_key, task_id)
+            raise
 
-        if request.references:
-            try:
-                resolved_refs = ReferenceManager.resolve_references(
-                    [ReferenceRequest(entity=r.entity, types=r.types, strength=r.strength)
-                     for r in request.references]
-                )
-            except ValueError as e:
-                raise ImagenAPIError(
-                    code="REFERENCE_NOT_FOUND",
-                    message="Reference resolution failed",
-                    detail=str(e),
-                    status=404,
-                )
-
-            # Auto-injection fond blanc pour references de type character
-            has_character_ref = any(r.get("category") == "character" for r in resolved_refs)
-            if has_character_ref:
-                if "white background" not in prompt.lower():
-                    prompt = f"{prompt}, white background, simple background"
-                if "complex background" not in negative_prompt.lower():
-                    negative_prompt = f"{negative_prompt}, complex background, detailed background"
-
-        # Vérifier queue (protection contre burst CLI)
-        inspector = celery_app.control.inspect()
-        active = inspector.active() or {}
-        scheduled = inspector.scheduled() or {}
-
-        total_pending = sum(len(t) for t in {**active, **scheduled}.values())
-
-        if total_pending >= MAX_QUEUE_SIZE:
-            raise ImagenAPIError(
-                code="QUEUE_FULL",
-                message="Generation queue is saturated",
-                detail=f"Current queue size: {total_pending}/{MAX_QUEUE_SIZE}. Retry after a few minutes.",
-                status=503,
-            )
+        return GenerationResponse(
+            job_id=task_id,
+            status="queued",
+            message=f"Tâche en file d'attente. Position estimée: {total_pending + 1}",
+        )
 
-        # Soumission tâche avec TOUS les paramètres
-        task = generate_image_task.delay(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            model=request.model,
-            loras=[lora.dict() for lora in request.loras],
-            steps=request.steps,
-            guidance_scale=request.guidance_scale,
-            seed=request.seed,
-            ip_strength=request.ip_strength,
-            references=[
-                {"path": r["path"], "strength": r["strength"], "embedding_path": r.get("embedding_path")}
-                for r in resolved_refs
-            ],
+    except ImagenAPIError:
+        raise
+    except Exception as e:
+        raise ImagenAPIError(
+            code="INTERNAL_ERROR",
+            message="Internal server error",
+            detail=str(e),
+            status=500,
         )
 
-        return GenerationResponse(
-            job_id=task.id,
+
+@v1_router.post("/generate/batch", response_model=BatchGenerationResponse)
+async def create_generation_batch(request: BatchGenerationRequest):
+    """
+    Crée plusieurs tâches de génération en une requête.
+
+    Chaque item garde son propre job_id et son propre résultat. Les items
+    compatibles (même modèle, LoRAs, steps, CFG, sans references) sont
+    exécutés par le worker dans un seul forward UNet. Tout ou rien : si un
+    item est invalide ou si la file est pleine, aucun job n'est créé ; si la
+    publication échoue en cours de lot, les jobs déjà publiés sont révoqués
+    et retirés (batching, scheduler, file) avant l'erreur 500.
+    """
+    try:
+        jobs = await run_blocking("files", lambda: [_prepare_job(item) for item in request.items])
+        task_ids = [str(uuid.uuid4()) for _ in jobs]
+        total_pending = await run_blocking("redis", _check_queue, task_ids)
+
+        responses = []
+        for index, (job, task_id) in enumerate(zip(jobs, task_ids)):
+            try:
+                await run_blocking("redis", _submit_job, job, task_id)
+            except Exception:
+                # Le client ne recevra aucun job_id : rien du lot ne doit s'exécuter
+                for published_id in task_ids[:index]:
+                    await run_blocking("redis", _cancel_published_job, published_id)
+                for pending_id in task_ids[index + 1:]:
+                    await run_blocking("redis", admission.release, pending_id)
+                raise
+            responses.append(GenerationResponse(
+                job_id=task_id,
+                status="queued",
+                message=f"Tâche en file d'attente. Position estimée: {total_pending + index + 1}",
+            ))
+
+        return BatchGenerationResponse(
+            jobs=responses,
             status="queued",
-            message=f"Tâche en file d'attente. Position estimée: {total_pending + 1}",
+            message=f"{len(responses)} tâches en file d'attente",
         )
 
     except ImagenAPIError:
@@ -358,15 +643,26 @@ async def create_generation_task(request: GenerationRequest):
         )
 
 
+def _task_snapshot(job_id: str) -> Dict:
+    """État Celery d'un job (lectures Redis bloquantes, exécuté hors boucle)"""
+    task_result = AsyncResult(job_id, app=celery_app)
+    state = task_result.state
+    return {
+        "state": state,
+        "result": task_result.result,
+        "info": task_result.info if state == "PROGRESS" else None,
+    }
+
+
 @v1_router.get("/status/{job_id}")
 async def get_job_status(job_id: str):
     """
     Récupère le statut d'une génération
     """
-    task_result = AsyncResult(job_id, app=celery_app)
+    task = await run_blocking("redis", _task_snapshot, job_id)
 
     # Job doesn't exist (PENDING with no result means never submitted)
-    if task_result.state == "PENDING" and not task_result.result:
+    if task["state"] == "PENDING" and not task["result"]:
         raise ImagenAPIError(
             code="JOB_NOT_FOUND",
             message="Job not found",
@@ -374,26 +670,245 @@ async def get_job_status(job_id: str):
             status=404,
         )
 
-    response = {"job_id": job_id, "status": task_result.status, "result": None}
+    response = {"job_id": job_id, "status": task["state"], "result": None}
 
-    if task_result.status == "SUCCESS":
-        response["result"] = task_result.result
-    elif task_result.status == "FAILURE":
-        response["error"] = str(task_result.result)
-    elif task_result.status == "PROGRESS":
-        response["meta"] = task_result.info
+    if task["state"] == "SUCCESS":
+        response["result"] = task["result"]
+    elif task["state"] == "FAILURE":
+        response["error"] = str(task["result"])
+    elif task["state"] == "PROGRESS":
+        response["meta"] = task["info"]
 
     return response
 
 
+def _current_event(job_id: str) -> Optional[Dict]:
+    """
+    Dernier événement connu d'un job, reconstruit depuis Celery et la file
+    d'admission si le worker n'a encore rien publié. None si le job n'existe pas.
+    """
+    event = events.last(job_id)
+    if event is not None:
+        return event
+
+    task = _task_snapshot(job_id)
+    if task["state"] == "SUCCESS":
+        return make_event(job_id, "result", task["result"])
+    if task["state"] == "FAILURE":
+        return make_event(job_id, "error", {"error": str(task["result"])})
+    if task["state"] == "PROGRESS":
+        return make_event(job_id, "progress", task["info"])
+
+    position = admission.position(job_id)
+    if position is None:
+        return None
+    return make_event(job_id, "queued", {"position": position})
+
+
+def _job_not_found(job_id: str) -> ImagenAPIError:
+    return ImagenAPIError(
+        code="JOB_NOT_FOUND",
+        message="Job not found",
+        detail=f"No job with ID '{job_id}' exists.",
+        status=404,
+    )
+
+
+@v1_router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    Flux Server-Sent Events d'un job : queued, progress, puis result ou error.
+    Remplace le polling de /v1/status ; un commentaire keepalive est envoyé
+    toutes les 15s tant que le job n'émet rien.
+    """
+    if await run_blocking("redis", _current_event, job_id) is None:
+        raise _job_not_found(job_id)
+
+    async def initial():
+        return await run_blocking("redis", _current_event, job_id)
+
+    async def body():
+        async for event in events.stream(job_id, initial):
+            yield format_sse(event)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@v1_router.websocket("/jobs/{job_id}/ws")
+async def job_events_websocket(websocket: WebSocket, job_id: str):
+    """
+    Mêmes événements que /events en JSON sur WebSocket.
+    Le middleware HTTP ne voit pas les WebSockets : la clé est vérifiée ici
+    (header X-API-Key ou paramètre api_key pour les navigateurs).
+    """
+    provided_key = websocket.headers.get("X-API-Key") or websocket.query_params.get("api_key", "")
+    if await run_blocking("files", _api_key_error, provided_key):
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    if await run_blocking("redis", _current_event, job_id) is None:
+        error = _job_not_found(job_id)
+        await websocket.send_json(
+            {"error": {"code": error.code, "message": error.message, "detail": error.detail, "status": error.status}}
+        )
+        await websocket.close(code=1008)
+        return
+
+    async def initial():
+        return await run_blocking("redis", _current_event, job_id)
+
+    try:
+        async for event in events.stream(job_id, initial):
+            await websocket.send_json(event if event is not None else {"type": "keepalive"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
+OutputFormat = Literal["png", "webp", "jpeg", "avif"]
+
+
+def _requested_format(filename: str, output_format: Optional[str], quality: Optional[int]):
+    """(format, qualité) servis ; qualité None = fichier d'origine ou défaut du format"""
+    output_format = output_format or format_of(filename)
+    if output_format == "png":
+        quality = None
+    return output_format, quality
+
+
+def _image_etag(digest: str, filename: str, output_format: str, quality: Optional[int]) -> str:
+    """ETag fort : hash du fichier, ou de (hash, format, qualité) pour un transcodage"""
+    if output_format == format_of(filename) and quality is None:
+        return strong_etag(digest)
+    return strong_etag(hashlib.sha256(f"{digest}:{output_format}:{quality}".encode("utf-8")).hexdigest())
+
+
+def _thumbnail_etag(digest: str, size: int) -> str:
+    """ETag fort d'une miniature : hash de l'original, taille et qualité"""
+    return strong_etag(hashlib.sha256(f"{digest}:w{size}:q{THUMBNAIL_QUALITY}".encode("utf-8")).hexdigest())
+
+
+async def _image_response(
+    request: Request,
+    filename: str,
+    file_path,
+    output_format: str,
+    quality: Optional[int],
+    etag: str,
+    headers: Optional[Dict] = None,
+) -> Response:
+    """
+    Réponse fichier d'une image (Range, validateurs), transcodée si un autre
+    format (ou une autre qualité) est demandé. Les transcodages sont mis en
+    cache (app.derivatives).
+    """
+    if output_format != format_of(filename) or quality is not None:
+        if output_format not in available_formats():
+            raise ImagenAPIError(
+                code="INVALID_PARAMETERS",
+                message=f"Output format '{output_format}' not available",
+                detail=f"Available formats: {available_formats()}",
+                status=422,
+            )
+        file_path = await run_blocking(
+            "images", derivatives.transcode, filename, file_path, output_format, quality
+        )
+        filename = f"{os.path.splitext(filename)[0]}.{extension(output_format)}"
+
+    stat_result = await run_blocking("files", os.stat, file_path)
+    return file_response(
+        request,
+        file_path,
+        stat_result,
+        media_type=media_type(output_format),
+        etag=etag,
+        filename=filename,
+        headers={**(headers or {}), "Cache-Control": IMMUTABLE},
+    )
+
+
+def _check_thumbnail_params(size: Optional[int], output_format: Optional[str], quality: Optional[int]) -> None:
+    if size is None:
+        return
+    if size not in THUMBNAIL_SIZES:
+        raise ImagenAPIError(
+            code="INVALID_PARAMETERS",
+            message=f"Thumbnail size {size} not available",
+            detail=f"Available sizes: {list(THUMBNAIL_SIZES)}",
+            status=422,
+        )
+    if output_format is not None or quality is not None:
+        raise ImagenAPIError(
+            code="INVALID_PARAMETERS",
+            message="Cannot use 'size' with 'format' or 'quality'",
+            detail="Thumbnails are always WebP.",
+            status=422,
+        )
+
+
+async def _thumbnail_response(
+    request: Request,
+    filename: str,
+    size: int,
+    headers: Optional[Dict] = None,
+    digest: Optional[str] = None,
+) -> Response:
+    """
+    Miniature WebP d'une image (créée par le worker ou à la première demande,
+    cache LRU app.derivatives). L'ETag dérive du hash du contenu de l'original
+    (`digest` s'il est connu, sinon lu dans l'index) : cache client longue durée.
+    Une miniature ne compte pas comme une récupération (rétention).
+    """
+    cache_headers = {**(headers or {}), "Cache-Control": f"public, max-age={THUMBNAIL_MAX_AGE}, immutable"}
+    if digest is not None:
+        etag = _thumbnail_etag(digest, size)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(etag, cache_headers)
+        file_path = await run_blocking("files", output_index.locate, filename)
+    else:
+        file_path, digest = await run_blocking("files", output_index.locate_with_hash, filename)
+    if file_path is None:
+        raise ImagenAPIError(
+            code="IMAGE_NOT_FOUND",
+            message="Image not found",
+            detail=f"File '{filename}' does not exist.",
+            status=404,
+        )
+    etag = _thumbnail_etag(digest, size)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag, cache_headers)
+
+    thumbnail = await run_blocking("images", derivatives.thumbnail, filename, file_path, size)
+    stat_result = await run_blocking("files", os.stat, thumbnail)
+    return file_response(
+        request, thumbnail, stat_result, media_type="image/webp", etag=etag, headers=cache_headers
+    )
+
+
 @v1_router.get("/download/{filename}")
-async def download_image(filename: str):
+async def download_image(
+    request: Request,
+    filename: str,
+    format: Optional[OutputFormat] = Query(None, description="Format de sortie (transcodage en cache)"),
+    quality: Optional[int] = Query(None, ge=1, le=100, description="Qualité des formats avec perte"),
+    size: Optional[int] = Query(None, description=f"Miniature WebP ({', '.join(map(str, THUMBNAIL_SIZES))} px)"),
+):
     """
-    Télécharge une image générée par son nom de fichier.
-    Marque l'image comme recuperee pour le nettoyage ulterieur.
+    Télécharge une image générée par son nom de fichier (Range, If-None-Match).
+    Marque l'image comme recuperee pour le nettoyage ulterieur (sauf miniature
+    et 304).
     """
-    file_path = OUTPUTS_DIR / filename
-    if not file_path.exists():
+    _check_thumbnail_params(size, format, quality)
+    if size is not None:
+        return await _thumbnail_response(request, filename, size)
+
+    file_path, digest = await run_blocking("files", output_index.locate_with_hash, filename)
+    if file_path is None:
         raise ImagenAPIError(
             code="IMAGE_NOT_FOUND",
             message="Image not found",
@@ -401,18 +916,30 @@ async def download_image(filename: str):
             status=404,
         )
 
-    _mark_retrieved(filename)
+    output_format, quality = _requested_format(filename, format, quality)
+    etag = _image_etag(digest, filename, output_format, quality)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag, {"Cache-Control": IMMUTABLE})
+
+    retrievals.mark(filename)
 
-    return FileResponse(file_path, media_type="image/png", filename=filename)
+    return await _image_response(request, filename, file_path, output_format, quality, etag)
 
 
 @v1_router.get("/image/{job_id}")
-async def get_image_by_job_id(job_id: str):
+async def get_image_by_job_id(
+    request: Request,
+    job_id: str,
+    format: Optional[OutputFormat] = Query(None, description="Format de sortie (transcodage en cache)"),
+    quality: Optional[int] = Query(None, ge=1, le=100, description="Qualité des formats avec perte"),
+    size: Optional[int] = Query(None, description=f"Miniature WebP ({', '.join(map(str, THUMBNAIL_SIZES))} px)"),
+):
     """
-    Récupère directement l'image PNG par job_id.
+    Récupère directement l'image par job_id.
 
-    Exemple: GET /image/7f2b0887-3cdf-46ff-b83b-ff7685ac5b23
-    Retourne: L'image PNG si la génération est terminée
+    Exemple: GET /image/7f2b0887-3cdf-46ff-b83b-ff7685ac5b23?format=webp
+    Retourne: L'image (format de la génération ou `format`) si la génération est terminée,
+    ou sa miniature WebP avec `size` (galerie)
 
     Status codes:
     - 200: Image retournée
@@ -420,10 +947,11 @@ async def get_image_by_job_id(job_id: str):
     - 404: Job non trouvé
     - 500: Erreur lors de la génération
     """
-    task_result = AsyncResult(job_id, app=celery_app)
+    _check_thumbnail_params(size, format, quality)
+    task = await run_blocking("redis", _task_snapshot, job_id)
 
     # Job n'existe pas
-    if task_result.state == "PENDING" and not task_result.result:
+    if task["state"] == "PENDING" and not task["result"]:
         raise ImagenAPIError(
             code="JOB_NOT_FOUND",
             message="Job not found",
@@ -432,29 +960,29 @@ async def get_image_by_job_id(job_id: str):
         )
 
     # Génération en cours
-    if task_result.state in ["PENDING", "PROGRESS", "STARTED"]:
+    if task["state"] in ["PENDING", "PROGRESS", "STARTED"]:
         raise HTTPException(
             status_code=202,
             detail={
                 "status": "processing",
                 "message": "Image en cours de génération",
-                "state": task_result.state,
-                "meta": task_result.info if task_result.state == "PROGRESS" else None
+                "state": task["state"],
+                "meta": task["info"],
             }
         )
 
     # Échec de génération
-    if task_result.state == "FAILURE":
+    if task["state"] == "FAILURE":
         raise ImagenAPIError(
             code="GENERATION_FAILED",
             message="Image generation failed",
-            detail=str(task_result.result),
+            detail=str(task["result"]),
             status=500,
         )
 
     # Succès - récupérer le fichier
-    if task_result.state == "SUCCESS":
-        result = task_result.result
+    if task["state"] == "SUCCESS":
+        result = task["result"]
         filename = result.get("filename")
 
         if not filename:
@@ -465,9 +993,23 @@ async def get_image_by_job_id(job_id: str):
                 status=500,
             )
 
-        file_path = OUTPUTS_DIR / filename
+        if size is not None:
+            return await _thumbnail_response(
+                request, filename, size, headers={"X-Job-ID": job_id}, digest=result.get("sha256")
+            )
 
-        if not file_path.exists():
+        # Hash écrit dans le résultat par le worker : 304 sans accès disque
+        output_format, quality = _requested_format(filename, format, quality)
+        digest = result.get("sha256")
+        if digest is not None:
+            etag = _image_etag(digest, filename, output_format, quality)
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                return not_modified(etag, {"X-Job-ID": job_id, "Cache-Control": IMMUTABLE})
+            file_path = await run_blocking("files", output_index.locate, filename)
+        else:
+            file_path, digest = await run_blocking("files", output_index.locate_with_hash, filename)
+
+        if file_path is None:
             raise ImagenAPIError(
                 code="IMAGE_NOT_FOUND",
                 message="Image not found",
@@ -475,13 +1017,20 @@ async def get_image_by_job_id(job_id: str):
                 status=404,
             )
 
+        etag = _image_etag(digest, filename, output_format, quality)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(etag, {"X-Job-ID": job_id, "Cache-Control": IMMUTABLE})
+
         # Marquer comme recuperee
-        _mark_retrieved(filename)
+        retrievals.mark(filename)
 
-        return FileResponse(
+        return await _image_response(
+            request,
+            filename,
             file_path,
-            media_type="image/png",
-            filename=filename,
+            output_format,
+            quality,
+            etag,
             headers={
                 "X-Job-ID": job_id,
                 "X-Generation-Metadata": str(result.get("metadata", {}))
@@ -492,22 +1041,58 @@ async def get_image_by_job_id(job_id: str):
     raise ImagenAPIError(
         code="INTERNAL_ERROR",
         message="Internal server error",
-        detail=f"Unknown task state: {task_result.state}",
+        detail=f"Unknown task state: {task['state']}",
         status=500,
     )
 
 
 @v1_router.get("/models")
-async def list_models():
+async def list_models(request: Request):
     """
     Liste les modèles disponibles avec leur état d'installation.
 
+    Réponse servie depuis l'index d'installation, avec ETag (304 si
+    If-None-Match correspond).
+
     Returns:
         Liste des modèles avec nom court, nom complet et statut
     """
+    # Vérification des mtimes de l'index : hors boucle d'événements
+    payload, etag = await run_blocking("scan", _cached_listing, "models", _list_models)
+    return _conditional_json(request, payload, etag)
+
+
+# Réponses de découverte par version de l'index : {nom: (version, payload, etag)}
+_listing_cache: Dict[str, tuple] = {}
+
+
+def _cached_listing(name: str, build) -> tuple:
+    """(payload, etag) d'un endpoint de découverte, reconstruit si l'index a changé"""
+    version = install_index.refresh()
+    cached = _listing_cache.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+
+    payload = build()
+    digest = hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    etag = f'"{name}-{digest}"'
+    _listing_cache[name] = (version, payload, etag)
+    return payload, etag
+
+
+def _conditional_json(request: Request, payload: Dict, etag: str):
+    """JSONResponse avec ETag, ou 304 si le client a déjà cette version"""
+    headers = {"Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag, headers)
+    return JSONResponse(content=payload, headers={**headers, "ETag": etag})
+
+
+def _list_models() -> Dict:
+    """Réponse de /v1/models (depuis l'index d'installation)"""
     models = []
     for model_id, config in AVAILABLE_MODELS.items():
-        is_installed = ModelManager.is_model_installed(
+        is_installed = install_index.is_model_installed(
             config.path,
             config.checkpoint_url
         )
@@ -524,7 +1109,7 @@ async def list_models():
         })
 
     # Infos sur les modèles installés
-    installed_models = ModelManager.get_installed_models()
+    installed_models = install_index.installed_models()
 
     return {
         "models": models,
@@ -535,18 +1120,26 @@ async def list_models():
 
 
 @v1_router.get("/loras")
-async def list_loras():
+async def list_loras(request: Request):
     """
     Liste les LoRAs disponibles avec leur référence et état d'installation.
 
+    Réponse servie depuis l'index d'installation, avec ETag (voir /v1/models).
+
     Returns:
         Liste des LoRAs avec référence (civitai-XXX, huggingface-XXX) et description
     """
+    payload, etag = await run_blocking("scan", _cached_listing, "loras", _list_loras)
+    return _conditional_json(request, payload, etag)
+
+
+def _list_loras() -> Dict:
+    """Réponse de /v1/loras (depuis l'index d'installation)"""
     all_loras = get_all_loras()
     loras = []
 
     for lora_id, config in all_loras.items():
-        is_installed = ModelManager.is_lora_installed(config.path)
+        is_installed = install_index.is_lora_installed(config.path)
 
         loras.append({
             "id": lora_id,
@@ -561,7 +1154,7 @@ async def list_loras():
         })
 
     # Infos sur les LoRAs installés
-    installed_loras = ModelManager.get_installed_loras()
+    installed_loras = install_index.installed_loras()
 
     return {
         "loras": loras,
@@ -586,7 +1179,9 @@ class CreateEntityRequest(BaseModel):
 async def create_reference_entity(entity_name: str, request: CreateEntityRequest):
     """Cree une nouvelle entite de reference (personnage, background, pose)."""
     try:
-        entity = ReferenceManager.create_entity(
+        entity = await run_blocking(
+            "files",
+            ReferenceManager.create_entity,
             name=entity_name,
             category=request.category,
             description=request.description,
@@ -625,7 +1220,10 @@ async def upload_reference_image(
     """Upload une image de reference pour une entite existante."""
     try:
         image_data = await file.read()
-        ref_image = ReferenceManager.upload_image(
+        # Décodage + resize PIL : pool dédié, n'occupe pas celui des statuts
+        ref_image = await run_blocking(
+            "images",
+            ReferenceManager.upload_image,
             entity_name=entity_name,
             subtype=subtype,
             image_data=image_data,
@@ -634,7 +1232,7 @@ async def upload_reference_image(
 
         # Lancer le calcul d'embedding en arriere-plan
         from app.worker import compute_embedding_task
-        embedding_task = compute_embedding_task.delay(entity_name, subtype)
+        embedding_task = await run_blocking("redis", compute_embedding_task.delay, entity_name, subtype)
 
         return {
             "entity": entity_name,
@@ -687,7 +1285,7 @@ async def list_references(category: Optional[str] = Query(default=None)):
             status=422,
         )
 
-    entities = ReferenceManager.list_entities(category=category)
+    entities = await run_blocking("files", ReferenceManager.list_entities, category=category)
 
     result = {}
     category_counts: Dict[str, int] = {c: 0 for c in REFERENCE_CATEGORIES}
@@ -714,7 +1312,7 @@ async def list_references(category: Optional[str] = Query(default=None)):
 @v1_router.get("/references/{entity_name}")
 async def get_reference_entity(entity_name: str):
     """Details d'une entite de reference avec toutes ses images."""
-    entity = ReferenceManager.get_entity(entity_name)
+    entity = await run_blocking("files", ReferenceManager.get_entity, entity_name)
     if not entity:
         raise ImagenAPIError(
             code="REFERENCE_NOT_FOUND",
@@ -750,7 +1348,7 @@ async def get_reference_entity(entity_name: str):
 async def delete_reference_entity(entity_name: str):
     """Supprime une entite et toutes ses images."""
     try:
-        images_count = ReferenceManager.delete_entity(entity_name)
+        images_count = await run_blocking("files", ReferenceManager.delete_entity, entity_name)
         return {
             "status": "deleted",
             "entity": entity_name,
@@ -769,7 +1367,7 @@ async def delete_reference_entity(entity_name: str):
 async def delete_reference_image(entity_name: str, subtype: str):
     """Supprime une image de reference specifique."""
     try:
-        ReferenceManager.delete_image(entity_name, subtype)
+        await run_blocking("files", ReferenceManager.delete_image, entity_name, subtype)
         return {
             "status": "deleted",
             "entity": entity_name,
@@ -814,12 +1412,17 @@ async def download_from_civitai(request: CivitaiDownloadRequest):
         output_dir = LORAS_CIVITAI_DIR / f"civitai_{request.model_id}"
 
         # Télécharger
-        downloaded_path = ModelManager.download_from_civitai(
+        downloaded_path = await run_blocking(
+            "downloads",
+            ModelManager.download_from_civitai,
             model_id=request.model_id,
             output_dir=output_dir,
             filename=request.filename
         )
 
+        # Fichier écrit en place : le mtime du dossier ne suffit pas à voir sa taille finale
+        install_index.invalidate()
+
         if not downloaded_path:
             raise ImagenAPIError(
                 code="DOWNLOAD_FAILED",
@@ -848,6 +1451,62 @@ async def download_from_civitai(request: CivitaiDownloadRequest):
         )
 
 
+@v1_router.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """Compteurs du scheduler par affinite (changements de modele evites, reports)"""
+    try:
+        return await run_blocking("redis", scheduler.stats)
+    except Exception as e:
+        raise ImagenAPIError(
+            code="INTERNAL_ERROR",
+            message="Scheduler stats unavailable",
+            detail=str(e),
+            status=500,
+        )
+
+
+@v1_router.get("/metrics/throughput")
+async def get_throughput_stats():
+    """Debit mesure du GPU (it/s) par modele, resolution, nombre de LoRAs et taille de batch"""
+    try:
+        return await run_blocking("redis", throughput.stats)
+    except Exception as e:
+        raise ImagenAPIError(
+            code="INTERNAL_ERROR",
+            message="Throughput stats unavailable",
+            detail=str(e),
+            status=500,
+        )
+
+
+@v1_router.get("/metrics/dedup")
+async def get_dedup_stats():
+    """Index de deduplication : entrees, hits, requetes coalescees, evictions"""
+    try:
+        return await run_blocking("redis", dedup.stats)
+    except Exception as e:
+        raise ImagenAPIError(
+            code="INTERNAL_ERROR",
+            message="Dedup stats unavailable",
+            detail=str(e),
+            status=500,
+        )
+
+
+@v1_router.get("/metrics/retention")
+async def get_retention_stats():
+    """Politique de retention, volume indexe, fichiers supprimes et octets recuperes par regle"""
+    try:
+        return await run_blocking("files", retention.stats)
+    except Exception as e:
+        raise ImagenAPIError(
+            code="INTERNAL_ERROR",
+            message="Retention stats unavailable",
+            detail=str(e),
+            status=500,
+        )
+
+
 @app.get("/health")
 async def health_check():
     """Healthcheck pour monitoring"""
@@ -855,9 +1514,24 @@ async def health_check():
         "status": "ok",
         "gpu_available": True,  # Simplifié pour l'exemple
         "queue_broker": "connected",
+        "io_pools": limiter_stats(),
+        "reference_cache": ReferenceManager.cache_stats(),
     }
 
 
+@app.on_event("startup")
+def start_retention():
+    """Nettoyage periodique de OUTPUTS_DIR (app.retention)"""
+    retention.start()
+
+
+@app.on_event("shutdown")
+def flush_retrievals():
+    """Arrete la retention et ecrit les recuperations encore en attente"""
+    retention.close()
+    retrievals.close()
+
+
 app.include_router(v1_router)
 
 
@@ -0,0 +1,201 @@
+"""
+Regroupement de jobs compatibles en un seul appel batch du pipeline.
+
+Un job est compatible avec un autre s'il partage modele, LoRAs (avec poids),
+steps, CFG et resolution, et n'utilise ni IP-Adapter ni seeds multiples.
+L'API publie le payload des jobs eligibles dans Redis; le worker qui demarre
+un job reclame jusqu'a BATCH_MAX_SIZE - 1 jobs compatibles et publie ensuite
+un resultat par job. Il n'attend (au plus BATCH_MAX_WAIT_SECONDS) que tant que
+des jobs compatibles arrivent : sans candidat, le job part seul immediatement.
+Quand le message Celery d'un job reclame arrive, la tache attend ce resultat
+tant que le worker proprietaire donne signe de vie (heartbeat), sinon elle
+genere le job elle-meme. Une fois l'image generee et son ecriture confiee au
+pool du proprietaire (hand_off), la tache se termine sans attendre.
+"""
+
+import json
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.config import (
+    BATCH_MAX_SIZE,
+    BATCH_MAX_WAIT_SECONDS,
+    BATCH_OWNER_HEARTBEAT_SECONDS,
+    BATCH_RESULT_TIMEOUT,
+    IMAGE_SIZE,
+)
+from app.redis_client import get_redis
+from app.scheduler import affinity_key
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "imagen:batch:pending"
+OWNER_KEY = "imagen:batch:owner:{job_id}"
+RESULT_KEY = "imagen:batch:result:{job_id}"
+ALIVE_KEY = "imagen:batch:alive:{owner_id}"
+HANDOFF_KEY = "imagen:batch:handoff:{job_id}"
+RESULT_TTL = 3600  # Aligne sur result_expires de Celery
+POLL_INTERVAL = 0.1
+WITHDRAWN = "-"  # proprietaire des jobs retires par l'API
+
+
+def batch_key(job: Dict) -> Optional[str]:
+    """Cle de compatibilite batch d'un job (None si non eligible)"""
+    if job.get("references") or job.get("ip_strength", 0) > 0 or job.get("seeds"):
+        return None
+    weights = ",".join(
+        f"{lora['name']}:{lora['weight']}"
+        for lora in sorted(job.get("loras") or [], key=lambda l: l["name"])
+    )
+    return (
+        f"{affinity_key(job['model'], job.get('loras'))}|{weights}|"
+        f"{job['steps']}|{job['guidance_scale']}|{IMAGE_SIZE[0]}x{IMAGE_SIZE[1]}"
+    )
+
+
+class BatchCollector:
+    """Publication (API) et reclamation (worker) des jobs batchables"""
+
+    def __init__(
+        self,
+        redis_client=None,
+        max_batch: int = BATCH_MAX_SIZE,
+        max_wait_seconds: float = BATCH_MAX_WAIT_SECONDS,
+        result_timeout: float = BATCH_RESULT_TIMEOUT,
+        heartbeat_seconds: int = BATCH_OWNER_HEARTBEAT_SECONDS,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self._redis = redis_client
+        self.max_batch = max_batch
+        self.max_wait_seconds = max_wait_seconds
+        self.result_timeout = result_timeout
+        self.heartbeat_seconds = heartbeat_seconds
+        self.clock = clock
+        self.sleep = sleep
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    def offer(self, job_id: str, job: Dict) -> bool:
+        """Publie le payload d'un job eligible (appele par l'API)"""
+        if self.max_batch <= 1 or batch_key(job) is None:
+            return False
+        self.redis.hset(PENDING_KEY, job_id, json.dumps(job))
+        return True
+
+    def claim(self, job_id: str, owner_id: str) -> bool:
+        """
+        Reclame un job pour owner_id. Atomique (SET NX) : un job n'est execute
+        que par un seul worker. Idempotent pour le meme owner (retries).
+        """
+        key = OWNER_KEY.format(job_id=job_id)
+        if self.redis.set(key, owner_id, nx=True, ex=RESULT_TTL):
+            self.redis.hdel(PENDING_KEY, job_id)
+            return True
+        return self.redis.get(key) == owner_id
+
+    def release(self, job_ids: List[str]) -> None:
+        """Rend des jobs reclames (echec du batch) : ils s'executeront seuls"""
+        for job_id in job_ids:
+            self.redis.delete(OWNER_KEY.format(job_id=job_id))
+
+    def heartbeat(self, owner_id: str) -> None:
+        """Signe de vie du worker qui execute un batch (etapes, ecriture)"""
+        self.redis.set(ALIVE_KEY.format(owner_id=owner_id), 1, ex=self.heartbeat_seconds)
+
+    def hand_off(self, job_ids: List[str]) -> None:
+        """
+        Images generees, ecriture confiee au pool du proprietaire : c'est lui
+        qui stockera le resultat (ou l'echec) de ces jobs.
+        """
+        for job_id in job_ids:
+            self.redis.set(HANDOFF_KEY.format(job_id=job_id), 1, ex=RESULT_TTL)
+
+    def is_handed_off(self, job_id: str) -> bool:
+        return self.redis.get(HANDOFF_KEY.format(job_id=job_id)) is not None
+
+    def withdraw(self, job_id: str) -> bool:
+        """
+        Retire un job jamais publie (echec de apply_async) : reclame au nom
+        d'aucun worker, il ne peut plus rejoindre un batch. False si un
+        worker l'a deja reclame.
+        """
+        return self.claim(job_id, WITHDRAWN)
+
+    def collect(self, job_id: str, job: Dict) -> List[Tuple[str, Dict]]:
+        """
+        Constitue le batch du job courant (deja reclame par lui-meme).
+        Attend au plus max_wait_seconds que le batch se remplisse.
+        """
+        batch = [(job_id, job)]
+        key = batch_key(job)
+        if key is None or self.max_batch <= 1:
+            return batch
+
+        deadline = self.clock() + self.max_wait_seconds
+        while True:
+            candidates = 0
+            for other_id, raw in self.redis.hgetall(PENDING_KEY).items():
+                if len(batch) >= self.max_batch:
+                    break
+                if other_id == job_id:
+                    continue
+                try:
+                    other = json.loads(raw)
+                except (TypeError, ValueError):
+                    self.redis.hdel(PENDING_KEY, other_id)
+                    continue
+                if batch_key(other) != key:
+                    continue
+                candidates += 1
+                if len(batch) == 1:
+                    self.heartbeat(job_id)  # avant la premiere reclamation
+                if self.claim(other_id, job_id):
+                    batch.append((other_id, other))
+
+            # Aucun job compatible en attente : inutile de retenir le GPU
+            if not candidates or len(batch) >= self.max_batch or self.clock() >= deadline:
+                break
+            self.sleep(POLL_INTERVAL)
+
+        if len(batch) > 1:
+            logger.info("Batch de %d jobs (%s)", len(batch), key)
+        return batch
+
+    def publish_result(self, job_id: str, result: Dict) -> None:
+        self.redis.set(RESULT_KEY.format(job_id=job_id), json.dumps(result), ex=RESULT_TTL)
+
+    def get_result(self, job_id: str) -> Optional[Dict]:
+        raw = self.redis.get(RESULT_KEY.format(job_id=job_id))
+        return json.loads(raw) if raw else None
+
+    def wait_result(self, job_id: str) -> Optional[Dict]:
+        """
+        Attend le resultat d'un job execute dans le batch d'un autre worker.
+        None si l'ecriture du job est confiee au pool du proprietaire
+        (is_handed_off : rien a attendre), si le batch a echoue ou si son
+        worker ne donne plus signe de vie (crash, arret force) : dans ces deux
+        derniers cas le job s'execute seul.
+        """
+        deadline = self.clock() + self.result_timeout
+        while self.clock() < deadline:
+            result = self.get_result(job_id)
+            if result is not None:
+                return result
+            if self.is_handed_off(job_id):
+                return None
+            owner = self.redis.get(OWNER_KEY.format(job_id=job_id))
+            if owner is None:
+                return None  # Batch en echec : le job a ete rendu
+            if owner != job_id and self.redis.get(ALIVE_KEY.format(owner_id=owner)) is None:
+                logger.warning("Worker du batch %s sans signe de vie, job %s execute seul", owner, job_id)
+                return None
+            self.sleep(POLL_INTERVAL * 5)
+        return None
+
+
+# Instance partagee (API: offer, worker: claim/collect/publish)
+batcher = BatchCollector()
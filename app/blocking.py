@@ -0,0 +1,42 @@
+"""
+Execution du travail bloquant des handlers async hors de la boucle
+d'evenements.
+
+Chaque type de travail a son propre limiteur de concurrence : un
+telechargement Civitai lent ou un gros upload occupe son pool sans bloquer
+les lectures de statut des autres clients.
+"""
+
+import functools
+from typing import Any, Callable, Dict
+
+from anyio import CapacityLimiter, to_thread
+
+from app.config import BLOCKING_IO_LIMITS
+
+_limiters: Dict[str, CapacityLimiter] = {}
+
+
+def _limiter(kind: str) -> CapacityLimiter:
+    # Cree a la premiere utilisation : un CapacityLimiter exige une boucle active
+    limiter = _limiters.get(kind)
+    if limiter is None:
+        limiter = _limiters[kind] = CapacityLimiter(BLOCKING_IO_LIMITS[kind])
+    return limiter
+
+
+async def run_blocking(kind: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Execute func(*args, **kwargs) dans un thread du pool `kind`.
+
+    kinds (BLOCKING_IO_LIMITS): redis, files, images, scan, downloads
+    """
+    return await to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=_limiter(kind))
+
+
+def limiter_stats() -> Dict[str, Dict[str, float]]:
+    """Occupation des pools (threads actifs / limite)"""
+    return {
+        kind: {"borrowed": limiter.borrowed_tokens, "total": limiter.total_tokens}
+        for kind, limiter in _limiters.items()
+    }
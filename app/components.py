@@ -0,0 +1,101 @@
+"""
+Registre de composants partages entre pipelines residents (VAE, tokenizers,
+schedulers). Un composant identique (meme source + meme empreinte) n'est
+charge qu'une fois et reutilise par tous les modeles base qui le declarent.
+"""
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from app.config import MODELS_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def source_fingerprint(source: str) -> str:
+    """
+    Empreinte d'une source de composant.
+
+    - fichier local: sha256 du contenu
+    - dossier local: hash des (nom, taille, mtime) des fichiers
+    - repo HuggingFace: commit resolu dans le cache (refs/main)
+    """
+    path = Path(source)
+    if path.is_file():
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    if path.is_dir():
+        digest = hashlib.sha256()
+        for item in sorted(path.rglob("*")):
+            if item.is_file():
+                st = item.stat()
+                digest.update(f"{item.relative_to(path)}:{st.st_size}:{st.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+    ref = MODELS_DIR / f"models--{source.replace('/', '--')}" / "refs" / "main"
+    if ref.exists():
+        return ref.read_text(encoding="utf-8").strip()
+    return "unresolved"
+
+
+def config_fingerprint(config: Dict) -> str:
+    """Empreinte d'un composant defini par sa seule config (schedulers)"""
+    content = json.dumps(dict(config), sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class ComponentRegistry:
+    """Composants charges indexes par (type, source, empreinte)"""
+
+    def __init__(self):
+        self._components: Dict[Tuple[str, str, str], Any] = {}
+        self.hits = 0
+        self.loads = 0
+
+    def __len__(self) -> int:
+        return len(self._components)
+
+    def get_or_load(
+        self,
+        kind: str,
+        source: str,
+        loader: Callable[[], Any],
+        fingerprint: Optional[str] = None,
+    ) -> Any:
+        if fingerprint is None:
+            fingerprint = source_fingerprint(source)
+        key = (kind, source, fingerprint)
+
+        component = self._components.get(key)
+        if component is not None:
+            self.hits += 1
+            logger.debug("Composant partage: %s %s", kind, source)
+            return component
+
+        component = loader()
+        self._components[key] = component
+        self.loads += 1
+        logger.debug("Composant charge: %s %s (%s)", kind, source, fingerprint[:12])
+        return component
+
+    def prune(self, pipes: Iterable[Any]) -> int:
+        """Oublie les composants qui ne sont plus utilises par aucun pipeline"""
+        in_use = set()
+        for pipe in pipes:
+            components = getattr(pipe, "components", None) or {}
+            in_use.update(id(component) for component in components.values())
+
+        stale = [key for key, component in self._components.items() if id(component) not in in_use]
+        for key in stale:
+            del self._components[key]
+        return len(stale)
+
+    def stats(self) -> Dict[str, int]:
+        return {"components": len(self._components), "hits": self.hits, "loads": self.loads}
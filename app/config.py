@@ -29,16 +29,118 @@ VAE_MODEL = (
 IP_ADAPTER_MODEL = "h94/IP-Adapter"
 IP_ADAPTER_SUBFOLDER = "sdxl_models"
 IP_ADAPTER_WEIGHT = "ip-adapter_sdxl.bin"
+# Une instance IP-Adapter par strength distincte (au-dela: strengths proches fusionnees)
+IP_ADAPTER_MAX_INSTANCES = int(os.getenv("IP_ADAPTER_MAX_INSTANCES", "3"))
+IP_EMBED_CACHE_MAX_ENTRIES = int(os.getenv("IP_EMBED_CACHE_MAX_ENTRIES", "64"))
 
 # Optimisation 2080 Ti (11Go)
 MAX_QUEUE_SIZE = 100
+ADMISSION_ENTRY_TTL = 6 * 3600  # Places de jobs jamais termines (worker tue) liberees apres 6h
+
+# Concurrence max du travail bloquant des handlers API, par type (threads)
+BLOCKING_IO_LIMITS = {
+    "redis": int(os.getenv("IO_LIMIT_REDIS", "32")),  # Statuts Celery, soumissions
+    "files": int(os.getenv("IO_LIMIT_FILES", "8")),  # metadata.json, tracker, FileResponse prep
+    "images": int(os.getenv("IO_LIMIT_IMAGES", "2")),  # Decodage/resize PIL (uploads, derives)
+    "scan": int(os.getenv("IO_LIMIT_SCAN", "1")),  # scan_cache_dir
+    "downloads": int(os.getenv("IO_LIMIT_DOWNLOADS", "2")),  # Telechargements Civitai
+}
 DEFAULT_STEPS = 30
 GUIDANCE_SCALE = 7.5
 IMAGE_SIZE = (1024, 1024)  # SDXL natif
 OFFLOAD_TO_CPU = True  # Critical pour 11Go VRAM
 
+# Pipelines gardes en RAM CPU (retour sur un modele recent sans rechargement disque)
+PIPELINE_CACHE_MAX_MODELS = int(os.getenv("PIPELINE_CACHE_MAX_MODELS", "2"))
+PIPELINE_CACHE_MAX_BYTES = int(float(os.getenv("PIPELINE_CACHE_MAX_GB", "16")) * 1024**3)
+
+# Adapters LoRA gardes charges par pipeline (LRU)
+LORA_CACHE_MAX_ADAPTERS = int(os.getenv("LORA_CACHE_MAX_ADAPTERS", "6"))
+LORA_CACHE_MAX_BYTES = int(float(os.getenv("LORA_CACHE_MAX_MB", "1536")) * 1024**2)
+
+# Fusion LoRA des combinaisons chaudes (poids UNet fusionnes gardes en RAM)
+LORA_FUSION_ENABLED = os.getenv("LORA_FUSION_ENABLED", "1") == "1"
+LORA_FUSION_MIN_USES = int(os.getenv("LORA_FUSION_MIN_USES", "3"))
+LORA_FUSION_MAX_COMBOS = int(os.getenv("LORA_FUSION_MAX_COMBOS", "3"))
+LORA_FUSION_MAX_BYTES = int(float(os.getenv("LORA_FUSION_MAX_GB", "4")) * 1024**3)
+
+# Cache des embeddings de prompt (Compel)
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "256"))
+PROMPT_CACHE_DISK_ENABLED = os.getenv("PROMPT_CACHE_DISK", "0") == "1"
+PROMPT_CACHE_DIR = MODELS_DIR / "cache" / "prompt_embeds"
+PROMPT_CACHE_MAX_DISK_ENTRIES = int(os.getenv("PROMPT_CACHE_MAX_DISK_ENTRIES", "5000"))
+
+# Index d'installation des modeles/LoRAs (/v1/models, /v1/loras)
+INSTALL_INDEX_FILE = MODELS_DIR / "cache" / "install_index.json"
+INSTALL_INDEX_CHECK_SECONDS = float(os.getenv("INSTALL_INDEX_CHECK_SECONDS", "10"))
+
+# Scheduler (regroupement des jobs par modele + LoRAs)
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+SCHEDULER_MAX_WAIT_SECONDS = int(os.getenv("SCHEDULER_MAX_WAIT_SECONDS", "180"))
+SCHEDULER_MAX_DEFERRALS = int(os.getenv("SCHEDULER_MAX_DEFERRALS", "10"))
+SCHEDULER_ENTRY_TTL = 6 * 3600  # Entrees orphelines purgees apres 6h
+
+# Batching (jobs compatibles executes dans un seul forward UNet)
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "2"))  # 2 x 1024x1024 tient en 11Go
+BATCH_MAX_WAIT_SECONDS = float(os.getenv("BATCH_MAX_WAIT_SECONDS", "0.5"))
+BATCH_RESULT_TIMEOUT = 600  # = task_time_limit
+# Un job reclame par un worker sans signe de vie depuis ce delai s'execute seul
+BATCH_OWNER_HEARTBEAT_SECONDS = int(os.getenv("BATCH_OWNER_HEARTBEAT_SECONDS", "60"))
+MAX_BATCH_REQUEST_ITEMS = 16
+MAX_IMAGES_PER_JOB = 8  # num_images / seeds par requete
+
+# Encodage des images generees (output_format/quality par requete)
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "6"))  # zlib 0-9 (defaut Pillow)
+WEBP_METHOD = int(os.getenv("WEBP_METHOD", "4"))  # 0 (rapide) - 6 (compact)
+
+# Ecriture des images hors du slot GPU (app.postprocess) ; 0 thread = ecriture dans la tache
+OUTPUT_WRITER_THREADS = int(os.getenv("OUTPUT_WRITER_THREADS", "2"))
+OUTPUT_WRITER_MAX_PENDING = int(os.getenv("OUTPUT_WRITER_MAX_PENDING", "8"))  # ecritures en attente avant blocage du GPU
+OUTPUT_WRITER_DRAIN_SECONDS = float(os.getenv("OUTPUT_WRITER_DRAIN_SECONDS", "60"))
+
+# Derives des images (transcodages a la demande, miniatures), eviction LRU
+DERIVATIVES_DIR = OUTPUTS_DIR / ".derivatives"
+DERIVATIVES_MAX_BYTES = int(os.getenv("DERIVATIVES_MAX_BYTES", str(2 * 1024**3)))
+
+# Miniatures WebP (plus grand cote en px) servies par /v1/image/{job_id}?size=
+THUMBNAIL_SIZES = (128, 256, 512)
+# Tailles creees par le worker a l'ecriture de l'image (les autres a la premiere demande)
+THUMBNAIL_EAGER_SIZES = tuple(
+    int(size) for size in os.getenv("THUMBNAIL_EAGER_SIZES", "256").split(",") if size.strip()
+)
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_MAX_AGE = int(os.getenv("THUMBNAIL_MAX_AGE", str(7 * 86400)))  # Cache-Control max-age
+
+# Deduplication des requetes deterministes (seed explicite)
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+DEDUP_TTL_SECONDS = int(os.getenv("DEDUP_TTL_SECONDS", "86400"))  # = retention des images non recuperees
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "10000"))
+DEDUP_INFLIGHT_TTL = 3600  # Attente en file + generation
+
+# Progression par etape de debruitage (ecritures Redis limitees a 1 par intervalle)
+PROGRESS_MIN_INTERVAL = float(os.getenv("PROGRESS_MIN_INTERVAL", "1.0"))
+
+# Etat de OUTPUTS_DIR : suivi des recuperations + index des fichiers (SQLite, WAL)
+OUTPUTS_STATE_DB_FILE = OUTPUTS_DIR / ".state.db"
+
+# Suivi des images recuperees (nettoyage de OUTPUTS_DIR)
+RETRIEVAL_DB_FILE = OUTPUTS_STATE_DB_FILE
+RETRIEVAL_LEGACY_FILE = OUTPUTS_DIR / ".retrieved.json"  # Ancien format, migre au demarrage
+RETRIEVAL_FLUSH_SECONDS = float(os.getenv("RETRIEVAL_FLUSH_SECONDS", "2.0"))
+RETRIEVAL_FLUSH_MAX_PENDING = 256  # Ecriture anticipee au-dela
+RETRIEVAL_COMPACT_SECONDS = float(os.getenv("RETRIEVAL_COMPACT_SECONDS", "3600"))
+
+# Retention des images generees (0 = regle desactivee)
+RETENTION_RETRIEVED_HOURS = float(os.getenv("RETENTION_RETRIEVED_HOURS", "1"))
+RETENTION_UNRETRIEVED_DAYS = float(os.getenv("RETENTION_UNRETRIEVED_DAYS", "1"))
+RETENTION_MAX_BYTES = int(os.getenv("RETENTION_MAX_BYTES", "0"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "300"))
+RETENTION_BATCH_SIZE = 500
+
 # References
-REFERENCE_METADATA_FILE = REFERENCE_DIR / "metadata.json"
+REFERENCE_DB_FILE = REFERENCE_DIR / "references.db"  # SQLite (WAL)
+REFERENCE_METADATA_FILE = REFERENCE_DIR / "metadata.json"  # Ancien format, migre au demarrage
+LEGACY_REFERENCE_IMAGE = REFERENCE_DIR / "electra_ref.png"  # ip_strength sans references
 REFERENCE_CATEGORIES = ["character", "background", "pose"]
 CATEGORY_SUBTYPES = {
     "character": ["front", "side", "back", "full_body", "detail"],
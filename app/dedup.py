@@ -0,0 +1,245 @@
+"""
+Deduplication des requetes de generation deterministes.
+
+Deux requetes avec la meme seed explicite, les memes parametres et les memes
+images de reference (contenu, pas chemin) produisent la meme image. L'API
+calcule une cle canonique (request_key) et:
+    - si un resultat existe encore dans OUTPUTS_DIR, le reutilise sans
+      passer par le GPU (nouveau job_id, resultat Celery ecrit directement)
+    - si un job identique est en file ou en cours, renvoie son job_id
+      (coalescence)
+Le worker enregistre le resultat sous la cle a la fin du job.
+
+Index Redis: une cle par resultat (TTL DEDUP_TTL_SECONDS) + un sorted set
+d'usage, tronque a DEDUP_MAX_ENTRIES (les moins recemment utilises d'abord).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.config import (
+    DEDUP_INFLIGHT_TTL,
+    DEDUP_MAX_ENTRIES,
+    DEDUP_TTL_SECONDS,
+    IMAGE_SIZE,
+)
+from app.output_index import output_index
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+RESULT_KEY = "imagen:dedup:result:{key}"
+INFLIGHT_KEY = "imagen:dedup:inflight:{key}"
+TASK_KEY = "imagen:dedup:task:{task_id}"
+USAGE_KEY = "imagen:dedup:usage"
+STATS_KEY = "imagen:dedup:stats"
+
+# A incrementer si le rendu d'une meme requete change (pipeline, scheduler...)
+KEY_VERSION = 1
+
+_hash_lock = threading.Lock()
+_hash_cache: Dict[Tuple[str, int, int], str] = {}
+_HASH_CACHE_MAX = 1024
+
+
+def content_hash(path: str) -> str:
+    """SHA-256 du contenu d'un fichier (memo par chemin, taille et mtime)"""
+    stat = os.stat(path)
+    memo_key = (path, stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        cached = _hash_cache.get(memo_key)
+    if cached is not None:
+        return cached
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    value = digest.hexdigest()
+    with _hash_lock:
+        if len(_hash_cache) >= _HASH_CACHE_MAX:
+            _hash_cache.clear()
+        _hash_cache[memo_key] = value
+    return value
+
+
+def request_key(job: Dict, legacy_reference: Optional[str] = None) -> str:
+    """
+    Cle canonique d'un job prepare (kwargs de generate_image_task). Les
+    references sont identifiees par le hash de leur contenu ; `legacy_reference`
+    est l'image utilisee par ip_strength sans references.
+    """
+    references = [
+        {"sha256": content_hash(ref["path"]), "strength": ref["strength"]}
+        for ref in job.get("references") or []
+    ]
+    if not references and job.get("ip_strength", 0) > 0 and legacy_reference:
+        if os.path.exists(legacy_reference):
+            references = [{"sha256": content_hash(legacy_reference), "legacy": True}]
+    canonical = {
+        "version": KEY_VERSION,
+        "size": list(IMAGE_SIZE),
+        "prompt": job["prompt"],
+        "negative_prompt": job["negative_prompt"],
+        "model": job["model"],
+        "loras": job.get("loras") or [],
+        "steps": job["steps"],
+        "guidance_scale": job["guidance_scale"],
+        "seed": job.get("seed"),
+        "seeds": job.get("seeds"),
+        "ip_strength": job.get("ip_strength", 0.0),
+        "references": references,
+        "output_format": job.get("output_format", "png"),
+        "quality": job.get("quality"),
+    }
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def result_filenames(result: Dict) -> List[str]:
+    """Fichiers produits par un job (image unique ou images d'un job multi-seeds)"""
+    names = [image["filename"] for image in result.get("images") or [] if image.get("filename")]
+    if result.get("filename") and result["filename"] not in names:
+        names.insert(0, result["filename"])
+    return names
+
+
+class RequestDeduplicator:
+    """Index des resultats par cle canonique + jobs identiques en cours"""
+
+    def __init__(
+        self,
+        redis_client=None,
+        ttl: int = DEDUP_TTL_SECONDS,
+        max_entries: int = DEDUP_MAX_ENTRIES,
+        inflight_ttl: int = DEDUP_INFLIGHT_TTL,
+        exists: Optional[Callable[[str], bool]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._redis = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.inflight_ttl = inflight_ttl
+        self._exists = exists
+        self.clock = clock
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    def exists(self, filename: str) -> bool:
+        if self._exists is not None:
+            return self._exists(filename)
+        return output_index.locate(filename) is not None
+
+    # -------------------------------------------------------------------- API
+
+    def lookup(self, key: str) -> Optional[Dict]:
+        """{task_id, result} d'un job identique termine dont les fichiers existent encore"""
+        raw = self.redis.get(RESULT_KEY.format(key=key))
+        if raw is None:
+            self.redis.hincrby(STATS_KEY, "misses", 1)
+            return None
+        entry = json.loads(raw)
+        if not all(self.exists(name) for name in result_filenames(entry["result"])):
+            # Supprime par la retention : l'entree ne sert plus
+            self._drop(key)
+            self.redis.hincrby(STATS_KEY, "misses", 1)
+            return None
+        pipe = self.redis.pipeline()
+        pipe.zadd(USAGE_KEY, {key: self.clock()})
+        pipe.hincrby(STATS_KEY, "hits", 1)
+        pipe.execute()
+        return entry
+
+    def claim(self, key: str, task_id: str) -> Optional[str]:
+        """
+        Reserve la cle pour `task_id`. Retourne le job_id d'un job identique
+        deja en file ou en cours (coalescence), None si `task_id` doit etre publie.
+        """
+        inflight = INFLIGHT_KEY.format(key=key)
+        for _ in range(2):
+            if self.redis.set(inflight, task_id, nx=True, ex=self.inflight_ttl):
+                self.redis.set(TASK_KEY.format(task_id=task_id), key, ex=self.inflight_ttl)
+                return None
+            existing = self.redis.get(inflight)
+            if existing is not None:
+                self.redis.hincrby(STATS_KEY, "coalesced", 1)
+                return existing
+        return None
+
+    def release(self, key: str, task_id: str) -> None:
+        """Annule une reservation (publication du job echouee)"""
+        self._clear_inflight(key, task_id)
+
+    # ----------------------------------------------------------------- worker
+
+    def complete(self, task_id: str, result: Dict) -> bool:
+        """Enregistre le resultat d'un job reserve (signal task_success du worker)"""
+        key = self.redis.get(TASK_KEY.format(task_id=task_id))
+        if key is None:
+            return False
+        if isinstance(result, dict) and result.get("status") == "success":
+            now = self.clock()
+            pipe = self.redis.pipeline()
+            pipe.set(RESULT_KEY.format(key=key), json.dumps({"task_id": task_id, "result": result}), ex=self.ttl)
+            pipe.zadd(USAGE_KEY, {key: now})
+            pipe.hincrby(STATS_KEY, "stored", 1)
+            pipe.execute()
+            self._evict(now)
+        self._clear_inflight(key, task_id)
+        return True
+
+    def abandon(self, task_id: str) -> None:
+        """Job reserve en echec : les requetes identiques suivantes relancent"""
+        key = self.redis.get(TASK_KEY.format(task_id=task_id))
+        if key is not None:
+            self._clear_inflight(key, task_id)
+
+    # -------------------------------------------------------------- interne
+
+    def _clear_inflight(self, key: str, task_id: str) -> None:
+        inflight = INFLIGHT_KEY.format(key=key)
+        if self.redis.get(inflight) == task_id:
+            self.redis.delete(inflight)
+        self.redis.delete(TASK_KEY.format(task_id=task_id))
+
+    def _drop(self, key: str) -> None:
+        pipe = self.redis.pipeline()
+        pipe.delete(RESULT_KEY.format(key=key))
+        pipe.zrem(USAGE_KEY, key)
+        pipe.execute()
+
+    def _evict(self, now: float) -> None:
+        # Entrees expirees (TTL) : leur dernier usage precede forcement now - ttl
+        self.redis.zremrangebyscore(USAGE_KEY, "-inf", now - self.ttl)
+        excess = self.redis.zcard(USAGE_KEY) - self.max_entries
+        if excess <= 0:
+            return
+        evicted = [member for member, _ in self.redis.zpopmin(USAGE_KEY, excess)]
+        pipe = self.redis.pipeline()
+        for key in evicted:
+            pipe.delete(RESULT_KEY.format(key=key))
+        pipe.hincrby(STATS_KEY, "evicted", len(evicted))
+        pipe.execute()
+
+    def stats(self) -> Dict:
+        counters = {key: int(value) for key, value in self.redis.hgetall(STATS_KEY).items()}
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "entries": self.redis.zcard(USAGE_KEY),
+            "hits": hits,
+            "misses": misses,
+            "coalesced": counters.get("coalesced", 0),
+            "stored": counters.get("stored", 0),
+            "evicted": counters.get("evicted", 0),
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+
+
+dedup = RequestDeduplicator()
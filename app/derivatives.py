@@ -0,0 +1,201 @@
+"""
+Cache disque des fichiers derives d'une image de OUTPUTS_DIR (transcodages a
+la demande, miniatures) sous OUTPUTS_DIR/.derivatives.
+
+Un derive est identifie par (nom de l'image, variante, extension) ; il est
+regenere si l'original est plus recent. Eviction LRU quand le cache depasse
+DERIVATIVES_MAX_BYTES.
+
+Le worker (miniatures a l'ecriture) et l'API (transcodages, lectures) partagent
+le dossier : le disque est la seule source de verite. Un acces remet le mtime
+du derive a jour (ordre LRU commun aux processus) et l'eviction reparcourt le
+dossier avant de supprimer. Chaque processus ne garde qu'une estimation de la
+taille pour decider quand reparcourir (au plus tard apres RESCAN_SECONDS).
+La retention supprime les derives d'une image avec elle (discard).
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from app.config import DERIVATIVES_DIR, DERIVATIVES_MAX_BYTES, THUMBNAIL_QUALITY
+from app.encoding import extension, save_image
+
+logger = logging.getLogger(__name__)
+
+RESCAN_SECONDS = 60  # Ecritures des autres processus prises en compte apres ce delai
+
+
+class DerivativeCache:
+    """Derives d'images avec eviction LRU par taille totale (etat sur disque)"""
+
+    def __init__(
+        self,
+        cache_dir: Path = DERIVATIVES_DIR,
+        max_bytes: int = DERIVATIVES_MAX_BYTES,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._bytes: Optional[int] = None  # estimation depuis le dernier parcours
+        self._scanned_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path_for(self, filename: str, variant: str, ext: str) -> Path:
+        shard = hashlib.sha1(filename.encode("utf-8")).hexdigest()[:2]
+        return self.cache_dir / shard / f"{Path(filename).stem}.{variant}.{ext}"
+
+    def get_or_create(
+        self,
+        filename: str,
+        variant: str,
+        ext: str,
+        source: Path,
+        render: Callable[[Path, Path], None],
+    ) -> Path:
+        """
+        Derive de `source` ; `render(source, target)` l'ecrit s'il manque ou si
+        l'original a change depuis.
+        """
+        target = self.path_for(filename, variant, ext)
+        try:
+            if target.stat().st_mtime >= source.stat().st_mtime:
+                os.utime(target)  # usage visible des autres processus (LRU)
+                with self._lock:
+                    self.hits += 1
+                return target
+        except FileNotFoundError:
+            pass
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f".{target.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            render(source, tmp)
+            os.replace(tmp, target)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        self._register(target, target.stat().st_size)
+        return target
+
+    def transcode(self, filename: str, source: Path, output_format: str, quality: Optional[int]) -> Path:
+        """Copie de l'image dans un autre format (variante q{quality} ou "default")"""
+
+        def render(src: Path, dst: Path) -> None:
+            with Image.open(src) as image:
+                save_image(image, dst, output_format, quality)
+
+        variant = f"q{quality}" if quality else "default"
+        return self.get_or_create(filename, variant, extension(output_format), source, render)
+
+    def thumbnail(
+        self,
+        filename: str,
+        source: Path,
+        size: int,
+        image: Optional[Image.Image] = None,
+    ) -> Path:
+        """
+        Miniature WebP (plus grand cote <= size, proportions conservees).
+        `image` (deja en memoire a l'ecriture) evite de relire l'original.
+        """
+
+        def render(src: Path, dst: Path) -> None:
+            # thumbnail() ne fait que reduire ; en place, d'ou la copie de `image`
+            with (image.copy() if image is not None else Image.open(src)) as thumb:
+                thumb.thumbnail((size, size), Image.LANCZOS)
+                save_image(thumb, dst, "webp", THUMBNAIL_QUALITY)
+
+        return self.get_or_create(filename, f"w{size}", "webp", source, render)
+
+    def discard(self, filename: str) -> int:
+        """Supprime tous les derives d'une image, retourne leur nombre"""
+        shard_dir = self.path_for(filename, "x", "x").parent
+        prefix = f"{Path(filename).stem}."
+        removed = 0
+        if not shard_dir.is_dir():
+            return 0
+        for path in shard_dir.glob(f"{prefix}*"):
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                if self._bytes is not None:
+                    self._bytes = max(0, self._bytes - size)
+            removed += 1
+        return removed
+
+    # -------------------------------------------------------------- interne
+
+    def _scan(self) -> List[Tuple[float, Path, int]]:
+        """Etat reel du cache : (mtime, chemin, taille), moins recemment utilises d'abord"""
+        found = []
+        if self.cache_dir.is_dir():
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.startswith("."):
+                        continue  # ecritures en cours
+                    path = Path(root) / name
+                    try:
+                        stat = path.stat()
+                    except FileNotFoundError:
+                        continue
+                    found.append((stat.st_mtime, path, stat.st_size))
+        found.sort()
+        return found
+
+    def _register(self, target: Path, size: int) -> None:
+        with self._lock:
+            self.misses += 1
+            if self._bytes is not None:
+                self._bytes += size
+            if (
+                self._bytes is not None
+                and self._bytes <= self.max_bytes
+                and self.clock() - self._scanned_at < RESCAN_SECONDS
+            ):
+                return
+            entries = self._scan()
+            total = sum(entry_size for _, _, entry_size in entries)
+            for _, path, entry_size in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == target:
+                    continue
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass  # deja evince par un autre processus
+                else:
+                    self.evictions += 1
+                total -= entry_size
+            self._bytes = total
+            self._scanned_at = self.clock()
+
+    def stats(self) -> Dict:
+        entries = self._scan()
+        with self._lock:
+            return {
+                "entries": len(entries),
+                "bytes": sum(size for _, _, size in entries),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+derivatives = DerivativeCache()
@@ -0,0 +1,101 @@
+"""
+Encodage des images generees : PNG (sans perte), WebP, JPEG, AVIF.
+
+PNG reste le format par defaut. Les formats avec perte prennent une qualite
+1-100 (defaut par format ci-dessous) ; pour PNG, l'effort de compression zlib
+est regle cote serveur (PNG_COMPRESS_LEVEL).
+
+AVIF n'est disponible que si Pillow sait l'ecrire (plugin pillow-avif-plugin
+ou Pillow >= 11.3) : voir available_formats().
+"""
+
+import io
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from PIL import Image
+
+from app.config import PNG_COMPRESS_LEVEL, WEBP_METHOD
+
+logger = logging.getLogger(__name__)
+
+# format API -> (format Pillow, extension, media type)
+FORMATS = {
+    "png": ("PNG", "png", "image/png"),
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "avif": ("AVIF", "avif", "image/avif"),
+}
+DEFAULT_QUALITY = {"webp": 90, "jpeg": 92, "avif": 75}
+
+_EXTENSIONS = {ext: name for name, (_, ext, _) in FORMATS.items()}
+_EXTENSIONS["jpeg"] = "jpeg"
+
+_avif_checked = False
+
+
+def _load_avif_plugin() -> None:
+    global _avif_checked
+    if _avif_checked:
+        return
+    _avif_checked = True
+    if "AVIF" in Image.SAVE:
+        return
+    try:
+        import pillow_avif  # noqa: F401  (enregistre le codec aupres de Pillow)
+    except ImportError:
+        logger.info("AVIF indisponible (pillow-avif-plugin non installe)")
+
+
+def available_formats() -> List[str]:
+    """Formats que ce processus sait ecrire"""
+    _load_avif_plugin()
+    Image.init()
+    return [name for name, (pil_format, _, _) in FORMATS.items() if pil_format in Image.SAVE]
+
+
+def extension(output_format: str) -> str:
+    return FORMATS[output_format][1]
+
+
+def media_type(output_format: str) -> str:
+    return FORMATS[output_format][2]
+
+
+def format_of(filename: str) -> str:
+    """Format d'un fichier d'apres son extension (png par defaut)"""
+    return _EXTENSIONS.get(Path(filename).suffix.lower().lstrip("."), "png")
+
+
+def save_options(output_format: str, quality: Optional[int] = None) -> Dict:
+    """Parametres Pillow de save() pour un format et une qualite"""
+    if output_format == "png":
+        return {"compress_level": PNG_COMPRESS_LEVEL}
+    quality = quality or DEFAULT_QUALITY[output_format]
+    if output_format == "webp":
+        return {"quality": quality, "method": WEBP_METHOD}
+    if output_format == "jpeg":
+        # Pas de sous-echantillonnage chroma en haute qualite (contours nets)
+        return {"quality": quality, "subsampling": 0 if quality >= 90 else 2}
+    return {"quality": quality}
+
+
+def save_image(
+    image: Image.Image,
+    target: Union[Path, io.BytesIO],
+    output_format: str = "png",
+    quality: Optional[int] = None,
+) -> None:
+    """Ecrit `image` dans `target` (chemin ou buffer) au format demande"""
+    if output_format == "avif":
+        _load_avif_plugin()
+    if output_format == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    image.save(target, FORMATS[output_format][0], **save_options(output_format, quality))
+
+
+def encode(image: Image.Image, output_format: str = "png", quality: Optional[int] = None) -> bytes:
+    buffer = io.BytesIO()
+    save_image(image, buffer, output_format, quality)
+    return buffer.getvalue()
@@ -0,0 +1,108 @@
+"""
+Flux d'evenements des jobs (Redis pub/sub) pour SSE et WebSocket.
+
+Le worker publie chaque etape (update_state) puis le resultat final sur
+imagen:job:{id}:events. Le dernier evenement est aussi garde dans
+imagen:job:{id}:last : un client qui s'abonne tard (ou apres la fin du job)
+recoit immediatement l'etat courant.
+
+Types d'evenements: queued, progress, result, error. Le flux se termine apres
+result ou error.
+"""
+
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from app.redis_client import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_KEY = "imagen:job:{job_id}:events"
+LAST_KEY = "imagen:job:{job_id}:last"
+EVENT_TTL = 3600  # Aligne sur result_expires de Celery
+FINAL_EVENTS = ("result", "error")
+HEARTBEAT_SECONDS = 15.0
+
+
+def make_event(job_id: str, event_type: str, data: Any) -> Dict:
+    return {"type": event_type, "job_id": job_id, "data": data, "ts": time.time()}
+
+
+def format_sse(event: Optional[Dict]) -> str:
+    """Evenement au format text/event-stream (None = keepalive)"""
+    if event is None:
+        return ": keepalive\n\n"
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+class JobEventBus:
+    """Publication (worker) et abonnement (API) aux evenements d'un job"""
+
+    def __init__(
+        self,
+        redis_client=None,
+        async_redis_client=None,
+        heartbeat_seconds: float = HEARTBEAT_SECONDS,
+    ):
+        self._redis = redis_client
+        self._async_redis = async_redis_client
+        self.heartbeat_seconds = heartbeat_seconds
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    @property
+    def async_redis(self):
+        return self._async_redis if self._async_redis is not None else get_async_redis()
+
+    def publish(self, job_id: str, event_type: str, data: Any) -> None:
+        raw = json.dumps(make_event(job_id, event_type, data), ensure_ascii=False, default=str)
+        self.redis.set(LAST_KEY.format(job_id=job_id), raw, ex=EVENT_TTL)
+        self.redis.publish(CHANNEL_KEY.format(job_id=job_id), raw)
+
+    def last(self, job_id: str) -> Optional[Dict]:
+        raw = self.redis.get(LAST_KEY.format(job_id=job_id))
+        return json.loads(raw) if raw else None
+
+    async def stream(
+        self,
+        job_id: str,
+        initial: Callable[[], Awaitable[Optional[Dict]]],
+    ) -> AsyncIterator[Optional[Dict]]:
+        """
+        Evenements du job jusqu'au resultat final (None = keepalive).
+
+        L'abonnement precede la lecture de l'etat courant : aucun evenement
+        publie entre les deux n'est perdu. `initial` fournit l'etat quand aucun
+        evenement n'a encore ete publie (job en file).
+        """
+        pubsub = self.async_redis.pubsub()
+        await pubsub.subscribe(CHANNEL_KEY.format(job_id=job_id))
+        try:
+            raw = await self.async_redis.get(LAST_KEY.format(job_id=job_id))
+            current = json.loads(raw) if raw else await initial()
+            if current is not None:
+                yield current
+                if current["type"] in FINAL_EVENTS:
+                    return
+
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=self.heartbeat_seconds
+                )
+                if message is None:
+                    yield None
+                    continue
+                event = json.loads(message["data"])
+                yield event
+                if event["type"] in FINAL_EVENTS:
+                    return
+        finally:
+            await pubsub.aclose()
+
+
+# Instance partagee (worker: publish, API: stream)
+events = JobEventBus()
@@ -0,0 +1,177 @@
+"""
+Chemin rapide LoRA fusionne pour les combinaisons (modele, LoRAs, poids) les
+plus utilisees.
+
+Les adapters PEFT dynamiques ajoutent un calcul a chaque step UNet. Pour une
+combinaison "chaude", les poids UNet fusionnes (base + delta LoRA) sont
+calcules une fois via fuse_lora(), copies en RAM CPU, puis les adapters sont
+desactives : le job tourne a la vitesse du modele base.
+
+Seules les couches touchees par les LoRAs sont conservees (poids fusionnes par
+combinaison + une copie des poids d'origine des couches encore utilisees, les
+deux comptes dans max_bytes). Quitter l'etat fusionne recopie les poids
+d'origine des couches modifiees : pas de derive fp16 liee a unfuse_lora().
+
+Les combinaisons avec des couches LoRA dans les text encoders restent en mode
+dynamique (les embeddings de prompt en dependent).
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def fusion_key(model_id: str, requested: List[Tuple[str, float, Any]]) -> str:
+    """Cle d'une combinaison : modele + (nom, poids) tries"""
+    parts = sorted(f"{name}:{float(weight)}" for name, weight, _ in requested)
+    return f"{model_id}|{','.join(parts)}"
+
+
+class LoRAFusion:
+    """Etat de fusion LoRA d'un pipeline resident + cache des poids fusionnes"""
+
+    def __init__(self, pipe: Any, max_combos: int, max_bytes: int, min_uses: int):
+        self.pipe = pipe
+        self.max_combos = max(1, max_combos)
+        self.max_bytes = max_bytes
+        self.min_uses = min_uses
+        self.uses: Dict[str, int] = {}
+        # key -> {nom du parametre base_layer: poids fusionne (CPU)}
+        self.fused: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # nom du parametre base_layer -> poids d'origine (CPU)
+        self.originals: Dict[str, Any] = {}
+        self.current: Optional[str] = None
+        self.current_names: List[str] = []
+        self.current_layers: List[str] = []
+        self.fusions = 0
+        self.hits = 0
+        self.restores = 0
+        self.evictions = 0
+
+    def record_use(self, key: str) -> bool:
+        """Compte une utilisation, retourne True si la combinaison est chaude"""
+        self.uses[key] = self.uses.get(key, 0) + 1
+        return key in self.fused or self.uses[key] >= self.min_uses
+
+    def is_eligible(self, adapter_names: List[str]) -> bool:
+        """Adapters charges et sans couches dans les text encoders"""
+        unet_adapters = getattr(self.pipe.unet, "peft_config", None) or {}
+        if any(name not in unet_adapters for name in adapter_names):
+            return False
+        for encoder_name in ("text_encoder", "text_encoder_2"):
+            encoder = getattr(self.pipe, encoder_name, None)
+            te_adapters = getattr(encoder, "peft_config", None) or {}
+            if any(name in te_adapters for name in adapter_names):
+                return False
+        return True
+
+    def _unet_params(self) -> Dict[str, Any]:
+        return dict(self.pipe.unet.named_parameters())
+
+    @staticmethod
+    def _base_names(params: Dict[str, Any], adapter_names: List[str]) -> List[str]:
+        """Parametres base_layer des modules portant un des adapters"""
+        names = set()
+        for adapter in adapter_names:
+            suffix = f".lora_A.{adapter}.weight"
+            for param_name in params:
+                if param_name.endswith(suffix):
+                    base = param_name[: -len(suffix)] + ".base_layer.weight"
+                    if base in params:
+                        names.add(base)
+        return sorted(names)
+
+    def enter(self, key: str, adapter_names: List[str], prepare: Callable[[], Any]) -> None:
+        """
+        Passe en etat fusionne pour la combinaison `key`.
+
+        `prepare` active les adapters avec leurs poids; il n'est appele que si
+        les poids fusionnes ne sont pas deja en cache.
+        """
+        if self.current == key:
+            return
+        self.leave()
+
+        params = self._unet_params()
+        weights = self.fused.get(key)
+        if weights is None:
+            prepare()
+            names = self._base_names(params, adapter_names)
+            self._snapshot_originals(params, names)
+            self.pipe.fuse_lora(fuse_text_encoder=False, adapter_names=adapter_names)
+            weights = {name: params[name].detach().to("cpu", copy=True) for name in names}
+            self.pipe.unfuse_lora(unfuse_text_encoder=False)
+            self._restore_originals(params, names)
+            self._store(key, weights)
+            self.fusions += 1
+            logger.info("Poids fusionnes calcules: %s (%d couches)", key, len(weights))
+        else:
+            self.fused.move_to_end(key)
+            self.hits += 1
+
+        self._snapshot_originals(params, list(weights))
+        for name, tensor in weights.items():
+            params[name].data.copy_(tensor)
+        self.current = key
+        self.current_names = list(adapter_names)
+        self.current_layers = list(weights)
+
+    def leave(self) -> None:
+        """Restaure les poids d'origine exacts"""
+        if self.current is None:
+            return
+        self._restore_originals(self._unet_params(), self.current_layers)
+        self.current = None
+        self.current_names = []
+        self.current_layers = []
+        self.restores += 1
+
+    def _restore_originals(self, params: Dict[str, Any], names: List[str]) -> None:
+        for name in names:
+            params[name].data.copy_(self.originals[name])
+
+    def _snapshot_originals(self, params: Dict[str, Any], names: List[str]) -> None:
+        # Appele uniquement hors etat fusionne : les poids sont ceux d'origine
+        for name in names:
+            if name not in self.originals:
+                self.originals[name] = params[name].detach().to("cpu", copy=True)
+
+    def _store(self, key: str, weights: Dict[str, Any]) -> None:
+        self.fused[key] = weights
+        self.fused.move_to_end(key)
+        while len(self.fused) > 1 and (
+            len(self.fused) > self.max_combos or self.total_bytes > self.max_bytes
+        ):
+            evicted, _ = self.fused.popitem(last=False)
+            self.uses.pop(evicted, None)
+            self._prune_originals()
+            self.evictions += 1
+            logger.info("Eviction poids fusionnes: %s", evicted)
+
+    def _prune_originals(self) -> None:
+        """Oublie les poids d'origine des couches qu'aucune combinaison n'utilise plus"""
+        used = set(self.current_layers)
+        for weights in self.fused.values():
+            used.update(weights)
+        for name in [name for name in self.originals if name not in used]:
+            del self.originals[name]
+
+    @property
+    def total_bytes(self) -> int:
+        tensors = [tensor for weights in self.fused.values() for tensor in weights.values()]
+        tensors.extend(self.originals.values())
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "current": self.current,
+            "cached": list(self.fused.keys()),
+            "total_bytes": self.total_bytes,
+            "original_layers": len(self.originals),
+            "fusions": self.fusions,
+            "hits": self.hits,
+            "restores": self.restores,
+            "evictions": self.evictions,
+        }
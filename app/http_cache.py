@@ -0,0 +1,136 @@
+"""
+Validateurs HTTP et requetes conditionnelles/partielles pour les images servies
+(/outputs, /v1/download, /v1/image).
+
+Les ETags sont forts : derives du SHA-256 du contenu, calcule par le worker a
+l'ecriture (app.output_index). Les noms d'images sont uniques et jamais
+reecrits, d'ou un Cache-Control immutable : un CDN ou reverse proxy devant
+/outputs peut garder les fichiers sans revalider.
+
+Range : une seule plage par requete (bytes=a-b, a-, -n). Plusieurs plages ou
+un en-tete invalide donnent la reponse complete (RFC 9110 autorise a ignorer
+Range) ; une plage hors du fichier donne 416.
+"""
+
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def strong_etag(digest: str) -> str:
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match (liste d'ETags, W/ ignore, ou *) correspond a `etag`"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(debut, fin incluse) de l'unique plage demandee, None = fichier complet"""
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if match is None:
+        return None  # plusieurs plages ou syntaxe non geree
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffixe : les n derniers octets
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+class FileRangeResponse(FileResponse):
+    """206 Partial Content : seule la plage [start, end] du fichier est envoyee"""
+
+    def __init__(self, path, start: int, end: int, size: int, **kwargs):
+        super().__init__(path, status_code=206, **kwargs)
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def not_modified(etag: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(status_code=304, headers={**(headers or {}), "ETag": etag})
+
+
+def file_response(
+    request: Request,
+    path,
+    stat_result: os.stat_result,
+    media_type: Optional[str] = None,
+    etag: Optional[str] = None,
+    filename: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    Reponse fichier avec validateurs : 304 si If-None-Match correspond, 206
+    pour une plage (If-Range respecte), 416 si la plage est hors du fichier.
+    """
+    headers = {**(headers or {}), "Accept-Ranges": "bytes"}
+    if etag is not None:
+        headers["ETag"] = etag
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(etag, headers)
+
+    size = stat_result.st_size
+    if_range = request.headers.get("if-range")
+    byte_range = None
+    if if_range is None or (etag is not None and if_range.strip() == etag):
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    kwargs = dict(
+        media_type=media_type, filename=filename, headers=headers,
+        stat_result=stat_result, method=request.method,
+    )
+    if byte_range is None or byte_range == (0, size - 1):
+        return FileResponse(path, **kwargs)
+    return FileRangeResponse(path, byte_range[0], byte_range[1], size, **kwargs)
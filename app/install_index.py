@@ -0,0 +1,274 @@
+"""
+Index d'installation des modeles et LoRAs pour /v1/models et /v1/loras.
+
+Le cache HuggingFace (scan_cache_dir) et le dossier des LoRAs Civitai sont
+scannes une fois, l'index est persiste dans INSTALL_INDEX_FILE et les
+endpoints repondent depuis la memoire.
+
+Fraicheur par mtime des dossiers, verifiee au plus toutes les
+INSTALL_INDEX_CHECK_SECONDS:
+    - cache HF : MODELS_DIR + arborescences snapshots/ de chaque repo
+      (un fichier telecharge = un lien ajoute dans snapshots/<revision>/).
+      Un changement relance scan_cache_dir.
+    - Civitai : un mtime par sous-dossier, seuls les dossiers modifies sont
+      rescannes.
+invalidate() force la verification (apres un telechargement par l'API).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from app.config import (
+    INSTALL_INDEX_CHECK_SECONDS,
+    INSTALL_INDEX_FILE,
+    LORAS_CIVITAI_DIR,
+    MODELS_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT = 1
+
+
+def _scan_cache_dir(models_dir: Path):
+    from huggingface_hub import scan_cache_dir
+
+    return scan_cache_dir(models_dir)
+
+
+def _mtime_ns(path: Path) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class InstallIndex:
+    """Etat d'installation en memoire, persiste et rafraichi par mtime"""
+
+    def __init__(
+        self,
+        models_dir: Path = MODELS_DIR,
+        civitai_dir: Path = LORAS_CIVITAI_DIR,
+        index_file: Optional[Path] = INSTALL_INDEX_FILE,
+        check_seconds: float = INSTALL_INDEX_CHECK_SECONDS,
+        scan: Callable = _scan_cache_dir,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.models_dir = models_dir
+        self.civitai_dir = civitai_dir
+        self.index_file = index_file
+        self.check_seconds = check_seconds
+        self._scan = scan
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._checked_at: Optional[float] = None
+        self.hf_scans = 0
+        self.civitai_scans = 0
+        # hf_fingerprint, hf: {repo_dir: {...}}, civitai: {abs_dir: {..., mtime_ns}}
+        self._data: Dict = self._load() or {"hf_fingerprint": None, "hf": {}, "civitai": {}}
+        self.version = self._compute_version()
+
+    # ---------------------------------------------------------------- refresh
+
+    def invalidate(self) -> None:
+        """
+        Force la verification a la prochaine lecture, avec rescan des dossiers
+        Civitai (un telechargement ecrit le fichier en place : le mtime du
+        dossier change a la creation, pas a la fin de l'ecriture).
+        """
+        with self._lock:
+            self._checked_at = None
+            for entry in self._data["civitai"].values():
+                entry["mtime_ns"] = None
+
+    def refresh(self) -> str:
+        """Met l'index a jour si un dossier a change, retourne sa version"""
+        with self._lock:
+            now = self.clock()
+            if self._checked_at is not None and now - self._checked_at < self.check_seconds:
+                return self.version
+            self._checked_at = now
+
+            changed = self._refresh_hf()
+            changed = self._refresh_civitai() or changed
+            if changed:
+                self.version = self._compute_version()
+                self._persist()
+            return self.version
+
+    def _hf_fingerprint(self) -> str:
+        entries = [("", _mtime_ns(self.models_dir))]
+        if self.models_dir.is_dir():
+            for repo_dir in sorted(self.models_dir.glob("models--*")):
+                for root, _, _ in os.walk(repo_dir / "snapshots"):
+                    entries.append((root, _mtime_ns(Path(root))))
+        return hashlib.sha1(repr(entries).encode("utf-8")).hexdigest()
+
+    def _refresh_hf(self) -> bool:
+        fingerprint = self._hf_fingerprint()
+        if fingerprint == self._data["hf_fingerprint"]:
+            return False
+
+        repos = {}
+        try:
+            cache_info = self._scan(self.models_dir)
+        except Exception as e:
+            # Cache absent ou illisible : rien d'installe, rescan au prochain changement
+            logger.warning("Scan du cache HF impossible: %s", e)
+            cache_info = None
+        self.hf_scans += 1
+
+        for repo in (cache_info.repos if cache_info is not None else []):
+            files = []
+            for revision in repo.revisions:
+                for file in revision.files:
+                    try:
+                        files.append(str(Path(file.file_path).relative_to(revision.snapshot_path)))
+                    except ValueError:
+                        files.append(Path(file.file_path).name)
+            repos[repo.repo_path.name] = {
+                "repo_id": repo.repo_path.name.replace("models--", "").replace("--", "/"),
+                "revisions": len(list(repo.revisions)),
+                "files": sorted(files),
+                "size": sum(
+                    sum(file.size_on_disk for file in revision.files)
+                    for revision in repo.revisions
+                ),
+                "num_files": sum(len(list(revision.files)) for revision in repo.revisions),
+            }
+
+        self._data["hf_fingerprint"] = fingerprint
+        self._data["hf"] = repos
+        return True
+
+    def _refresh_civitai(self) -> bool:
+        previous = self._data["civitai"]
+        current = {}
+        if self.civitai_dir.is_dir():
+            for item in self.civitai_dir.iterdir():
+                if not item.is_dir():
+                    continue
+                key = os.path.abspath(item)
+                mtime_ns = _mtime_ns(item)
+                entry = previous.get(key)
+                if entry is None or entry["mtime_ns"] != mtime_ns:
+                    entry = self._scan_civitai_dir(item, mtime_ns)
+                current[key] = entry
+
+        if current == previous:
+            return False
+        self._data["civitai"] = current
+        return True
+
+    def _scan_civitai_dir(self, item: Path, mtime_ns: Optional[int]) -> Dict:
+        self.civitai_scans += 1
+        safetensors = sorted(item.glob("*.safetensors"))
+        try:
+            path = str(item.relative_to(self.models_dir.parent))
+        except ValueError:
+            path = str(item)
+        return {
+            "path": path,
+            "mtime_ns": mtime_ns,
+            "files": [f.name for f in safetensors],
+            "size": sum(f.stat().st_size for f in safetensors),
+        }
+
+    # ------------------------------------------------------------ persistence
+
+    def _compute_version(self) -> str:
+        raw = json.dumps([self._data["hf"], self._data["civitai"]], sort_keys=True)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _load(self) -> Optional[Dict]:
+        if self.index_file is None or not self.index_file.exists():
+            return None
+        try:
+            data = json.loads(self.index_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning("Index d'installation illisible, reconstruction: %s", e)
+            return None
+        if data.get("format") != INDEX_FORMAT:
+            return None
+        return {key: data[key] for key in ("hf_fingerprint", "hf", "civitai")}
+
+    def _persist(self) -> None:
+        if self.index_file is None:
+            return
+        try:
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.index_file.with_suffix(".tmp")
+            tmp.write_text(json.dumps({"format": INDEX_FORMAT, **self._data}), encoding="utf-8")
+            os.replace(tmp, self.index_file)
+        except OSError as e:
+            logger.warning("Index d'installation non persiste: %s", e)
+
+    # ---------------------------------------------------------------- lookups
+
+    def is_model_installed(self, model_path: str, checkpoint_url: Optional[str] = None) -> bool:
+        """Meme semantique que ModelManager.is_model_installed, sans scan"""
+        self.refresh()
+        repo = self._data["hf"].get(f"models--{model_path.replace('/', '--')}")
+        if repo is None:
+            return False
+        if checkpoint_url:
+            return any(checkpoint_url in name for name in repo["files"])
+        return repo["revisions"] > 0
+
+    def is_lora_installed(self, lora_path: str) -> bool:
+        """Meme semantique que ModelManager.is_lora_installed, sans scan"""
+        if lora_path.startswith("./"):
+            self.refresh()
+            entry = self._data["civitai"].get(os.path.abspath(lora_path))
+            if entry is not None:
+                return bool(entry["files"])
+            # Dossier local hors de LORAS_CIVITAI_DIR : verification directe
+            local_path = Path(lora_path)
+            return local_path.exists() and any(local_path.glob("*.safetensors"))
+        return self.is_model_installed(lora_path)
+
+    def installed_models(self) -> List[Dict]:
+        """Format de ModelManager.get_installed_models"""
+        self.refresh()
+        return [
+            {
+                "repo_id": repo["repo_id"],
+                "size_gb": round(repo["size"] / (1024**3), 2),
+                "num_files": repo["num_files"],
+            }
+            for _, repo in sorted(self._data["hf"].items())
+        ]
+
+    def installed_loras(self) -> List[Dict]:
+        """Format de ModelManager.get_installed_loras"""
+        self.refresh()
+        installed = [
+            {
+                "source": "civitai",
+                "path": entry["path"],
+                "size_mb": round(entry["size"] / (1024**2), 1),
+                "files": entry["files"],
+            }
+            for _, entry in sorted(self._data["civitai"].items())
+            if entry["files"]
+        ]
+        for _, repo in sorted(self._data["hf"].items()):
+            if "lora" in repo["repo_id"].lower():
+                installed.append({
+                    "source": "huggingface",
+                    "reference": f"huggingface-{repo['repo_id']}",
+                    "size_mb": round(repo["size"] / (1024**2), 1),
+                    "num_files": repo["num_files"],
+                })
+        return installed
+
+
+# Instance partagee par l'API
+install_index = InstallIndex()
@@ -0,0 +1,169 @@
+"""
+Embeddings IP-Adapter pre-calcules pour les images de reference.
+
+L'embedding (sortie de l'encodeur CLIP image de l'IP-Adapter, + embedding
+negatif) est calcule une fois par image et stocke a cote d'elle
+({subtype}.pt). La generation passe ces tenseurs en ip_adapter_image_embeds
+au lieu de re-encoder l'image a chaque job.
+
+Un .pt n'est valide que pour l'encodeur et la version de l'image qui l'ont
+produit (empreinte encodeur + mtime de l'image) : sinon il est recalcule.
+"""
+
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (image_embeds, negative_image_embeds), tenseurs CPU
+Embeds = Tuple[Any, Any]
+
+
+def _torch_save(obj: Any, path: Path) -> None:
+    import torch
+
+    torch.save(obj, path)
+
+
+def _torch_load(path: Path) -> Any:
+    import torch
+
+    return torch.load(path, map_location="cpu")
+
+
+def embedding_path_for(image_path: str) -> Path:
+    """Chemin du .pt d'une image de reference ({subtype}.png -> {subtype}.pt)"""
+    return Path(image_path).with_suffix(".pt")
+
+
+def group_by_strength(
+    references: List[Tuple[str, float]], max_groups: int
+) -> List[Tuple[float, List[str]]]:
+    """
+    Regroupe les references par strength : une instance IP-Adapter par groupe
+    (scale propre), les images d'un groupe partagent l'instance.
+
+    Au-dela de max_groups, les deux groupes de strengths les plus proches sont
+    fusionnes (strength moyenne ponderee par le nombre d'images).
+
+    Returns:
+        [(strength, [image_path, ...]), ...] tries par strength
+    """
+    groups: Dict[float, List[str]] = {}
+    for path, strength in references:
+        groups.setdefault(round(float(strength), 3), []).append(path)
+    merged = sorted(groups.items())
+
+    while len(merged) > max(1, max_groups):
+        i = min(range(len(merged) - 1), key=lambda k: merged[k + 1][0] - merged[k][0])
+        (s1, p1), (s2, p2) = merged[i], merged[i + 1]
+        strength = round((s1 * len(p1) + s2 * len(p2)) / (len(p1) + len(p2)), 3)
+        merged[i:i + 2] = [(strength, p1 + p2)]
+    return merged
+
+
+class ImageEmbeddingCache:
+    """LRU memoire devant les .pt des references"""
+
+    def __init__(
+        self,
+        max_entries: int,
+        encoder_id: str,
+        save: Callable[[Any, Path], None] = _torch_save,
+        load: Callable[[Path], Any] = _torch_load,
+    ):
+        self.max_entries = max_entries
+        self.encoder_id = encoder_id
+        self._save = save
+        self._load = load
+        self._entries: "OrderedDict[str, Embeds]" = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.computed = 0
+
+    @staticmethod
+    def _version(image_path: str) -> int:
+        return Path(image_path).stat().st_mtime_ns
+
+    def get(self, image_path: str, compute: Callable[[str], Embeds]) -> Embeds:
+        """
+        Embeddings d'une image : memoire, sinon .pt valide, sinon compute()
+        (resultat enregistre sur disque).
+        """
+        version = self._version(image_path)
+        key = f"{image_path}:{version}"
+
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return value
+
+        value = self._load_disk(image_path, version)
+        if value is not None:
+            self.disk_hits += 1
+            self._remember(key, value)
+            return value
+
+        return self.store(image_path, compute(image_path))
+
+    def store(self, image_path: str, embeds: Embeds) -> Embeds:
+        """Enregistre les embeddings d'une image (.pt + memoire)"""
+        version = self._version(image_path)
+        path = embedding_path_for(image_path)
+        payload = {
+            "encoder": self.encoder_id,
+            "image_mtime_ns": version,
+            "image_embeds": embeds[0],
+            "negative_image_embeds": embeds[1],
+        }
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            self._save(payload, tmp_path)
+            tmp_path.replace(path)
+        except OSError as e:
+            # Reference en lecture seule : l'embedding reste en memoire
+            logger.warning("Embedding non enregistre %s: %s", path, e)
+        self.computed += 1
+        self._remember(f"{image_path}:{version}", embeds)
+        return embeds
+
+    def _load_disk(self, image_path: str, version: int) -> Optional[Embeds]:
+        path = embedding_path_for(image_path)
+        if not path.exists():
+            return None
+        try:
+            payload = self._load(path)
+        except Exception as e:
+            logger.warning("Embedding illisible %s: %s", path, e)
+            return None
+        if (
+            not isinstance(payload, dict)
+            or payload.get("encoder") != self.encoder_id
+            or payload.get("image_mtime_ns") != version
+        ):
+            logger.info("Embedding perime, recalcul: %s", path)
+            return None
+        return payload["image_embeds"], payload["negative_image_embeds"]
+
+    def _remember(self, key: str, value: Embeds) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.computed
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "entries": len(self._entries),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "computed": self.computed,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,278 @@
+"""
+Index SQLite des images de OUTPUTS_DIR (nom, chemin, taille, date de creation).
+
+Disposition shardee : {YYYYMMDD}/{2 premiers caracteres de l'id}/{filename},
+deduite du nom genere par le worker ({modele}_{YYYYMMDD}_{HHMMSS}_{id}.png).
+Les noms restent la cle publique (/v1/download/{filename}, /outputs/{filename}) ;
+locate() les resout via l'index, puis le chemin deduit, puis l'ancien
+emplacement a plat (fichiers pas encore migres par reshard_outputs.py).
+
+Le worker enregistre chaque image a l'ecriture, avec le SHA-256 de son contenu
+(ETag des telechargements, app.http_cache) ; la retention (app.retention)
+choisit ses candidats par requetes indexees au lieu de relister le dossier.
+Le total des octets est tenu a jour par triggers (lecture O(1)).
+
+A la premiere ouverture, le contenu existant de OUTPUTS_DIR est indexe une
+seule fois (os.walk, date = mtime).
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.config import OUTPUTS_DIR, OUTPUTS_STATE_DB_FILE
+from app.sqlite_utils import ThreadLocalDB
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    path TEXT,  -- relatif a OUTPUTS_DIR ; NULL = ancien emplacement a plat
+    sha256 TEXT  -- hash du contenu (ETag) ; NULL = calcule a la premiere lecture
+);
+CREATE INDEX IF NOT EXISTS idx_outputs_created_at ON outputs(created_at);
+CREATE TABLE IF NOT EXISTS outputs_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO outputs_meta (key, value) VALUES ('files', 0), ('bytes', 0);
+CREATE TRIGGER IF NOT EXISTS outputs_total_insert AFTER INSERT ON outputs BEGIN
+    UPDATE outputs_meta SET value = value + 1 WHERE key = 'files';
+    UPDATE outputs_meta SET value = value + new.size WHERE key = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS outputs_total_delete AFTER DELETE ON outputs BEGIN
+    UPDATE outputs_meta SET value = value - 1 WHERE key = 'files';
+    UPDATE outputs_meta SET value = value - old.size WHERE key = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS outputs_total_update AFTER UPDATE OF size ON outputs BEGIN
+    UPDATE outputs_meta SET value = value - old.size + new.size WHERE key = 'bytes';
+END;
+"""
+
+OutputRow = Tuple[str, int, float]  # (filename, size, created_at)
+
+# {modele}_{YYYYMMDD}_{HHMMSS}_{id}.{ext} (app.worker._write_image)
+GENERATED_NAME = re.compile(r"_(\d{8})_\d{6}_([0-9a-f]{2})[0-9a-f]*\.\w+$")
+
+
+def shard_path(filename: str) -> Optional[str]:
+    """Chemin sharde d'un nom genere ({YYYYMMDD}/{id[:2]}/{filename}), None sinon"""
+    match = GENERATED_NAME.search(filename)
+    if match is None:
+        return None
+    return f"{match.group(1)}/{match.group(2)}/{filename}"
+
+
+def is_output_name(filename: str) -> bool:
+    """Nom de fichier simple (pas de sous-dossier, pas de fichier d'etat)"""
+    return bool(filename) and "/" not in filename and "\\" not in filename and not filename.startswith(".")
+
+
+def locate_output(outputs_dir: Path, filename: str, indexed: Optional[str] = None) -> Optional[Path]:
+    """Chemin existant d'une image : chemin indexe, chemin sharde, puis a plat"""
+    if not is_output_name(filename):
+        return None
+    candidates = []
+    for relative in (indexed, shard_path(filename), filename):
+        if relative and relative not in candidates:
+            candidates.append(relative)
+    for relative in candidates:
+        path = outputs_dir / relative
+        if path.is_file():
+            return path
+    return None
+
+
+class OutputIndex:
+    """Fichiers de OUTPUTS_DIR : ajout a l'ecriture, parcours par date de creation"""
+
+    def __init__(self, db_path: Path = OUTPUTS_STATE_DB_FILE, outputs_dir: Path = OUTPUTS_DIR):
+        self.outputs_dir = outputs_dir
+        self._db = ThreadLocalDB(db_path, initialize=self._initialize)
+
+    def _initialize(self, conn: sqlite3.Connection) -> None:
+        conn.executescript(SCHEMA)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(outputs)")]
+            if "path" not in columns:
+                conn.execute("ALTER TABLE outputs ADD COLUMN path TEXT")
+            if "sha256" not in columns:
+                conn.execute("ALTER TABLE outputs ADD COLUMN sha256 TEXT")
+            scanned = conn.execute("SELECT 1 FROM outputs_meta WHERE key = 'scanned'").fetchone()
+            rows = [] if scanned else self._scan()
+            conn.executemany(
+                "INSERT OR IGNORE INTO outputs (filename, size, created_at, path) VALUES (?, ?, ?, ?)", rows
+            )
+            conn.execute("INSERT OR IGNORE INTO outputs_meta (key, value) VALUES ('scanned', 1)")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        if rows:
+            logger.info("OUTPUTS_DIR indexe (%d fichiers existants)", len(rows))
+
+    def _scan(self) -> List[Tuple[str, int, float, str]]:
+        rows = []
+        for root, dirs, files in os.walk(self.outputs_dir):
+            # Fichiers et dossiers d'etat (.state.db, .retrieved.json...) exclus
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = Path(root) / name
+                stat = path.stat()
+                rows.append((name, stat.st_size, stat.st_mtime, path.relative_to(self.outputs_dir).as_posix()))
+        return rows
+
+    # -------------------------------------------------------------- ecriture
+
+    def add(
+        self,
+        filename: str,
+        size: int,
+        created_at: Optional[float] = None,
+        path: Optional[str] = None,
+        sha256: Optional[str] = None,
+    ) -> None:
+        """Enregistre une image ecrite (remplace une entree du meme nom)"""
+        self._db.conn.execute(
+            "INSERT INTO outputs (filename, size, created_at, path, sha256) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (filename) DO UPDATE SET size = excluded.size, "
+            "created_at = excluded.created_at, path = excluded.path, sha256 = excluded.sha256",
+            (filename, size, time.time() if created_at is None else created_at, path or filename, sha256),
+        )
+
+    def move(self, filename: str, path: str) -> bool:
+        """Nouveau chemin d'une image deplacee (False si non indexee)"""
+        cursor = self._db.conn.execute("UPDATE outputs SET path = ? WHERE filename = ?", (path, filename))
+        return cursor.rowcount == 1
+
+    def remove(self, filenames: Iterable[str]) -> None:
+        with self._db.transaction() as conn:
+            conn.executemany("DELETE FROM outputs WHERE filename = ?", [(name,) for name in filenames])
+
+    def reshard(self, dry_run: bool = False, limit: Optional[int] = None, pause: float = 0.0) -> Dict[str, int]:
+        """
+        Deplace les images encore a plat vers leur chemin sharde, API et worker
+        en marche : le fichier est renomme (atomique) avant la mise a jour de
+        l'index, et locate() essaie le chemin deduit si l'index est en retard.
+        Les noms non generes par le worker restent a plat.
+        """
+        counts = {"moved": 0, "skipped": 0, "errors": 0}
+        with os.scandir(self.outputs_dir) as entries:
+            names = sorted(entry.name for entry in entries if is_output_name(entry.name) and entry.is_file())
+
+        for name in names:
+            if limit is not None and counts["moved"] >= limit:
+                break
+            relative = shard_path(name)
+            target = self.outputs_dir / relative if relative else None
+            if target is None or target.exists():
+                counts["skipped"] += 1
+                continue
+            if dry_run:
+                counts["moved"] += 1
+                continue
+            try:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.rename(self.outputs_dir / name, target)
+            except OSError as exc:
+                logger.warning("%s non deplace: %s", name, exc)
+                counts["errors"] += 1
+                continue
+            if not self.move(name, relative):
+                stat = target.stat()
+                self.add(name, stat.st_size, stat.st_mtime, path=relative)
+            counts["moved"] += 1
+            if pause:
+                time.sleep(pause)
+        return counts
+
+    # --------------------------------------------------------------- lecture
+
+    def locate(self, filename: str) -> Optional[Path]:
+        """Chemin de l'image sur disque (index, puis chemin sharde, puis a plat)"""
+        if not is_output_name(filename):
+            return None
+        row = self._db.conn.execute("SELECT path FROM outputs WHERE filename = ?", (filename,)).fetchone()
+        return locate_output(self.outputs_dir, filename, row[0] if row else None)
+
+    def locate_with_hash(self, filename: str) -> Tuple[Optional[Path], Optional[str]]:
+        """
+        Chemin et SHA-256 du contenu d'une image, en une lecture d'index. Le
+        hash des images indexees sans hash (anterieures) est calcule une fois.
+        """
+        if not is_output_name(filename):
+            return None, None
+        row = self._db.conn.execute(
+            "SELECT path, sha256 FROM outputs WHERE filename = ?", (filename,)
+        ).fetchone()
+        path = locate_output(self.outputs_dir, filename, row[0] if row else None)
+        if path is None:
+            return None, None
+        if row and row[1]:
+            return path, row[1]
+        return path, self._store_hash(filename, path)
+
+    def content_hash(self, filename: str, path: Path) -> str:
+        """SHA-256 d'une image deja localisee (index, sinon calcule et enregistre)"""
+        row = self._db.conn.execute("SELECT sha256 FROM outputs WHERE filename = ?", (filename,)).fetchone()
+        if row and row[0]:
+            return row[0]
+        return self._store_hash(filename, path)
+
+    def _store_hash(self, filename: str, path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        value = digest.hexdigest()
+        self._db.conn.execute("UPDATE outputs SET sha256 = ? WHERE filename = ?", (value, filename))
+        return value
+
+    def get(self, filename: str) -> Optional[OutputRow]:
+        row = self._db.conn.execute(
+            "SELECT filename, size, created_at FROM outputs WHERE filename = ?", (filename,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def oldest(
+        self,
+        before: float = float("inf"),
+        after: Tuple[float, str] = (float("-inf"), ""),
+        limit: int = 500,
+    ) -> List[OutputRow]:
+        """
+        Fichiers crees avant `before`, plus anciens d'abord, a partir du
+        curseur `after` = (created_at, filename) de la page precedente.
+        """
+        return [
+            tuple(row)
+            for row in self._db.conn.execute(
+                "SELECT filename, size, created_at FROM outputs "
+                "WHERE created_at < ? AND (created_at > ? OR (created_at = ? AND filename > ?)) "
+                "ORDER BY created_at, filename LIMIT ?",
+                (before, after[0], after[0], after[1], limit),
+            )
+        ]
+
+    def totals(self) -> Dict[str, int]:
+        """{files, bytes} (compteurs maintenus par triggers)"""
+        return {
+            key: value
+            for key, value in self._db.conn.execute(
+                "SELECT key, value FROM outputs_meta WHERE key IN ('files', 'bytes')"
+            )
+        }
+
+
+output_index = OutputIndex()
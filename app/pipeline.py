@@ -3,16 +3,27 @@ Pipeline de génération d'images SDXL avec support multi-modèles et LoRA
 """
 
 import gc
+import hashlib
 import logging
+import random
 import torch
 from diffusers import StableDiffusionXLPipeline, AutoencoderKL
+from diffusers.models.embeddings import ImageProjection
 from PIL import Image
 from pathlib import Path
 from typing import Optional, List, Dict
 
 from app.config import *
 from app.models_config import get_model_config, get_lora_config, DEFAULT_MODEL
+from app.adapters import AdapterManager
+from app.components import ComponentRegistry, config_fingerprint
+from app.fusion import LoRAFusion, fusion_key
+from app.ip_embeds import ImageEmbeddingCache, group_by_strength
+from app.progress import StepProgress
+from app.prompt_cache import PromptEmbeddingCache
+from app.residency import PipelineResidencyCache, ResidentPipeline, pipeline_module_sizes
 from compel import Compel, ReturnedEmbeddingsType
+from transformers import CLIPTokenizer
 
 # Import tokens from config
 from app.config import HUGGINGFACE_TOKEN, CIVITAI_API_TOKEN
@@ -42,8 +53,25 @@ class FlexiblePipeline:
         self.current_model = None
         self.pipe = None
         self.compel = None
-        self.loaded_loras = {}  # Track loaded LoRAs
-        self.ip_adapter_loaded = False
+        self.adapters = None  # AdapterManager du pipeline actif
+        self.loaded_loras = {}  # Track loaded LoRAs (= self.adapters.loaded)
+        self.fusion = None  # LoRAFusion du pipeline actif
+        self.ip_adapter_loaded = 0  # Nombre d'instances IP-Adapter chargees
+        self.components = ComponentRegistry()
+        self.prompt_cache = PromptEmbeddingCache(
+            max_entries=PROMPT_CACHE_MAX_ENTRIES,
+            disk_dir=PROMPT_CACHE_DIR if PROMPT_CACHE_DISK_ENABLED else None,
+            max_disk_entries=PROMPT_CACHE_MAX_DISK_ENTRIES,
+        )
+        self.ip_embeds = ImageEmbeddingCache(
+            max_entries=IP_EMBED_CACHE_MAX_ENTRIES,
+            encoder_id=f"{IP_ADAPTER_MODEL}/{IP_ADAPTER_SUBFOLDER}/{IP_ADAPTER_WEIGHT}",
+        )
+        self.residency = PipelineResidencyCache(
+            max_entries=PIPELINE_CACHE_MAX_MODELS,
+            max_bytes=PIPELINE_CACHE_MAX_BYTES,
+            on_evict=self._release,
+        )
 
         # Charger le modèle par défaut
         self.load_model(DEFAULT_MODEL)
@@ -52,29 +80,166 @@ class FlexiblePipeline:
         logger.info("Pipeline pret sur %s", self.device)
 
     def load_model(self, model_id: str):
-        """Charge un modèle base (avec lazy loading)"""
-        if hasattr(self, 'current_model') and hasattr(self, 'pipe') and \
-           self.current_model == model_id and self.pipe is not None:
+        """Active un modele base (cache de residence, sinon chargement disque)"""
+        if self.current_model == model_id and self.pipe is not None:
             logger.debug("Modele %s deja charge", model_id)
             return  # Déjà chargé
 
-        logger.info("Chargement du modele: %s", model_id)
-
-        # Clear previous model
-        if hasattr(self, 'pipe') and self.pipe is not None:
-            logger.debug("Nettoyage du modele precedent")
-            del self.pipe
-            del self.compel
-            torch.cuda.empty_cache()
-            gc.collect()
-
         # Get model config
         model_config = get_model_config(model_id)
         if not model_config:
             raise ValueError(f"Modèle {model_id} non trouvé dans la configuration")
 
-        # Load pipeline
+        # Le modele courant reste resident en RAM CPU
+        self._park_current()
+
+        resident = self.residency.get(model_id)
+        if resident is not None:
+            logger.info("Modele %s resident, reactivation", model_id)
+        else:
+            logger.info("Chargement du modele: %s", model_id)
+            self.residency.reserve()
+            pipe = self._build_pipeline(model_config)
+
+            # Setup Compel
+            logger.debug("Configuration Compel")
+            compel = Compel(
+                tokenizer=[pipe.tokenizer, pipe.tokenizer_2],
+                text_encoder=[pipe.text_encoder, pipe.text_encoder_2],
+                returned_embeddings_type=ReturnedEmbeddingsType.PENULTIMATE_HIDDEN_STATES_NON_NORMALIZED,
+                requires_pooled=[False, True]
+            )
+
+            # GPU optimizations (l'offload CPU est active dans _activate)
+            logger.debug("Activation des optimisations GPU")
+            pipe.enable_vae_slicing()
+            pipe.enable_vae_tiling()
+
+            module_sizes = pipeline_module_sizes(pipe)
+            resident = ResidentPipeline(
+                model_id, pipe, compel,
+                size_bytes=sum(module_sizes.values()),
+                module_sizes=module_sizes,
+            )
+            resident.adapters = AdapterManager(
+                pipe,
+                loader=self._load_lora_weights,
+                max_adapters=LORA_CACHE_MAX_ADAPTERS,
+                max_bytes=LORA_CACHE_MAX_BYTES,
+            )
+            resident.fusion = LoRAFusion(
+                pipe,
+                max_combos=LORA_FUSION_MAX_COMBOS,
+                max_bytes=LORA_FUSION_MAX_BYTES,
+                min_uses=LORA_FUSION_MIN_USES,
+            )
+            self.residency.put(resident)
+            # Apres construction : les composants partages repris par le
+            # nouveau pipeline (VAE, tokenizers) sont encore references
+            self._prune_components()
+
+        self._activate(resident)
+        logger.info("Modele %s pret (cache: %s)", model_id, self.residency.stats())
+
+    def _park_current(self):
+        """Sauvegarde l'etat du modele actif et libere la VRAM qu'il occupe"""
+        if self.pipe is None:
+            return
+
+        resident = self.residency.peek(self.current_model)
+        if resident is not None:
+            resident.ip_adapter_loaded = self.ip_adapter_loaded
+
+        if OFFLOAD_TO_CPU:
+            # Les hooks d'offload gardent le dernier composant utilise sur GPU
+            if hasattr(self.pipe, "maybe_free_model_hooks"):
+                self.pipe.maybe_free_model_hooks()
+        else:
+            self.pipe.to("cpu")
+
+        self.pipe = None
+        self.compel = None
+        self.adapters = None
+        self.loaded_loras = {}
+        self.fusion = None
+        self.current_model = None
+        torch.cuda.empty_cache()
+
+    def _activate(self, resident: ResidentPipeline):
+        """Rend un pipeline resident actif (deplacement device si pas d'offload)"""
+        if OFFLOAD_TO_CPU:
+            # Les composants partages portent les hooks du dernier pipeline
+            # actif : on les rattache a celui-ci (operation sans copie)
+            resident.pipe.enable_model_cpu_offload()
+        else:
+            resident.pipe.to(self.device)
+
+        self.pipe = resident.pipe
+        self.compel = resident.compel
+        self.adapters = resident.adapters
+        self.loaded_loras = resident.adapters.loaded
+        self.fusion = resident.fusion
+        self.ip_adapter_loaded = resident.ip_adapter_loaded
+        self.current_model = resident.model_id
+
+    def _release(self, resident: ResidentPipeline):
+        """Callback d'eviction : libere la memoire d'un pipeline"""
+        resident.pipe = None
+        resident.compel = None
+        resident.adapters = None
+        resident.fusion = None
+        # Le registre garde les composants partages jusqu'au prochain
+        # _prune_components (reutilisables par le pipeline en construction)
+        gc.collect()
+        torch.cuda.empty_cache()
+
+    def _prune_components(self):
+        """Oublie les composants partages qu'aucun pipeline resident n'utilise"""
+        if self.components.prune(entry.pipe for entry in self.residency.entries()):
+            gc.collect()
+            torch.cuda.empty_cache()
+
+    def _shared_components(self, model_config) -> Dict:
+        """
+        Composants communs aux modeles SDXL (VAE, tokenizers CLIP), charges
+        une seule fois et passes au constructeur du pipeline.
+        """
+        hf_kwargs = {"cache_dir": MODELS_DIR}
+        if HUGGINGFACE_TOKEN:
+            hf_kwargs["token"] = HUGGINGFACE_TOKEN
+
+        shared = {
+            "tokenizer": self.components.get_or_load(
+                "tokenizer",
+                SDXL_MODEL,
+                lambda: CLIPTokenizer.from_pretrained(SDXL_MODEL, subfolder="tokenizer", **hf_kwargs),
+            ),
+            "tokenizer_2": self.components.get_or_load(
+                "tokenizer_2",
+                SDXL_MODEL,
+                lambda: CLIPTokenizer.from_pretrained(SDXL_MODEL, subfolder="tokenizer_2", **hf_kwargs),
+            ),
+        }
+
+        # Load custom VAE if specified
+        if model_config.vae_path:
+            logger.debug("VAE: %s", model_config.vae_path)
+            shared["vae"] = self.components.get_or_load(
+                "vae",
+                model_config.vae_path,
+                lambda: AutoencoderKL.from_pretrained(
+                    model_config.vae_path,
+                    torch_dtype=torch.float16,
+                    **hf_kwargs
+                ),
+            )
+
+        return shared
+
+    def _build_pipeline(self, model_config) -> StableDiffusionXLPipeline:
+        """Construit un pipeline SDXL depuis le disque (checkpoint ou diffusers)"""
         logger.info("Chargement de %s", model_config.full_name)
+        shared = self._shared_components(model_config)
 
         # Check if it's a checkpoint (single file) or full pipeline
         if model_config.checkpoint_url:
@@ -101,9 +266,10 @@ class FlexiblePipeline:
             }
 
             # Load from the downloaded checkpoint file
-            self.pipe = StableDiffusionXLPipeline.from_single_file(
+            pipe = StableDiffusionXLPipeline.from_single_file(
                 checkpoint_path,
-                **load_kwargs
+                **load_kwargs,
+                **shared
             )
         else:
             # Load from full diffusers pipeline
@@ -121,114 +287,102 @@ class FlexiblePipeline:
                 load_kwargs["token"] = HUGGINGFACE_TOKEN
                 logger.debug("Utilisation du token HuggingFace")
 
-            self.pipe = StableDiffusionXLPipeline.from_pretrained(
+            pipe = StableDiffusionXLPipeline.from_pretrained(
                 model_config.path,
-                **load_kwargs
+                **load_kwargs,
+                **shared
             )
 
-        # Load custom VAE if specified
-        if model_config.vae_path:
-            logger.debug("Chargement VAE: %s", model_config.vae_path)
-
-            # Build kwargs for VAE loading
-            vae_kwargs = {
-                "torch_dtype": torch.float16,
-                "cache_dir": MODELS_DIR
-            }
-
-            # Add HuggingFace token if available
-            if HUGGINGFACE_TOKEN:
-                vae_kwargs["token"] = HUGGINGFACE_TOKEN
-
-            vae = AutoencoderKL.from_pretrained(
-                model_config.vae_path,
-                **vae_kwargs
-            )
-            self.pipe.vae = vae
-
-        # Setup Compel
-        logger.debug("Configuration Compel")
-        self.compel = Compel(
-            tokenizer=[self.pipe.tokenizer, self.pipe.tokenizer_2],
-            text_encoder=[self.pipe.text_encoder, self.pipe.text_encoder_2],
-            returned_embeddings_type=ReturnedEmbeddingsType.PENULTIMATE_HIDDEN_STATES_NON_NORMALIZED,
-            requires_pooled=[False, True]
+        # Scheduler identique (meme classe + meme config) partage entre modeles
+        pipe.scheduler = self.components.get_or_load(
+            "scheduler",
+            type(pipe.scheduler).__name__,
+            lambda: pipe.scheduler,
+            fingerprint=config_fingerprint(pipe.scheduler.config),
         )
 
-        # GPU optimizations
-        logger.debug("Activation des optimisations GPU")
-        self.pipe.enable_model_cpu_offload()
-        self.pipe.enable_vae_slicing()
-        self.pipe.enable_vae_tiling()
+        return pipe
 
-        self.current_model = model_id
-        self.loaded_loras = {}  # Reset LoRAs when changing model
-        self.ip_adapter_loaded = False  # Reset IP-Adapter
-        logger.info("Modele %s pret", model_id)
+    def cache_stats(self) -> Dict:
+        """Compteurs des caches du pipeline"""
+        return {
+            "pipelines": self.residency.stats(),
+            "components": self.components.stats(),
+            "prompt_embeddings": self.prompt_cache.stats(),
+            "ip_adapter_embeddings": self.ip_embeds.stats(),
+            "loras": self.adapters.stats() if self.adapters else None,
+            "fused_loras": self.fusion.stats() if self.fusion else None,
+        }
 
     def load_loras(self, lora_configs: List[Dict]):
-        """Charge et fusionne plusieurs LoRAs"""
-        if not lora_configs:
-            # Unload all LoRAs
-            if self.loaded_loras:
-                logger.debug("Dechargement des LoRAs")
-                self.pipe.unload_lora_weights()
-                self.loaded_loras = {}
-            return
-
-        # Build LoRA configuration
-        adapter_names = []
-        adapter_weights = []
-
+        """Applique un jeu de LoRAs (diff avec l'état actif, éviction LRU)"""
+        requested = []
         for lora_req in lora_configs:
             lora_id = lora_req["name"]
-            weight = lora_req["weight"]
 
             # Get LoRA config
             lora_config = get_lora_config(lora_id)
             if not lora_config:
                 logger.warning("LoRA %s non trouve, ignore", lora_id)
                 continue
+            requested.append((lora_id, lora_req["weight"], lora_config))
 
-            # Load LoRA if not already loaded
-            if lora_id not in self.loaded_loras:
-                logger.info("Chargement LoRA: %s (weight=%s)", lora_config.name, weight)
-                try:
-                    # Build kwargs for load_lora_weights
-                    lora_kwargs = {
-                        "adapter_name": lora_id,
-                        "cache_dir": MODELS_DIR
-                    }
-
-                    # Add HuggingFace token if available
-                    if HUGGINGFACE_TOKEN:
-                        lora_kwargs["token"] = HUGGINGFACE_TOKEN
-
-                    self.pipe.load_lora_weights(
-                        lora_config.path,
-                        **lora_kwargs
-                    )
-                    self.loaded_loras[lora_id] = lora_config
-                except Exception as e:
-                    logger.error("Erreur chargement LoRA %s", lora_id, exc_info=True)
-                    continue
-
-            adapter_names.append(lora_id)
-            adapter_weights.append(weight)
-
-        # Set active adapters with weights
-        if adapter_names:
-            self.pipe.set_adapters(adapter_names, adapter_weights=adapter_weights)
-            logger.info("LoRAs actifs: %s", ", ".join(adapter_names))
-        else:
+        if requested and self._apply_fused(requested):
+            return
+
+        # Combinaison froide : adapters dynamiques sur les poids d'origine
+        self.fusion.leave()
+        if not self.adapters.apply(requested):
+            logger.debug("LoRAs inchanges")
+        elif self.adapters.active:
+            logger.info("LoRAs actifs: %s", ", ".join(name for name, _ in self.adapters.active))
+        elif lora_configs:
             logger.warning("Aucun LoRA charge")
 
+    def _apply_fused(self, requested: List) -> bool:
+        """Chemin rapide : combinaison chaude fusionnee dans l'UNet"""
+        if not LORA_FUSION_ENABLED:
+            return False
+        key = fusion_key(self.current_model, requested)
+        names = [name for name, _, _ in requested]
+        if not self.fusion.record_use(key):
+            return False
+        if key not in self.fusion.fused and not self.fusion.is_eligible(names):
+            return False
+
+        self.fusion.enter(key, names, prepare=lambda: self.adapters.apply(requested))
+        # Les poids fusionnes remplacent les adapters : plus de calcul LoRA par step
+        self.adapters.disable()
+        logger.info("LoRAs fusionnes: %s", ", ".join(names))
+        return True
+
+    @staticmethod
+    def _load_lora_weights(pipe, lora_id: str, lora_config):
+        """Charge un LoRA comme adapter PEFT nommé (loader de AdapterManager)"""
+        # Build kwargs for load_lora_weights
+        lora_kwargs = {
+            "adapter_name": lora_id,
+            "cache_dir": MODELS_DIR
+        }
+
+        # Add HuggingFace token if available
+        if HUGGINGFACE_TOKEN:
+            lora_kwargs["token"] = HUGGINGFACE_TOKEN
+
+        pipe.load_lora_weights(
+            lora_config.path,
+            **lora_kwargs
+        )
+
     def enhance_prompt_with_trigger_words(self, prompt: str, lora_configs: List[Dict]) -> str:
         """Ajoute les trigger words des LoRAs au prompt si nécessaire"""
         enhanced_prompt = prompt
 
         for lora_req in lora_configs:
             lora_config = self.loaded_loras.get(lora_req["name"])
+            if lora_config is None and self.fusion and lora_req["name"] in self.fusion.current_names:
+                # Combinaison fusionnee dont l'adapter a ete evince depuis
+                lora_config = get_lora_config(lora_req["name"])
             if lora_config and lora_config.trigger_words:
                 # Append trigger words if not already in prompt
                 for trigger in lora_config.trigger_words:
@@ -240,29 +394,117 @@ class FlexiblePipeline:
 
         return enhanced_prompt
 
-    def _ensure_ip_adapter_loaded(self):
-        """Charge IP-Adapter Plus si pas deja charge"""
-        if not self.ip_adapter_loaded:
-            logger.info("Chargement IP-Adapter (%s)", IP_ADAPTER_WEIGHT)
+    def _text_encoder_fingerprint(self, lora_configs: List[Dict]) -> str:
+        """
+        Empreinte des text encoders actifs : modele + LoRAs (avec poids) qui
+        ont des couches dans les encoders. Un LoRA UNet-only ne change rien.
+        """
+        te_adapters = set()
+        for encoder in (self.pipe.text_encoder, self.pipe.text_encoder_2):
+            te_adapters.update(getattr(encoder, "peft_config", None) or {})
+
+        parts = sorted(
+            f"{lora['name']}:{lora['weight']}"
+            for lora in lora_configs
+            if lora["name"] in te_adapters and lora["name"] in self.loaded_loras
+        )
+        raw = f"{self.current_model}|{','.join(parts)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _encode_prompt(self, prompt: str, encoder_fingerprint: str):
+        """Encodage Compel avec cache (conditioning, pooled)"""
+        cached = self.prompt_cache.get(self.current_model, encoder_fingerprint, prompt)
+        if cached is not None:
+            conditioning, pooled = cached
+            return conditioning.to(self.device), pooled.to(self.device)
+
+        conditioning, pooled = self.compel(prompt)
+        # Stockage CPU : le cache ne doit pas consommer de VRAM
+        self.prompt_cache.put(
+            self.current_model,
+            encoder_fingerprint,
+            prompt,
+            (conditioning.to("cpu"), pooled.to("cpu")),
+        )
+        return conditioning, pooled
+
+    def _ensure_ip_adapter_loaded(self, instances: int = 1):
+        """
+        Charge au moins `instances` instances IP-Adapter (une par scale).
+        Le nombre ne fait que croitre : les instances en trop recoivent un
+        scale 0 plutot que d'etre dechargees.
+        """
+        if self.ip_adapter_loaded < instances:
+            logger.info("Chargement IP-Adapter (%s) x%d", IP_ADAPTER_WEIGHT, instances)
             self.pipe.load_ip_adapter(
                 IP_ADAPTER_MODEL,
                 subfolder=IP_ADAPTER_SUBFOLDER,
-                weight_name=IP_ADAPTER_WEIGHT,
+                weight_name=[IP_ADAPTER_WEIGHT] * instances,
                 cache_dir=MODELS_DIR
             )
-            self.ip_adapter_loaded = True
+            self.ip_adapter_loaded = instances
             logger.info("IP-Adapter charge")
 
+    def _encode_reference(self, image_path: str):
+        """Encodeur CLIP image de l'IP-Adapter -> (embeds, negative_embeds) CPU"""
+        self._ensure_ip_adapter_loaded()
+        projection = self.pipe.unet.encoder_hid_proj.image_projection_layers[0]
+        output_hidden_states = not isinstance(projection, ImageProjection)
+
+        image = Image.open(image_path).convert("RGB")
+        with torch.no_grad():
+            embeds, negative_embeds = self.pipe.encode_image(
+                image, self.device, 1, output_hidden_states
+            )
+        return embeds.to("cpu"), negative_embeds.to("cpu")
+
     def compute_embedding(self, image_path: str) -> torch.Tensor:
         """
-        Calcule l'embedding CLIP pour une image de reference.
-        Reserve pour usage futur (IP-Adapter Plus avec encodeur ViT-H correct).
-        Pour l'instant, les images brutes sont passees directement au pipeline.
+        Calcule et enregistre ({subtype}.pt) l'embedding IP-Adapter d'une image
+        de reference. Appele a l'upload par compute_embedding_task.
+        """
+        embeds, _ = self.ip_embeds.store(image_path, self._encode_reference(image_path))
+        return embeds
+
+    def _reference_embeds(self, image_paths: List[str], guidance_scale: float) -> torch.Tensor:
+        """
+        Embeddings d'une instance IP-Adapter pour N images de reference
+        (embeddings pre-calcules, encodeur seulement si absents).
         """
-        # Pour l'instant, on ne pre-calcule pas d'embeddings.
-        # Le pipeline utilise les images brutes directement.
-        # Cette methode est gardee pour compatibilite avec compute_embedding_task.
-        return torch.zeros(1)  # Placeholder
+        embeds, negative_embeds = zip(
+            *(self.ip_embeds.get(path, self._encode_reference) for path in image_paths)
+        )
+        # (1, N, ...) : une ligne par prompt, N images pour l'adapter
+        image_embeds = torch.cat(embeds).unsqueeze(0)
+        if guidance_scale > 1:
+            # CFG : embedding negatif en premiere moitie (convention diffusers)
+            image_embeds = torch.cat([torch.cat(negative_embeds).unsqueeze(0), image_embeds])
+        return image_embeds.to(self.device, dtype=self.pipe.unet.dtype)
+
+    def _ip_adapter_args(self, references: List[tuple], guidance_scale: float) -> Dict:
+        """
+        Une instance IP-Adapter par strength distincte : chaque reference garde
+        son scale (ex: character 0.7 + background 0.3).
+
+        Args:
+            references: [(image_path, strength), ...]
+        """
+        groups = group_by_strength(references, IP_ADAPTER_MAX_INSTANCES)
+        self._ensure_ip_adapter_loaded(len(groups))
+
+        embeds = [self._reference_embeds(paths, guidance_scale) for _, paths in groups]
+        scales = [strength for strength, _ in groups]
+        # Instances inutilisees : scale 0 (les embeddings sont ignores)
+        unused = self.ip_adapter_loaded - len(groups)
+        embeds += [embeds[0]] * unused
+        scales += [0.0] * unused
+
+        self.pipe.set_ip_adapter_scale(scales)
+        logger.info(
+            "IP-Adapter: %d reference(s), scales=%s",
+            len(references), [strength for strength, _ in groups],
+        )
+        return {"ip_adapter_image_embeds": embeds}
 
     def generate(
         self,
@@ -276,6 +518,7 @@ class FlexiblePipeline:
         reference_image_path: Optional[str] = None,
         ip_strength: float = 0.0,
         reference_images: Optional[List[Dict]] = None,
+        progress: Optional[StepProgress] = None,
     ):
         """
         Génération avec support multi-modèles, LoRAs et references multiples
@@ -291,6 +534,49 @@ class FlexiblePipeline:
             reference_image_path: (Legacy) Chemin vers image de référence
             ip_strength: (Legacy) Force du style transfer (0.0-1.0)
             reference_images: Liste de references [{path, strength, embedding_path}, ...]
+            progress: Suivi par étape de débruitage (callback step-end)
+        """
+        return self.generate_images(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            model=model,
+            loras=loras,
+            steps=steps,
+            guidance_scale=guidance_scale,
+            seeds=[seed],
+            reference_image_path=reference_image_path,
+            ip_strength=ip_strength,
+            reference_images=reference_images,
+            progress=progress,
+        )[0]
+
+    def generate_images(
+        self,
+        prompt: str,
+        negative_prompt: str = "",
+        model: str = DEFAULT_MODEL,
+        loras: List[Dict] = [],
+        steps: int = 30,
+        guidance_scale: float = 7.5,
+        seeds: List[Optional[int]] = [None],
+        reference_image_path: Optional[str] = None,
+        ip_strength: float = 0.0,
+        reference_images: Optional[List[Dict]] = None,
+        progress: Optional[StepProgress] = None,
+    ):
+        """
+        Génération de plusieurs images d'un même prompt (une par seed).
+
+        Le prompt est encodé une fois et la préparation (LoRAs, IP-Adapter) est
+        commune. Les seeds sont générées par groupes de BATCH_MAX_SIZE dans un
+        seul forward UNet, avec repli image par image en cas d'OOM.
+
+        Args:
+            seeds: Une seed par image (None = aléatoire)
+            (autres arguments: voir generate)
+
+        Returns:
+            Liste d'images dans l'ordre des seeds
         """
 
         try:
@@ -309,67 +595,79 @@ class FlexiblePipeline:
 
             logger.debug("Prompt (%d chars)", len(enhanced_prompt))
 
-            # Compel encoding
-            conditioning, pooled = self.compel(enhanced_prompt)
-            neg_conditioning, neg_pooled = self.compel(negative_prompt) if negative_prompt else (None, None)
+            # Compel encoding (cache par modele + etat des text encoders)
+            encoder_fp = self._text_encoder_fingerprint(loras)
+            conditioning, pooled = self._encode_prompt(enhanced_prompt, encoder_fp)
+            neg_conditioning, neg_pooled = self._encode_prompt(negative_prompt, encoder_fp) if negative_prompt else (None, None)
 
             # IP-Adapter avec references multiples
             ip_args = {}
 
             if reference_images and len(reference_images) > 0:
-                self._ensure_ip_adapter_loaded()
-
-                # Calculer la strength moyenne
-                avg_strength = sum(r["strength"] for r in reference_images) / len(reference_images)
-                self.pipe.set_ip_adapter_scale(avg_strength)
-
-                # Charger les images de reference
-                raw_images = []
-                for ref in reference_images:
-                    if Path(ref["path"]).exists():
-                        raw_images.append(Image.open(ref["path"]).convert("RGB"))
-
-                if raw_images:
-                    if len(raw_images) == 1:
-                        ip_args = {"ip_adapter_image": raw_images[0]}
-                    else:
-                        ip_args = {"ip_adapter_image": raw_images}
-                    logger.info("IP-Adapter: %d reference(s) (strength=%.2f)", len(raw_images), avg_strength)
+                # Embeddings pre-calcules, un scale par reference
+                refs = [
+                    (ref["path"], ref["strength"])
+                    for ref in reference_images
+                    if Path(ref["path"]).exists()
+                ]
+                if refs:
+                    ip_args = self._ip_adapter_args(refs, guidance_scale)
 
             elif reference_image_path and Path(reference_image_path).exists() and ip_strength > 0:
                 # Legacy: single reference image
-                self._ensure_ip_adapter_loaded()
-
-                ref_image = Image.open(reference_image_path).convert("RGB")
-                self.pipe.set_ip_adapter_scale(ip_strength)
-                ip_args = {"ip_adapter_image": ref_image}
+                ip_args = self._ip_adapter_args([(reference_image_path, ip_strength)], guidance_scale)
                 logger.info("IP-Adapter legacy (strength=%s)", ip_strength)
 
-            # Generator with seed
-            generator = None
-            if seed is not None:
-                generator = torch.Generator(device=self.device).manual_seed(seed)
-                logger.debug("Seed: %s", seed)
-
-            logger.info("Generation (steps=%d, cfg=%s)", steps, guidance_scale)
-
-            # Generation
-            image = self.pipe(
-                prompt_embeds=conditioning,
-                pooled_prompt_embeds=pooled,
-                negative_prompt_embeds=neg_conditioning,
-                negative_pooled_prompt_embeds=neg_pooled,
-                num_inference_steps=steps,
-                guidance_scale=guidance_scale,
-                generator=generator,
-                height=IMAGE_SIZE[1],
-                width=IMAGE_SIZE[0],
-                **ip_args
-            ).images[0]
+            def call(chunk: List[Optional[int]]):
+                # Generator with seed
+                generator = None
+                if any(seed is not None for seed in chunk):
+                    generator = self._generators(
+                        [seed if seed is not None else random.randint(0, 2**32 - 1) for seed in chunk]
+                    )
+                    logger.debug("Seeds: %s", chunk)
+
+                return self._run_pipe(
+                    progress,
+                    len(chunk),
+                    prompt_embeds=conditioning,
+                    pooled_prompt_embeds=pooled,
+                    negative_prompt_embeds=neg_conditioning,
+                    negative_pooled_prompt_embeds=neg_pooled,
+                    num_inference_steps=steps,
+                    guidance_scale=guidance_scale,
+                    num_images_per_prompt=len(chunk),
+                    generator=generator,
+                    height=IMAGE_SIZE[1],
+                    width=IMAGE_SIZE[0],
+                    **ip_args
+                )
+
+            logger.info("Generation x%d (steps=%d, cfg=%s)", len(seeds), steps, guidance_scale)
+
+            # Generation par groupes de BATCH_MAX_SIZE seeds
+            images = []
+            chunk_size = max(1, BATCH_MAX_SIZE)
+            if progress is not None:
+                progress.expect(steps * -(-len(seeds) // chunk_size))
+            for start in range(0, len(seeds), chunk_size):
+                chunk = seeds[start:start + chunk_size]
+                try:
+                    images.extend(call(chunk))
+                except torch.cuda.OutOfMemoryError:
+                    if len(chunk) == 1:
+                        raise
+                    logger.warning("OOM x%d, repli sequentiel", len(chunk))
+                    gc.collect()
+                    torch.cuda.empty_cache()
+                    if progress is not None:
+                        progress.expect(steps * len(chunk))
+                    for seed in chunk:
+                        images.extend(call([seed]))
 
             torch.cuda.empty_cache()
             logger.info("Generation terminee")
-            return image
+            return images
 
         except Exception as e:
             logger.error("Generation failed", exc_info=True)
@@ -377,5 +675,113 @@ class FlexiblePipeline:
             raise
 
 
+    def _generators(self, seeds: List[int]) -> List[torch.Generator]:
+        return [torch.Generator(device=self.device).manual_seed(seed) for seed in seeds]
+
+    def _run_pipe(self, progress: Optional[StepProgress], batch_size: int, **kwargs) -> List[Image.Image]:
+        """Appel du pipeline diffusers, avec suivi par étape si progress est fourni"""
+        if progress is None:
+            return self.pipe(**kwargs).images
+        progress.begin(batch_size)
+        images = self.pipe(**kwargs, callback_on_step_end=progress).images
+        progress.end()
+        return images
+
+    def generate_batch(
+        self,
+        items: List[Dict],
+        model: str = DEFAULT_MODEL,
+        loras: List[Dict] = [],
+        steps: int = 30,
+        guidance_scale: float = 7.5,
+        progress: Optional[StepProgress] = None,
+    ):
+        """
+        Génération batch : plusieurs prompts/seeds dans un seul forward UNet
+
+        Args:
+            items: [{prompt, negative_prompt, seed}, ...] (seed None = aléatoire)
+            model, loras, steps, guidance_scale: communs à tout le batch
+            progress: Suivi par étape de débruitage (callback step-end)
+
+        Returns:
+            (images, seeds) dans l'ordre des items, avec les seeds effectivement utilisées
+        """
+        try:
+            gc.collect()
+            torch.cuda.empty_cache()
+
+            self.load_model(model)
+            self.load_loras(loras)
+
+            encoder_fp = self._text_encoder_fingerprint(loras)
+            seeds = [
+                item["seed"] if item.get("seed") is not None else random.randint(0, 2**32 - 1)
+                for item in items
+            ]
+            use_negative = any(item.get("negative_prompt") for item in items)
+
+            conditionings, pooleds = [], []
+            neg_conditionings, neg_pooleds = [], []
+            for item in items:
+                enhanced_prompt = self.enhance_prompt_with_trigger_words(item["prompt"], loras)
+                conditioning, pooled = self._encode_prompt(enhanced_prompt, encoder_fp)
+                conditionings.append(conditioning)
+                pooleds.append(pooled)
+                if use_negative:
+                    neg_conditioning, neg_pooled = self._encode_prompt(item.get("negative_prompt") or "", encoder_fp)
+                    neg_conditionings.append(neg_conditioning)
+                    neg_pooleds.append(neg_pooled)
+
+            # Longueurs de tokens alignees (prompts longs = plusieurs chunks de 77)
+            padded = self.compel.pad_conditioning_tensors_to_same_length(conditionings + neg_conditionings)
+            conditionings, neg_conditionings = padded[:len(items)], padded[len(items):]
+
+            def call(indices: List[int]):
+                kwargs = {
+                    "prompt_embeds": torch.cat([conditionings[i] for i in indices]),
+                    "pooled_prompt_embeds": torch.cat([pooleds[i] for i in indices]),
+                }
+                if use_negative:
+                    kwargs["negative_prompt_embeds"] = torch.cat([neg_conditionings[i] for i in indices])
+                    kwargs["negative_pooled_prompt_embeds"] = torch.cat([neg_pooleds[i] for i in indices])
+                return self._run_pipe(
+                    progress,
+                    len(indices),
+                    **kwargs,
+                    num_inference_steps=steps,
+                    guidance_scale=guidance_scale,
+                    generator=self._generators([seeds[i] for i in indices]),
+                    height=IMAGE_SIZE[1],
+                    width=IMAGE_SIZE[0],
+                )
+
+            logger.info("Generation batch x%d (steps=%d, cfg=%s)", len(items), steps, guidance_scale)
+            indices = list(range(len(items)))
+            if progress is not None:
+                progress.expect(steps)
+            try:
+                images = call(indices)
+            except torch.cuda.OutOfMemoryError:
+                # Repli sequentiel : memes seeds, memes embeddings
+                logger.warning("OOM en batch x%d, repli sequentiel", len(items))
+                gc.collect()
+                torch.cuda.empty_cache()
+                if progress is not None:
+                    progress.expect(steps * len(items))
+                images = []
+                for i in indices:
+                    images.extend(call([i]))
+
+            torch.cuda.empty_cache()
+            logger.info("Generation batch terminee")
+            return images, seeds
+
+        except Exception:
+            logger.error("Batch generation failed", exc_info=True)
+            torch.cuda.empty_cache()
+            raise
+
+
 # Singleton instance
 pipeline = FlexiblePipeline()
@@ -0,0 +1,129 @@
+"""
+Post-traitement des images generees hors de la boucle GPU du worker.
+
+Le worker Celery (--pool=solo, concurrency 1) occupe le seul slot GPU pendant
+toute la tache : encoder et ecrire les fichiers dans ce slot laisse le GPU
+inactif. OutputWriter execute ces ecritures dans un pool de threads (les
+encodeurs Pillow relachent le GIL pendant la compression) et la tache passe
+au job suivant des que le debruitage est termine.
+
+Les images passent telles quelles (objets PIL, aucune copie). Le nombre
+d'ecritures en attente est borne (max_pending) : si l'encodage prend du
+retard, submit() bloque et le GPU attend au lieu d'accumuler des images en
+memoire.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional
+
+from app.config import OUTPUT_WRITER_MAX_PENDING, OUTPUT_WRITER_THREADS
+
+logger = logging.getLogger(__name__)
+
+
+class OutputWriter:
+    """Pool d'ecriture borne ; threads = 0 ecrit de facon synchrone"""
+
+    def __init__(
+        self,
+        threads: int = OUTPUT_WRITER_THREADS,
+        max_pending: int = OUTPUT_WRITER_MAX_PENDING,
+        clock: Callable[[], float] = time.perf_counter,
+    ):
+        self.threads = threads
+        self.max_pending = max(1, max_pending)
+        self.clock = clock
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._futures = set()
+        self.completed = 0
+        self.failed = 0
+        self.write_seconds = 0.0
+        self.blocked_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threads > 0
+
+    def submit(self, func: Callable, *args) -> Future:
+        """
+        Execute func(*args) dans le pool. Les erreurs restent dans le Future :
+        func doit gerer lui-meme la finalisation d'un job en echec.
+        """
+        if not self.enabled:
+            future = Future()
+            self._run(future, func, args)
+            return future
+
+        start = self.clock()
+        self._slots.acquire()
+        waited = self.clock() - start
+        future = Future()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.threads, thread_name_prefix="output-writer"
+                )
+            self.blocked_seconds += waited
+            self._futures.add(future)
+        try:
+            self._executor.submit(self._run, future, func, args)
+        except Exception:
+            with self._lock:
+                self._futures.discard(future)
+            self._slots.release()
+            raise
+        return future
+
+    def _run(self, future: Future, func: Callable, args) -> None:
+        start = self.clock()
+        result = error = None
+        try:
+            result = func(*args)
+        except Exception as exc:
+            logger.warning("Post-traitement en echec: %s", exc)
+            error = exc
+        with self._lock:
+            self.write_seconds += self.clock() - start
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+            if future in self._futures:
+                self._futures.discard(future)
+                self._slots.release()
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Attend les ecritures en cours (arret du worker), True si toutes terminees"""
+        with self._lock:
+            pending = list(self._futures)
+        if not pending:
+            return True
+        _, not_done = wait(pending, timeout=timeout)
+        if not_done:
+            logger.warning("%d ecritures d'images non terminees a l'arret", len(not_done))
+        return not not_done
+
+    def stats(self) -> Dict:
+        with self._lock:
+            done = self.completed + self.failed
+            return {
+                "threads": self.threads,
+                "pending": len(self._futures),
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_write_ms": round(self.write_seconds / done * 1000, 1) if done else None,
+                "blocked_seconds": round(self.blocked_seconds, 3),
+            }
+
+
+writer = OutputWriter()
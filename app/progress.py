@@ -0,0 +1,188 @@
+"""
+Progression par etape de debruitage et debit reel du GPU.
+
+StepProgress est passe au pipeline diffusers (callback_on_step_end) : il
+compte les etapes de tous les appels UNet d'un job, mesure les secondes par
+etape et publie step/total/ETA au plus une fois par intervalle (les ecritures
+Redis ne ralentissent pas la boucle de debruitage).
+
+ThroughputStats cumule le debit mesure par (modele, resolution, nombre de
+LoRAs, images par forward) dans Redis pour la planification de capacite.
+"""
+
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.config import PROGRESS_MIN_INTERVAL
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+THROUGHPUT_KEY = "imagen:metrics:throughput"
+
+# Plage de "progress" (%) couverte par le debruitage : 10 = generation_gpu,
+# 90 = sauvegarde (voir app.worker)
+PROGRESS_START = 10
+PROGRESS_END = 90
+
+
+class StepProgress:
+    """
+    Callback step-end diffusers, cumule sur tous les appels pipeline d'un job.
+
+    Le pipeline annonce les etapes prevues (expect), puis encadre chaque appel
+    par begin(batch_size) / end(). Un appel interrompu (OOM) n'est pas compte
+    dans `segments` ; son repli est annonce par un nouvel expect.
+
+    report(meta) recoit:
+        step: "generation_gpu"
+        progress: pourcentage global du job
+        current_step / total_steps: etapes UNet faites / prevues
+        sec_per_step: moyenne mesuree sur les etapes faites
+        eta_seconds: estimation du debruitage restant
+    """
+
+    def __init__(
+        self,
+        report: Callable[[Dict], None],
+        min_interval: float = PROGRESS_MIN_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.report = report
+        self.min_interval = min_interval
+        self.clock = clock
+        self.total_steps = 0
+        self.current_step = 0
+        self.reports = 0
+        # Appels termines: [{batch_size, steps, seconds}]
+        self.segments: List[Dict] = []
+        self._segment: Optional[Dict] = None
+        self._measured_steps = 0
+        self._measured_seconds = 0.0
+        self._last_report: Optional[float] = None
+
+    def expect(self, steps: int) -> None:
+        self.total_steps += steps
+
+    def begin(self, batch_size: int) -> None:
+        now = self.clock()
+        self._segment = {"batch_size": batch_size, "steps": 0, "started_at": now, "last_at": now}
+
+    def end(self) -> None:
+        segment, self._segment = self._segment, None
+        if segment is None or segment["steps"] == 0:
+            return
+        seconds = segment["last_at"] - segment["started_at"]
+        self._measured_steps += segment["steps"]
+        self._measured_seconds += seconds
+        self.segments.append(
+            {"batch_size": segment["batch_size"], "steps": segment["steps"], "seconds": seconds}
+        )
+
+    @property
+    def sec_per_step(self) -> Optional[float]:
+        steps, seconds = self._measured_steps, self._measured_seconds
+        if self._segment is not None:
+            steps += self._segment["steps"]
+            seconds += self._segment["last_at"] - self._segment["started_at"]
+        return seconds / steps if steps else None
+
+    def meta(self) -> Dict:
+        sec_per_step = self.sec_per_step
+        total = max(self.total_steps, self.current_step, 1)
+        remaining = max(self.total_steps - self.current_step, 0)
+        return {
+            "step": "generation_gpu",
+            "progress": PROGRESS_START + int((PROGRESS_END - PROGRESS_START) * self.current_step / total),
+            "current_step": self.current_step,
+            "total_steps": self.total_steps,
+            "sec_per_step": None if sec_per_step is None else round(sec_per_step, 3),
+            "eta_seconds": None if sec_per_step is None else round(remaining * sec_per_step, 1),
+        }
+
+    def __call__(self, pipe, step_index: int, timestep, callback_kwargs: Dict) -> Dict:
+        now = self.clock()
+        if self._segment is None:
+            self.begin(1)
+        self._segment["steps"] += 1
+        self._segment["last_at"] = now
+        self.current_step += 1
+
+        last_step = self.current_step >= self.total_steps
+        if last_step or self._last_report is None or now - self._last_report >= self.min_interval:
+            self._last_report = now
+            self.reports += 1
+            try:
+                self.report(self.meta())
+            except Exception as exc:
+                # La progression ne doit jamais interrompre la generation
+                logger.warning("Progression non publiee: %s", exc)
+        return callback_kwargs
+
+
+def throughput_key(model: str, width: int, height: int, lora_count: int, batch_size: int) -> str:
+    return f"{model}|{width}x{height}|loras={lora_count}|batch={batch_size}"
+
+
+class ThroughputStats:
+    """
+    Debit mesure par configuration (hash Redis THROUGHPUT_KEY).
+
+    Champs: {cle}:runs, {cle}:steps, {cle}:seconds
+    """
+
+    def __init__(self, redis_client=None):
+        self._redis = redis_client
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    def record(
+        self,
+        model: str,
+        width: int,
+        height: int,
+        lora_count: int,
+        batch_size: int,
+        steps: int,
+        seconds: float,
+    ) -> None:
+        if steps <= 0 or seconds <= 0:
+            return
+        key = throughput_key(model, width, height, lora_count, batch_size)
+        pipe = self.redis.pipeline()
+        pipe.hincrby(THROUGHPUT_KEY, f"{key}:runs", 1)
+        pipe.hincrby(THROUGHPUT_KEY, f"{key}:steps", steps)
+        pipe.hincrbyfloat(THROUGHPUT_KEY, f"{key}:seconds", seconds)
+        pipe.execute()
+
+    def stats(self) -> Dict[str, Dict]:
+        """{cle: {model, resolution, loras, batch_size, runs, steps, seconds, it_per_s, sec_per_step}}"""
+        grouped: Dict[str, Dict[str, float]] = {}
+        for field, value in self.redis.hgetall(THROUGHPUT_KEY).items():
+            key, _, counter = field.rpartition(":")
+            grouped.setdefault(key, {})[counter] = float(value)
+
+        stats = {}
+        for key, counters in sorted(grouped.items()):
+            model, resolution, loras, batch = key.split("|")
+            steps = int(counters.get("steps", 0))
+            seconds = counters.get("seconds", 0.0)
+            stats[key] = {
+                "model": model,
+                "resolution": resolution,
+                "loras": int(loras.split("=", 1)[1]),
+                "batch_size": int(batch.split("=", 1)[1]),
+                "runs": int(counters.get("runs", 0)),
+                "steps": steps,
+                "seconds": round(seconds, 3),
+                "it_per_s": round(steps / seconds, 3) if seconds else None,
+                "sec_per_step": round(seconds / steps, 4) if steps else None,
+            }
+        return stats
+
+
+# Instance partagee (worker: record, API: stats)
+throughput = ThroughputStats()
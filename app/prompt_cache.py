@@ -0,0 +1,129 @@
+"""
+Cache des embeddings de prompt Compel (conditioning, pooled).
+
+Cle: modele + empreinte des text encoders (LoRAs appliques aux encoders) +
+prompt final. Un changement de modele ou de LoRA texte change l'empreinte,
+donc la cle : les anciennes entrees ne sont plus lues et sortent par LRU.
+
+Deux niveaux: LRU en memoire (tenseurs CPU) et tier disque optionnel (.pt).
+"""
+
+import hashlib
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _torch_save(obj: Any, path: Path) -> None:
+    import torch
+
+    torch.save(obj, path)
+
+
+def _torch_load(path: Path) -> Any:
+    import torch
+
+    return torch.load(path, map_location="cpu")
+
+
+class PromptEmbeddingCache:
+    """LRU memoire + tier disque optionnel pour les sorties de Compel"""
+
+    def __init__(
+        self,
+        max_entries: int,
+        disk_dir: Optional[Path] = None,
+        max_disk_entries: int = 0,
+        save: Callable[[Any, Path], None] = _torch_save,
+        load: Callable[[Path], Any] = _torch_load,
+    ):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self._save = save
+        self._load = load
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._disk_count = 0
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_count = sum(1 for _ in self.disk_dir.glob("*.pt"))
+
+    @staticmethod
+    def make_key(model_id: str, encoder_fingerprint: str, prompt: str) -> str:
+        raw = f"{model_id}\0{encoder_fingerprint}\0{prompt}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, model_id: str, encoder_fingerprint: str, prompt: str) -> Optional[Any]:
+        key = self.make_key(model_id, encoder_fingerprint, prompt)
+
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return value
+
+        if self.disk_dir is not None:
+            path = self.disk_dir / f"{key}.pt"
+            if path.exists():
+                try:
+                    value = self._load(path)
+                except Exception as e:
+                    logger.warning("Embedding disque illisible %s: %s", path.name, e)
+                    path.unlink(missing_ok=True)
+                else:
+                    path.touch()  # mtime = LRU du tier disque
+                    self.disk_hits += 1
+                    self._remember(key, value)
+                    return value
+
+        self.misses += 1
+        return None
+
+    def put(self, model_id: str, encoder_fingerprint: str, prompt: str, value: Any) -> None:
+        key = self.make_key(model_id, encoder_fingerprint, prompt)
+        self._remember(key, value)
+
+        if self.disk_dir is not None:
+            path = self.disk_dir / f"{key}.pt"
+            if not path.exists():
+                tmp_path = path.with_suffix(".tmp")
+                self._save(value, tmp_path)
+                tmp_path.rename(path)
+                self._disk_count += 1
+                if self._disk_count > self.max_disk_entries:
+                    self._prune_disk()
+
+    def _remember(self, key: str, value: Any) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _prune_disk(self) -> None:
+        files = sorted(self.disk_dir.glob("*.pt"), key=lambda p: p.stat().st_mtime)
+        excess = len(files) - self.max_disk_entries
+        for path in files[:max(excess, 0)]:
+            path.unlink(missing_ok=True)
+        self._disk_count = min(len(files), self.max_disk_entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "entries": len(self._entries),
+            "disk_entries": self._disk_count,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,28 @@
+"""
+Clients Redis partages entre l'API et le worker
+"""
+
+from app.config import REDIS_URL
+
+_client = None
+_async_client = None
+
+
+def get_redis():
+    """Retourne le client Redis du processus (cree a la premiere utilisation)"""
+    global _client
+    if _client is None:
+        import redis
+
+        _client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _client
+
+
+def get_async_redis():
+    """Client Redis asyncio du processus (abonnements pub/sub de l'API)"""
+    global _async_client
+    if _async_client is None:
+        import redis.asyncio
+
+        _async_client = redis.asyncio.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _async_client
@@ -0,0 +1,250 @@
+"""
+Stockage SQLite (WAL) des metadonnees de references.
+
+Remplace la reecriture complete de metadata.json a chaque mutation : une
+ligne par entite, une ligne par image, mises a jour unitaires dans des
+transactions. Le mode WAL laisse les lectures (API, worker) concurrentes
+d'une ecriture, y compris entre processus.
+
+Au premier demarrage, un metadata.json existant est importe dans la meme
+transaction que la creation du schema, puis renomme en metadata.json.migrated.
+"""
+
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from app.sqlite_utils import ThreadLocalDB
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    name TEXT PRIMARY KEY,
+    category TEXT NOT NULL,
+    description TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entities_category ON entities(category);
+CREATE TABLE IF NOT EXISTS images (
+    entity TEXT NOT NULL REFERENCES entities(name) ON DELETE CASCADE,
+    subtype TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    original_name TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    uploaded_at TEXT NOT NULL,
+    embedding_cached INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (entity, subtype)
+);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO store_meta (key, value) VALUES ('generation', '0');
+"""
+
+# Compteur de generation incremente par toute ecriture (tous processus) :
+# les caches de resolution le comparent au lieu de relire les lignes
+GENERATION_TRIGGERS = "\n".join(
+    f"CREATE TRIGGER IF NOT EXISTS generation_{table}_{event.lower()} AFTER {event} ON {table} "
+    f"BEGIN UPDATE store_meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'generation'; END;"
+    for table in ("entities", "images")
+    for event in ("INSERT", "UPDATE", "DELETE")
+)
+
+ENTITY_COLUMNS = ("name", "category", "description", "created_at")
+IMAGE_COLUMNS = (
+    "subtype", "filename", "original_name", "width", "height", "uploaded_at", "embedding_cached",
+)
+
+
+def _image_row(row: Tuple) -> Dict:
+    image = dict(zip(IMAGE_COLUMNS, row))
+    image["embedding_cached"] = bool(image["embedding_cached"])
+    return image
+
+
+class ReferenceStore:
+    """
+    Acces SQLite aux entites et images de reference (dicts bruts, les modeles
+    pydantic restent dans app.references).
+
+    Une connexion par thread : les handlers API tournent dans un pool.
+    """
+
+    def __init__(self, db_path: Path, legacy_json: Optional[Path] = None, busy_timeout: float = 30.0):
+        self.db_path = db_path
+        self.legacy_json = legacy_json
+        self._db = ThreadLocalDB(db_path, initialize=self._initialize, busy_timeout=busy_timeout)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        return self._db.conn
+
+    def transaction(self):
+        """Transaction d'ecriture (BEGIN IMMEDIATE : verrou pris des le debut)"""
+        return self._db.transaction()
+
+    def close(self) -> None:
+        self._db.close()
+
+    # ------------------------------------------------------ schema/migration
+
+    def _initialize(self, conn: sqlite3.Connection) -> None:
+        conn.executescript(SCHEMA + GENERATION_TRIGGERS)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM store_meta WHERE key = 'schema_version'").fetchone()
+            migrated = 0
+            if row is None:
+                migrated = self._import_legacy_json(conn)
+                conn.execute(
+                    "INSERT INTO store_meta (key, value) VALUES ('schema_version', ?)",
+                    (str(SCHEMA_VERSION),),
+                )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+        if migrated:
+            logger.info("metadata.json migre vers SQLite (%d entites)", migrated)
+            try:
+                self.legacy_json.rename(self.legacy_json.with_name(self.legacy_json.name + ".migrated"))
+            except OSError as e:
+                logger.warning("metadata.json migre mais non renomme: %s", e)
+
+    def _import_legacy_json(self, conn: sqlite3.Connection) -> int:
+        if self.legacy_json is None or not self.legacy_json.exists():
+            return 0
+        try:
+            data = json.loads(self.legacy_json.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning("metadata.json illisible, migration ignoree: %s", e)
+            return 0
+        entities = data.get("entities", {})
+        self._insert_all(conn, entities)
+        return len(entities)
+
+    @staticmethod
+    def _insert_all(conn: sqlite3.Connection, entities: Dict[str, Dict]) -> None:
+        for name, entity in entities.items():
+            conn.execute(
+                "INSERT INTO entities (name, category, description, created_at) VALUES (?, ?, ?, ?)",
+                (name, entity["category"], entity.get("description"), entity["created_at"]),
+            )
+            for subtype, image in (entity.get("references") or {}).items():
+                conn.execute(
+                    "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        name,
+                        subtype,
+                        image["filename"],
+                        image["original_name"],
+                        image["width"],
+                        image["height"],
+                        image["uploaded_at"],
+                        int(image.get("embedding_cached", False)),
+                    ),
+                )
+
+    # --------------------------------------------------------------- lecture
+
+    def get_entity(self, name: str) -> Optional[Dict]:
+        """{name, category, description, created_at, references: {subtype: image}}"""
+        row = self.conn.execute(
+            "SELECT name, category, description, created_at FROM entities WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            return None
+        entity = dict(zip(ENTITY_COLUMNS, row))
+        entity["references"] = {
+            image[0]: _image_row(image)
+            for image in self.conn.execute(
+                f"SELECT {', '.join(IMAGE_COLUMNS)} FROM images WHERE entity = ? ORDER BY rowid",
+                (name,),
+            )
+        }
+        return entity
+
+    def list_entities(self, category: Optional[str] = None) -> Dict[str, Dict]:
+        """Entites (filtre optionnel par categorie, index) avec leurs images"""
+        where, params = ("WHERE e.category = ?", (category,)) if category else ("", ())
+        entities: Dict[str, Dict] = {}
+        for row in self.conn.execute(
+            f"SELECT name, category, description, created_at FROM entities e {where} ORDER BY e.rowid",
+            params,
+        ):
+            entities[row[0]] = {**dict(zip(ENTITY_COLUMNS, row)), "references": {}}
+        for row in self.conn.execute(
+            f"SELECT i.entity, {', '.join('i.' + c for c in IMAGE_COLUMNS)} "
+            f"FROM images i JOIN entities e ON e.name = i.entity {where} ORDER BY i.rowid",
+            params,
+        ):
+            entities[row[0]]["references"][row[1]] = _image_row(row[1:])
+        return entities
+
+    # -------------------------------------------------------------- ecriture
+
+    def insert_entity(
+        self,
+        conn: sqlite3.Connection,
+        name: str,
+        category: str,
+        description: Optional[str],
+        created_at: str,
+    ) -> bool:
+        """False si l'entite existe deja"""
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO entities (name, category, description, created_at) VALUES (?, ?, ?, ?)",
+            (name, category, description, created_at),
+        )
+        return cursor.rowcount == 1
+
+    def upsert_image(self, conn: sqlite3.Connection, entity: str, image: Dict) -> None:
+        # ON CONFLICT garde la ligne (et l'ordre des sous-types) en cas de re-upload
+        conn.execute(
+            "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (entity, subtype) DO UPDATE SET filename = excluded.filename, "
+            "original_name = excluded.original_name, width = excluded.width, "
+            "height = excluded.height, uploaded_at = excluded.uploaded_at, "
+            "embedding_cached = excluded.embedding_cached",
+            (entity, *[int(image[c]) if c == "embedding_cached" else image[c] for c in IMAGE_COLUMNS]),
+        )
+
+    def delete_entity(self, conn: sqlite3.Connection, name: str) -> None:
+        conn.execute("DELETE FROM entities WHERE name = ?", (name,))
+
+    def delete_image(self, conn: sqlite3.Connection, entity: str, subtype: str) -> None:
+        conn.execute("DELETE FROM images WHERE entity = ? AND subtype = ?", (entity, subtype))
+
+    def set_embedding_cached(self, entity: str, subtype: str, cached: bool = True) -> bool:
+        cursor = self.conn.execute(
+            "UPDATE images SET embedding_cached = ? WHERE entity = ? AND subtype = ?",
+            (int(cached), entity, subtype),
+        )
+        return cursor.rowcount == 1
+
+    def replace_all(self, entities: Dict[str, Dict]) -> None:
+        """Remplace tout le contenu (save_metadata: snapshot complet)"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM images")
+            conn.execute("DELETE FROM entities")
+            self._insert_all(conn, entities)
+
+    def generation(self) -> int:
+        """Incremente a chaque ecriture sur entities/images (triggers)"""
+        return int(
+            self.conn.execute("SELECT value FROM store_meta WHERE key = 'generation'").fetchone()[0]
+        )
+
+    def counts(self) -> Dict[str, int]:
+        entities, images = self.conn.execute(
+            "SELECT (SELECT COUNT(*) FROM entities), (SELECT COUNT(*) FROM images)"
+        ).fetchone()
+        return {"entities": entities, "images": images}
@@ -2,9 +2,8 @@
 Gestionnaire de references graphiques (personnages, backgrounds, poses)
 """
 
-import fcntl
-import json
 import shutil
+import threading
 from datetime import datetime, timezone
 from io import BytesIO
 from pathlib import Path
@@ -17,9 +16,11 @@ from app.config import (
     CATEGORY_SUBTYPES,
     MAX_REFERENCE_IMAGE_SIZE,
     REFERENCE_CATEGORIES,
+    REFERENCE_DB_FILE,
     REFERENCE_DIR,
     REFERENCE_METADATA_FILE,
 )
+from app.reference_store import ReferenceStore
 
 ALLOWED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
 
@@ -31,6 +32,92 @@ CATEGORY_DIRS = {
 }
 
 
+# Metadonnees en SQLite (app.reference_store), metadata.json migre au premier acces
+_store: Optional[ReferenceStore] = None
+
+
+def get_store() -> ReferenceStore:
+    """Store du processus (cree a la premiere utilisation)"""
+    global _store
+    if _store is None:
+        _store = ReferenceStore(REFERENCE_DB_FILE, legacy_json=REFERENCE_METADATA_FILE)
+    return _store
+
+
+class ResolutionCache:
+    """
+    Memo par processus des entites resolues (categorie, chemins, existence des
+    fichiers) pour le chemin de generation.
+
+    Valide pour une generation du store (incrementee par toute ecriture, y
+    compris depuis le worker) : une generation differente vide le memo.
+    Les fichiers image/embedding ne changent qu'avec une ecriture du store
+    (upload, suppression, mark_embedding_cached).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation: Optional[tuple] = None  # (store, generation)
+        # {entite: {"category", "subtypes": {subtype: {path, exists, embedding_path}}} | None}
+        self._entries: Dict[str, Optional[Dict]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, store: ReferenceStore, entity_name: str) -> Optional[Dict]:
+        generation = (id(store), store.generation())
+        with self._lock:
+            if generation != self._generation:
+                if self._generation is not None:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._generation = generation
+            if entity_name in self._entries:
+                self.hits += 1
+                return self._entries[entity_name]
+            self.misses += 1
+
+        resolved = self._resolve(entity_name, store.get_entity(entity_name))
+        with self._lock:
+            if self._generation == generation:
+                self._entries[entity_name] = resolved
+        return resolved
+
+    @staticmethod
+    def _resolve(entity_name: str, row: Optional[Dict]) -> Optional[Dict]:
+        if row is None:
+            return None
+        entity_dir = ReferenceManager._entity_dir(row["category"], entity_name)
+        subtypes = {}
+        for subtype, image in row["references"].items():
+            image_path = entity_dir / image["filename"]
+            embedding_path = entity_dir / f"{subtype}.pt"
+            subtypes[subtype] = {
+                "path": image_path,
+                "exists": image_path.exists(),
+                "embedding_path": embedding_path if embedding_path.exists() else None,
+            }
+        return {"category": row["category"], "subtypes": subtypes}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generation = None
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+_resolution_cache = ResolutionCache()
+
+
 # ============================================
 # MODELES PYDANTIC
 # ============================================
@@ -82,33 +169,33 @@ class ReferenceManager:
 
     @staticmethod
     def load_metadata() -> ReferenceMetadata:
-        if not REFERENCE_METADATA_FILE.exists():
-            return ReferenceMetadata()
-        try:
-            data = json.loads(REFERENCE_METADATA_FILE.read_text(encoding="utf-8"))
-            return ReferenceMetadata(**data)
-        except (json.JSONDecodeError, Exception):
-            return ReferenceMetadata()
+        """Snapshot complet des metadonnees (export, outils)"""
+        return ReferenceMetadata(entities=ReferenceManager.list_entities())
 
     @staticmethod
     def save_metadata(metadata: ReferenceMetadata) -> None:
-        REFERENCE_METADATA_FILE.parent.mkdir(parents=True, exist_ok=True)
-        tmp_path = REFERENCE_METADATA_FILE.with_suffix(".tmp")
-        content = json.dumps(metadata.model_dump(), indent=2, ensure_ascii=False)
-
-        with open(tmp_path, "w", encoding="utf-8") as f:
-            fcntl.flock(f, fcntl.LOCK_EX)
-            f.write(content)
-            f.flush()
-            fcntl.flock(f, fcntl.LOCK_UN)
-
-        tmp_path.rename(REFERENCE_METADATA_FILE)
+        """Remplace toutes les metadonnees par le snapshot (une transaction)"""
+        get_store().replace_all(
+            {name: entity.model_dump() for name, entity in metadata.entities.items()}
+        )
 
     @staticmethod
     def _entity_dir(category: str, entity_name: str) -> Path:
         subdir = CATEGORY_DIRS.get(category, category)
         return REFERENCE_DIR / subdir / entity_name
 
+    @staticmethod
+    def _to_entity(row: Dict) -> ReferenceEntity:
+        return ReferenceEntity(
+            category=row["category"],
+            description=row["description"],
+            created_at=row["created_at"],
+            references={
+                subtype: ReferenceImage(**{k: v for k, v in image.items() if k != "subtype"})
+                for subtype, image in row["references"].items()
+            },
+        )
+
     @staticmethod
     def create_entity(
         name: str, category: str, description: Optional[str] = None
@@ -119,21 +206,18 @@ class ReferenceManager:
                 f"Utiliser: {', '.join(REFERENCE_CATEGORIES)}"
             )
 
-        metadata = ReferenceManager.load_metadata()
-
-        if name in metadata.entities:
-            raise ValueError(f"L'entite '{name}' existe deja")
-
-        entity_dir = ReferenceManager._entity_dir(category, name)
-        entity_dir.mkdir(parents=True, exist_ok=True)
-
         entity = ReferenceEntity(
             category=category,
             description=description,
             created_at=datetime.now(timezone.utc).isoformat(),
         )
-        metadata.entities[name] = entity
-        ReferenceManager.save_metadata(metadata)
+
+        store = get_store()
+        with store.transaction() as conn:
+            if not store.insert_entity(conn, name, category, description, entity.created_at):
+                raise ValueError(f"L'entite '{name}' existe deja")
+            entity_dir = ReferenceManager._entity_dir(category, name)
+            entity_dir.mkdir(parents=True, exist_ok=True)
 
         return entity
 
@@ -144,17 +228,16 @@ class ReferenceManager:
         image_data: bytes,
         original_filename: str,
     ) -> ReferenceImage:
-        metadata = ReferenceManager.load_metadata()
+        store = get_store()
+        entity = store.get_entity(entity_name)
 
-        if entity_name not in metadata.entities:
+        if entity is None:
             raise ValueError(f"Entite '{entity_name}' non trouvee")
 
-        entity = metadata.entities[entity_name]
-
-        allowed_subtypes = CATEGORY_SUBTYPES.get(entity.category, [])
+        allowed_subtypes = CATEGORY_SUBTYPES.get(entity["category"], [])
         if subtype not in allowed_subtypes:
             raise ValueError(
-                f"Sous-type '{subtype}' invalide pour categorie '{entity.category}'. "
+                f"Sous-type '{subtype}' invalide pour categorie '{entity['category']}'. "
                 f"Utiliser: {', '.join(allowed_subtypes)}"
             )
 
@@ -179,19 +262,11 @@ class ReferenceManager:
 
         img = _center_crop_resize(img, 1024, 1024)
 
-        # Sauvegarder
-        entity_dir = ReferenceManager._entity_dir(entity.category, entity_name)
-        entity_dir.mkdir(parents=True, exist_ok=True)
+        # Encodage PNG hors transaction : seule l'ecriture tient le verrou
+        png = BytesIO()
+        img.save(png, "PNG")
 
         filename = f"{subtype}.png"
-        filepath = entity_dir / filename
-        img.save(filepath, "PNG")
-
-        # Supprimer embedding cache si existant (sera recalcule)
-        embedding_path = entity_dir / f"{subtype}.pt"
-        if embedding_path.exists():
-            embedding_path.unlink()
-
         ref_image = ReferenceImage(
             filename=filename,
             original_name=original_filename,
@@ -201,77 +276,82 @@ class ReferenceManager:
             embedding_cached=False,
         )
 
-        entity.references[subtype] = ref_image
-        ReferenceManager.save_metadata(metadata)
+        with store.transaction() as conn:
+            # L'entite a pu etre supprimee pendant le traitement de l'image
+            if store.get_entity(entity_name) is None:
+                raise ValueError(f"Entite '{entity_name}' non trouvee")
+
+            # Sauvegarder
+            entity_dir = ReferenceManager._entity_dir(entity["category"], entity_name)
+            entity_dir.mkdir(parents=True, exist_ok=True)
+            (entity_dir / filename).write_bytes(png.getvalue())
+
+            # Supprimer embedding cache si existant (sera recalcule)
+            embedding_path = entity_dir / f"{subtype}.pt"
+            if embedding_path.exists():
+                embedding_path.unlink()
+
+            store.upsert_image(conn, entity_name, {"subtype": subtype, **ref_image.model_dump()})
 
         return ref_image
 
     @staticmethod
     def delete_entity(name: str) -> int:
-        metadata = ReferenceManager.load_metadata()
-
-        if name not in metadata.entities:
-            raise ValueError(f"Entite '{name}' non trouvee")
+        store = get_store()
+        with store.transaction() as conn:
+            entity = store.get_entity(name)
+            if entity is None:
+                raise ValueError(f"Entite '{name}' non trouvee")
 
-        entity = metadata.entities[name]
-        entity_dir = ReferenceManager._entity_dir(entity.category, name)
-        images_count = len(entity.references)
+            entity_dir = ReferenceManager._entity_dir(entity["category"], name)
+            images_count = len(entity["references"])
 
-        if entity_dir.exists():
-            shutil.rmtree(entity_dir)
+            if entity_dir.exists():
+                shutil.rmtree(entity_dir)
 
-        del metadata.entities[name]
-        ReferenceManager.save_metadata(metadata)
+            store.delete_entity(conn, name)
 
         return images_count
 
     @staticmethod
     def delete_image(entity_name: str, subtype: str) -> None:
-        metadata = ReferenceManager.load_metadata()
-
-        if entity_name not in metadata.entities:
-            raise ValueError(f"Entite '{entity_name}' non trouvee")
-
-        entity = metadata.entities[entity_name]
-
-        if subtype not in entity.references:
-            raise ValueError(
-                f"Sous-type '{subtype}' non trouve pour '{entity_name}'"
-            )
+        store = get_store()
+        with store.transaction() as conn:
+            entity = store.get_entity(entity_name)
+            if entity is None:
+                raise ValueError(f"Entite '{entity_name}' non trouvee")
+
+            if subtype not in entity["references"]:
+                raise ValueError(
+                    f"Sous-type '{subtype}' non trouve pour '{entity_name}'"
+                )
 
-        entity_dir = ReferenceManager._entity_dir(entity.category, entity_name)
+            entity_dir = ReferenceManager._entity_dir(entity["category"], entity_name)
 
-        # Supprimer image + embedding
-        image_path = entity_dir / entity.references[subtype].filename
-        if image_path.exists():
-            image_path.unlink()
+            # Supprimer image + embedding
+            image_path = entity_dir / entity["references"][subtype]["filename"]
+            if image_path.exists():
+                image_path.unlink()
 
-        embedding_path = entity_dir / f"{subtype}.pt"
-        if embedding_path.exists():
-            embedding_path.unlink()
+            embedding_path = entity_dir / f"{subtype}.pt"
+            if embedding_path.exists():
+                embedding_path.unlink()
 
-        del entity.references[subtype]
-        ReferenceManager.save_metadata(metadata)
+            store.delete_image(conn, entity_name, subtype)
 
     @staticmethod
     def list_entities(
         category: Optional[str] = None,
     ) -> Dict[str, ReferenceEntity]:
-        metadata = ReferenceManager.load_metadata()
-
-        if category is None:
-            return metadata.entities
-
         return {
-            name: entity
-            for name, entity in metadata.entities.items()
-            if entity.category == category
+            name: ReferenceManager._to_entity(row)
+            for name, row in get_store().list_entities(category).items()
         }
 
     @staticmethod
     def get_entity(name: str) -> Optional[ReferenceEntity]:
-        metadata = ReferenceManager.load_metadata()
-        return metadata.entities.get(name)
+        row = get_store().get_entity(name)
+        return ReferenceManager._to_entity(row) if row is not None else None
 
     @staticmethod
     def resolve_references(
@@ -286,42 +366,35 @@ class ReferenceManager:
         Raises:
             ValueError si une reference est manquante ou embeddings pas prets.
         """
-        metadata = ReferenceManager.load_metadata()
+        store = get_store()
         resolved = []
 
         for ref in refs:
-            if ref.entity not in metadata.entities:
+            entity = _resolution_cache.get(store, ref.entity)
+            if entity is None:
                 raise ValueError(f"Reference '{ref.entity}' non trouvee")
 
-            entity = metadata.entities[ref.entity]
-
             for subtype in ref.types:
-                if subtype not in entity.references:
+                if subtype not in entity["subtypes"]:
                     raise ValueError(
                         f"Type '{subtype}' non trouve pour '{ref.entity}'. "
-                        f"Disponibles: {list(entity.references.keys())}"
+                        f"Disponibles: {list(entity['subtypes'].keys())}"
                     )
 
-                ref_image = entity.references[subtype]
-                entity_dir = ReferenceManager._entity_dir(
-                    entity.category, ref.entity
-                )
-                image_path = entity_dir / ref_image.filename
-                embedding_path = entity_dir / f"{subtype}.pt"
-
-                if not image_path.exists():
+                image = entity["subtypes"][subtype]
+                if not image["exists"]:
                     raise ValueError(
                         f"Fichier image manquant pour {ref.entity}/{subtype}"
                     )
 
                 resolved.append(
                     {
-                        "path": str(image_path),
+                        "path": str(image["path"]),
                         "strength": ref.strength,
-                        "embedding_path": str(embedding_path)
-                        if embedding_path.exists()
+                        "embedding_path": str(image["embedding_path"])
+                        if image["embedding_path"] is not None
                         else None,
-                        "category": entity.category,
+                        "category": entity["category"],
                     }
                 )
 
@@ -329,35 +402,26 @@ class ReferenceManager:
 
     @staticmethod
     def mark_embedding_cached(entity_name: str, subtype: str) -> None:
-        metadata = ReferenceManager.load_metadata()
-        if entity_name in metadata.entities:
-            entity = metadata.entities[entity_name]
-            if subtype in entity.references:
-                entity.references[subtype].embedding_cached = True
-                ReferenceManager.save_metadata(metadata)
+        get_store().set_embedding_cached(entity_name, subtype)
 
     @staticmethod
     def get_image_path(entity_name: str, subtype: str) -> Optional[Path]:
-        metadata = ReferenceManager.load_metadata()
-        if entity_name not in metadata.entities:
-            return None
-        entity = metadata.entities[entity_name]
-        if subtype not in entity.references:
+        entity = _resolution_cache.get(get_store(), entity_name)
+        if entity is None or subtype not in entity["subtypes"]:
             return None
-        entity_dir = ReferenceManager._entity_dir(entity.category, entity_name)
-        return entity_dir / entity.references[subtype].filename
+        return entity["subtypes"][subtype]["path"]
 
     @staticmethod
     def get_embedding_path(entity_name: str, subtype: str) -> Optional[Path]:
-        metadata = ReferenceManager.load_metadata()
-        if entity_name not in metadata.entities:
-            return None
-        entity = metadata.entities[entity_name]
-        if subtype not in entity.references:
+        entity = _resolution_cache.get(get_store(), entity_name)
+        if entity is None or subtype not in entity["subtypes"]:
             return None
-        entity_dir = ReferenceManager._entity_dir(entity.category, entity_name)
-        path = entity_dir / f"{subtype}.pt"
-        return path if path.exists() else None
+        return entity["subtypes"][subtype]["embedding_path"]
+
+    @staticmethod
+    def cache_stats() -> Dict:
+        """Metriques du memo de resolution (hits, misses, invalidations)"""
+        return _resolution_cache.stats()
 
 
 # ============================================
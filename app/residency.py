@@ -0,0 +1,150 @@
+"""
+Cache de residence des pipelines : garde N pipelines complets (UNet, VAE,
+text encoders, Compel) en RAM CPU pour qu'un retour sur un modele recent soit
+un simple deplacement de device et non un from_pretrained/from_single_file.
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def module_size_bytes(module: Any) -> int:
+    """Taille des parametres + buffers d'un module torch (0 si non applicable)"""
+    total = 0
+    for attr in ("parameters", "buffers"):
+        tensors = getattr(module, attr, None)
+        if not callable(tensors):
+            continue
+        for tensor in tensors():
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def pipeline_module_sizes(pipe: Any) -> Dict[int, int]:
+    """Taille de chaque composant d'un pipeline diffusers, indexee par id()"""
+    components = getattr(pipe, "components", None) or {}
+    return {id(component): module_size_bytes(component) for component in components.values()}
+
+
+def pipeline_size_bytes(pipe: Any) -> int:
+    """Taille memoire d'un pipeline diffusers (somme de ses composants distincts)"""
+    return sum(pipeline_module_sizes(pipe).values())
+
+
+class ResidentPipeline:
+    """Pipeline construit + etat associe (adapters LoRA, IP-Adapter)"""
+
+    def __init__(
+        self,
+        model_id: str,
+        pipe: Any,
+        compel: Any,
+        size_bytes: int = 0,
+        module_sizes: Optional[Dict[int, int]] = None,
+    ):
+        self.model_id = model_id
+        self.pipe = pipe
+        self.compel = compel
+        self.size_bytes = size_bytes
+        # id(composant) -> octets : les composants partages (VAE, tokenizers)
+        # ne sont comptes qu'une fois dans le cache
+        self.module_sizes = module_sizes or {}
+        self.adapters: Any = None  # AdapterManager (LoRAs charges sur ce pipeline)
+        self.fusion: Any = None  # LoRAFusion (combinaisons fusionnees dans l'UNet)
+        self.ip_adapter_loaded = 0  # Nombre d'instances IP-Adapter chargees
+
+
+class PipelineResidencyCache:
+    """
+    LRU borne en nombre d'entrees et en octets.
+
+    L'entree la plus recente n'est jamais evincee, meme si elle depasse seule
+    max_bytes : le pipeline actif doit rester disponible.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int,
+        on_evict: Optional[Callable[[ResidentPipeline], None]] = None,
+    ):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[str, ResidentPipeline]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, model_id: str) -> bool:
+        return model_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        sizes: Dict[Any, int] = {}
+        for entry in self._entries.values():
+            if entry.module_sizes:
+                sizes.update(entry.module_sizes)
+            else:
+                sizes[entry.model_id] = entry.size_bytes
+        return sum(sizes.values())
+
+    def get(self, model_id: str) -> Optional[ResidentPipeline]:
+        entry = self._entries.get(model_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(model_id)
+        self.hits += 1
+        return entry
+
+    def entries(self) -> List[ResidentPipeline]:
+        return list(self._entries.values())
+
+    def peek(self, model_id: str) -> Optional[ResidentPipeline]:
+        """Acces sans effet sur l'ordre LRU ni les compteurs"""
+        return self._entries.get(model_id)
+
+    def reserve(self) -> None:
+        """Libere une place avant de construire un nouveau pipeline (pic RAM)"""
+        while self._entries and len(self._entries) >= self.max_entries:
+            self._evict_oldest()
+
+    def put(self, entry: ResidentPipeline) -> None:
+        self._entries[entry.model_id] = entry
+        self._entries.move_to_end(entry.model_id)
+        self._evict()
+
+    def _evict(self) -> None:
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes
+        ):
+            self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        model_id, entry = self._entries.popitem(last=False)
+        self.evictions += 1
+        logger.info(
+            "Eviction du pipeline %s (%.1f Go)", model_id, entry.size_bytes / 1024**3
+        )
+        if self.on_evict:
+            self.on_evict(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "resident": list(self._entries.keys()),
+            "total_bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
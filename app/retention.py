@@ -0,0 +1,215 @@
+"""
+Retention des images de OUTPUTS_DIR (thread de fond de l'API).
+
+Politique (0 = regle desactivee):
+    - RETENTION_RETRIEVED_HOURS   : suppression N heures apres la derniere
+                                    recuperation (suivi app.retrieval)
+    - RETENTION_UNRETRIEVED_DAYS  : suppression des images jamais recuperees
+                                    M jours apres leur creation
+    - RETENTION_MAX_BYTES         : au-dela, suppression des plus anciennes
+
+Les candidats viennent de requetes indexees (app.retrieval, app.output_index),
+par pages : aucun listdir de OUTPUTS_DIR. Fichiers supprimes et octets
+recuperes sont cumules par regle dans le hash Redis RETENTION_KEY.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.config import (
+    RETENTION_BATCH_SIZE,
+    RETENTION_INTERVAL_SECONDS,
+    RETENTION_MAX_BYTES,
+    RETENTION_RETRIEVED_HOURS,
+    RETENTION_UNRETRIEVED_DAYS,
+)
+from app.derivatives import DerivativeCache, derivatives
+from app.output_index import OutputIndex, output_index
+from app.redis_client import get_redis
+from app.retrieval import RetrievalTracker, retrievals
+
+logger = logging.getLogger(__name__)
+
+RETENTION_KEY = "imagen:metrics:retention"
+REASONS = ("retrieved", "unretrieved", "max_bytes")
+
+
+class RetentionService:
+    """Applique la politique de retention, une passe toutes les `interval` secondes"""
+
+    def __init__(
+        self,
+        index: OutputIndex = output_index,
+        tracker: RetrievalTracker = retrievals,
+        derived: DerivativeCache = derivatives,
+        retrieved_hours: float = RETENTION_RETRIEVED_HOURS,
+        unretrieved_days: float = RETENTION_UNRETRIEVED_DAYS,
+        max_bytes: int = RETENTION_MAX_BYTES,
+        interval: float = RETENTION_INTERVAL_SECONDS,
+        batch_size: int = RETENTION_BATCH_SIZE,
+        clock: Callable[[], float] = time.time,
+        redis_client=None,
+    ):
+        self.index = index
+        self.tracker = tracker
+        self.derived = derived
+        self.retrieved_hours = retrieved_hours
+        self.unretrieved_days = unretrieved_days
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.batch_size = batch_size
+        self.clock = clock
+        self._redis = redis_client
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_run: Optional[Dict] = None
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    # ---------------------------------------------------------------- passe
+
+    def run_once(self) -> Dict[str, Dict[str, int]]:
+        """Une passe complete : {regle: {files, bytes}}"""
+        now = self.clock()
+        deleted = {reason: {"files": 0, "bytes": 0} for reason in REASONS}
+        if self.retrieved_hours > 0:
+            self._expire_retrieved(now - self.retrieved_hours * 3600, deleted["retrieved"])
+        if self.unretrieved_days > 0:
+            self._expire_unretrieved(now - self.unretrieved_days * 86400, deleted["unretrieved"])
+        if self.max_bytes > 0:
+            self._enforce_max_bytes(deleted["max_bytes"])
+
+        self._record(deleted)
+        self.last_run = {"at": now, "duration": round(self.clock() - now, 3), "deleted": deleted}
+        total = sum(counts["files"] for counts in deleted.values())
+        if total:
+            logger.info(
+                "Retention: %d images supprimees (%d octets)",
+                total, sum(counts["bytes"] for counts in deleted.values()),
+            )
+        return deleted
+
+    def _expire_retrieved(self, cutoff: float, counts: Dict[str, int]) -> None:
+        while True:
+            names = [name for name, _ in self.tracker.retrieved_before(cutoff, limit=self.batch_size)]
+            if not names or not self._delete(names, counts):
+                # Page entierement en echec (permissions...) : reessai a la prochaine passe
+                break
+
+    def _expire_unretrieved(self, cutoff: float, counts: Dict[str, int]) -> None:
+        cursor = (float("-inf"), "")
+        while True:
+            rows = self.index.oldest(before=cutoff, after=cursor, limit=self.batch_size)
+            if not rows:
+                break
+            cursor = (rows[-1][2], rows[-1][0])
+            self._delete([name for name, _, _ in rows if self.tracker.retrieved_at(name) is None], counts)
+
+    def _enforce_max_bytes(self, counts: Dict[str, int]) -> None:
+        cursor = (float("-inf"), "")
+        while True:
+            excess = self.index.totals()["bytes"] - self.max_bytes
+            if excess <= 0:
+                break
+            rows = self.index.oldest(after=cursor, limit=self.batch_size)
+            if not rows:
+                break
+            victims = []
+            for name, size, created_at in rows:
+                victims.append(name)
+                cursor = (created_at, name)
+                excess -= size
+                if excess <= 0:
+                    break
+            self._delete(victims, counts)
+
+    def _delete(self, names: List[str], counts: Dict[str, int]) -> List[str]:
+        """Supprime les fichiers et leurs derives, puis leurs entrees d'index et de suivi"""
+        removed = []
+        for name in names:
+            path = self.index.locate(name)
+            if path is None:
+                removed.append(name)  # deja supprime : seul l'index est nettoye
+                continue
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                removed.append(name)  # deja supprime : seul l'index est nettoye
+                continue
+            except OSError as exc:
+                logger.warning("Retention: %s non supprime: %s", name, exc)
+                continue
+            removed.append(name)
+            self._discard_derived(name)
+            counts["files"] += 1
+            counts["bytes"] += size
+        if removed:
+            self.index.remove(removed)
+            self.tracker.forget(removed)
+        return removed
+
+    def _discard_derived(self, name: str) -> None:
+        try:
+            self.derived.discard(name)
+        except OSError as exc:
+            logger.warning("Retention: derives de %s non supprimes: %s", name, exc)
+
+    # ------------------------------------------------------------- metriques
+
+    def _record(self, deleted: Dict[str, Dict[str, int]]) -> None:
+        try:
+            pipe = self.redis.pipeline()
+            pipe.hincrby(RETENTION_KEY, "runs", 1)
+            for reason, counts in deleted.items():
+                pipe.hincrby(RETENTION_KEY, f"{reason}:files", counts["files"])
+                pipe.hincrby(RETENTION_KEY, f"{reason}:bytes", counts["bytes"])
+            pipe.execute()
+        except Exception as exc:
+            logger.warning("Metriques de retention non enregistrees: %s", exc)
+
+    def stats(self) -> Dict:
+        """Politique, contenu indexe, cumuls Redis et derniere passe du processus"""
+        counters = {key: int(value) for key, value in self.redis.hgetall(RETENTION_KEY).items()}
+        return {
+            "policy": {
+                "retrieved_hours": self.retrieved_hours,
+                "unretrieved_days": self.unretrieved_days,
+                "max_bytes": self.max_bytes,
+                "interval_seconds": self.interval,
+            },
+            "outputs": self.index.totals(),
+            "runs": counters.get("runs", 0),
+            "files_deleted": {reason: counters.get(f"{reason}:files", 0) for reason in REASONS},
+            "bytes_reclaimed": {reason: counters.get(f"{reason}:bytes", 0) for reason in REASONS},
+            "last_run": self.last_run,
+        }
+
+    # -------------------------------------------------------- thread de fond
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as exc:
+                logger.warning("Passe de retention echouee: %s", exc)
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+retention = RetentionService()
@@ -0,0 +1,264 @@
+"""
+Suivi des images recuperees (/v1/download, /v1/image) pour le nettoyage de
+OUTPUTS_DIR.
+
+Remplace .retrieved.json (relu et reecrit en entier a chaque telechargement):
+    - mark() est O(1) en memoire, sans E/S sur le chemin de la requete
+    - un thread de fond ecrit les marques en lot (une transaction SQLite
+      toutes les RETRIEVAL_FLUSH_SECONDS, ou des que le lot est plein)
+    - la table est indexee par date de recuperation : retrieved_before(X)
+      ne lit que les lignes concernees
+    - compaction periodique : lignes des fichiers disparus supprimees,
+      WAL tronque
+
+.retrieved.json est importe a la premiere ouverture puis renomme.
+"""
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.config import (
+    OUTPUTS_DIR,
+    RETRIEVAL_COMPACT_SECONDS,
+    RETRIEVAL_DB_FILE,
+    RETRIEVAL_FLUSH_MAX_PENDING,
+    RETRIEVAL_FLUSH_SECONDS,
+    RETRIEVAL_LEGACY_FILE,
+)
+from app.output_index import locate_output
+from app.sqlite_utils import ThreadLocalDB
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS retrievals (
+    filename TEXT PRIMARY KEY,
+    retrieved_at REAL NOT NULL,
+    count INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_retrievals_retrieved_at ON retrievals(retrieved_at);
+"""
+
+UPSERT = (
+    "INSERT INTO retrievals (filename, retrieved_at, count) VALUES (?, ?, ?) "
+    "ON CONFLICT (filename) DO UPDATE SET "
+    "retrieved_at = MAX(retrieved_at, excluded.retrieved_at), count = count + excluded.count"
+)
+
+
+class RetrievalTracker:
+    """Derniere recuperation de chaque image, ecrite en lot par un thread de fond"""
+
+    def __init__(
+        self,
+        db_path: Path = RETRIEVAL_DB_FILE,
+        legacy_json: Optional[Path] = RETRIEVAL_LEGACY_FILE,
+        outputs_dir: Path = OUTPUTS_DIR,
+        flush_seconds: float = RETRIEVAL_FLUSH_SECONDS,
+        max_pending: int = RETRIEVAL_FLUSH_MAX_PENDING,
+        compact_seconds: float = RETRIEVAL_COMPACT_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.legacy_json = legacy_json
+        self.outputs_dir = outputs_dir
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.compact_seconds = compact_seconds
+        self.clock = clock
+        self._db = ThreadLocalDB(db_path, initialize=self._initialize)
+        self._lock = threading.Lock()
+        # {filename: (retrieved_at, count)} pas encore ecrits
+        self._pending: Dict[str, Tuple[float, int]] = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_compact = clock()
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.compacted_rows = 0
+
+    # ------------------------------------------------------ schema/migration
+
+    def _initialize(self, conn) -> None:
+        conn.executescript(SCHEMA)
+        if self.legacy_json is None or not self.legacy_json.exists():
+            return
+        try:
+            legacy = json.loads(self.legacy_json.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(".retrieved.json illisible, migration ignoree: %s", e)
+            return
+
+        rows = []
+        for filename, retrieved_at in legacy.items():
+            try:
+                rows.append((filename, datetime.fromisoformat(retrieved_at).timestamp(), 1))
+            except (TypeError, ValueError):
+                continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(UPSERT, rows)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+        logger.info(".retrieved.json migre vers SQLite (%d images)", len(rows))
+        try:
+            self.legacy_json.rename(self.legacy_json.with_name(self.legacy_json.name + ".migrated"))
+        except OSError as e:
+            logger.warning(".retrieved.json migre mais non renomme: %s", e)
+
+    # ------------------------------------------------------------- ecriture
+
+    def mark(self, filename: str) -> None:
+        """Enregistre une recuperation (memoire seulement, ecrite au prochain lot)"""
+        now = self.clock()
+        with self._lock:
+            _, count = self._pending.get(filename, (now, 0))
+            self._pending[filename] = (now, count + 1)
+            full = len(self._pending) >= self.max_pending
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Ecrit les recuperations en attente en une transaction, retourne leur nombre"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            with self._db.transaction() as conn:
+                conn.executemany(
+                    UPSERT, [(name, at, count) for name, (at, count) in pending.items()]
+                )
+        except Exception:
+            # Remises en attente : le prochain lot reessaiera
+            with self._lock:
+                for name, (at, count) in pending.items():
+                    current_at, current_count = self._pending.get(name, (at, 0))
+                    self._pending[name] = (max(at, current_at), count + current_count)
+            raise
+        self.flushes += 1
+        self.flushed_rows += len(pending)
+        return len(pending)
+
+    def forget(self, filenames: Iterable[str]) -> None:
+        """Supprime le suivi d'images effacees"""
+        filenames = list(filenames)
+        with self._lock:
+            for name in filenames:
+                self._pending.pop(name, None)
+        with self._db.transaction() as conn:
+            conn.executemany("DELETE FROM retrievals WHERE filename = ?", [(name,) for name in filenames])
+
+    def compact(self, exists: Optional[Callable[[str], bool]] = None, batch_size: int = 500) -> int:
+        """
+        Supprime les lignes des fichiers disparus de OUTPUTS_DIR et tronque le
+        WAL. Retourne le nombre de lignes supprimees.
+        """
+        if exists is None:
+            exists = lambda name: locate_output(self.outputs_dir, name) is not None  # noqa: E731
+
+        removed = 0
+        last = ""
+        while True:
+            names = [
+                row[0]
+                for row in self._db.conn.execute(
+                    "SELECT filename FROM retrievals WHERE filename > ? ORDER BY filename LIMIT ?",
+                    (last, batch_size),
+                )
+            ]
+            if not names:
+                break
+            last = names[-1]
+            missing = [name for name in names if not exists(name)]
+            if missing:
+                self.forget(missing)
+                removed += len(missing)
+
+        self._db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.compacted_rows += removed
+        return removed
+
+    # --------------------------------------------------------------- lecture
+
+    def retrieved_at(self, filename: str) -> Optional[float]:
+        """Derniere recuperation (epoch) ou None"""
+        with self._lock:
+            pending = self._pending.get(filename)
+        if pending is not None:
+            return pending[0]
+        row = self._db.conn.execute(
+            "SELECT retrieved_at FROM retrievals WHERE filename = ?", (filename,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def retrieved_before(self, cutoff: float, limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Images dont la derniere recuperation precede `cutoff` (epoch), plus
+        anciennes d'abord : [(filename, retrieved_at)]. Parcours de l'index.
+        """
+        self.flush()
+        query = "SELECT filename, retrieved_at FROM retrievals WHERE retrieved_at < ? ORDER BY retrieved_at"
+        params: tuple = (cutoff,)
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (cutoff, limit)
+        return [(row[0], row[1]) for row in self._db.conn.execute(query, params)]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending = len(self._pending)
+        tracked = self._db.conn.execute("SELECT COUNT(*) FROM retrievals").fetchone()[0]
+        return {
+            "tracked": tracked,
+            "pending": pending,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "compacted_rows": self.compacted_rows,
+        }
+
+    # -------------------------------------------------------- thread de fond
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="retrieval-flush", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if self.clock() - self._last_compact >= self.compact_seconds:
+                    self._last_compact = self.clock()
+                    removed = self.compact()
+                    if removed:
+                        logger.info("Suivi des recuperations compacte (%d lignes)", removed)
+            except Exception as exc:
+                logger.warning("Ecriture du suivi des recuperations impossible: %s", exc)
+
+    def close(self) -> None:
+        """Arrete le thread de fond et ecrit les marques restantes"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+
+# Instance partagee par l'API
+retrievals = RetrievalTracker()
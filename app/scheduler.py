@@ -0,0 +1,174 @@
+"""
+Scheduler par affinite de modele : regroupe les jobs en attente par
+(modele, LoRAs tries) pour eviter de reconstruire le pipeline SDXL a chaque job.
+
+Le worker traite les messages Celery en FIFO (concurrency=1, prefetch=1).
+Quand le job recu ne correspond pas au modele charge alors qu'un job compatible
+attend derriere, il est re-publie en fin de file (meme task_id). Une borne
+d'equite (attente max + nombre max de reports) garantit qu'aucun job n'est
+affame.
+"""
+
+import json
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.config import (
+    SCHEDULER_ENTRY_TTL,
+    SCHEDULER_MAX_DEFERRALS,
+    SCHEDULER_MAX_WAIT_SECONDS,
+)
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "imagen:scheduler:pending"
+STATS_KEY = "imagen:scheduler:stats"
+
+
+def affinity_key(model: str, loras: Optional[List[Dict]] = None) -> str:
+    """Cle d'affinite d'un job : modele + noms de LoRAs tries"""
+    names = sorted({lora["name"] for lora in (loras or [])})
+    return f"{model}|{','.join(names)}"
+
+
+class AffinityScheduler:
+    """
+    Registre Redis des jobs en attente + decision de report cote worker.
+
+    Compteurs exposes (hash Redis STATS_KEY):
+        jobs_started: jobs effectivement executes
+        swaps: changements d'affinite (modele ou jeu de LoRAs) entre deux jobs
+        swaps_avoided: jobs executes avant un job plus ancien d'une autre
+            affinite (un ordre FIFO aurait impose un changement de modele)
+        deferrals: reports en fin de file
+        fairness_overrides: jobs executes malgre un job compatible en attente,
+            car la borne d'equite etait atteinte
+    """
+
+    def __init__(
+        self,
+        redis_client=None,
+        max_wait_seconds: int = SCHEDULER_MAX_WAIT_SECONDS,
+        max_deferrals: int = SCHEDULER_MAX_DEFERRALS,
+        entry_ttl: int = SCHEDULER_ENTRY_TTL,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._redis = redis_client
+        self.max_wait_seconds = max_wait_seconds
+        self.max_deferrals = max_deferrals
+        self.entry_ttl = entry_ttl
+        self.clock = clock
+        # Affinite actuellement chargee par ce worker (etat local au processus)
+        self.current_key: Optional[str] = None
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    def register(self, job_id: str, model: str, loras: Optional[List[Dict]] = None) -> None:
+        """Enregistre un job soumis (appele par l'API avant publication)"""
+        entry = {
+            "key": affinity_key(model, loras),
+            "enqueued_at": self.clock(),
+            "deferrals": 0,
+        }
+        self.redis.hset(PENDING_KEY, job_id, json.dumps(entry))
+
+    def pending(self) -> Dict[str, Dict]:
+        """Jobs en attente {job_id: entry}, purge des entrees orphelines"""
+        now = self.clock()
+        entries = {}
+        expired = []
+        for job_id, raw in self.redis.hgetall(PENDING_KEY).items():
+            try:
+                entry = json.loads(raw)
+            except (TypeError, ValueError):
+                expired.append(job_id)
+                continue
+            if now - entry["enqueued_at"] > self.entry_ttl:
+                expired.append(job_id)
+                continue
+            entries[job_id] = entry
+        if expired:
+            self.redis.hdel(PENDING_KEY, *expired)
+        return entries
+
+    def should_defer(self, job_id: str, key: str) -> bool:
+        """
+        Indique si le job doit etre re-publie en fin de file.
+
+        Reporte uniquement si l'affinite differe de celle chargee, qu'un autre
+        job compatible avec le modele charge attend, et que la borne d'equite
+        du job n'est pas atteinte.
+        """
+        if self.current_key is None or key == self.current_key:
+            return False
+
+        pending = self.pending()
+        entry = pending.get(job_id)
+        if entry is None:
+            return False
+
+        has_match = any(
+            other["key"] == self.current_key
+            for other_id, other in pending.items()
+            if other_id != job_id
+        )
+        if not has_match:
+            return False
+
+        waited = self.clock() - entry["enqueued_at"]
+        if waited >= self.max_wait_seconds or entry["deferrals"] >= self.max_deferrals:
+            self.redis.hincrby(STATS_KEY, "fairness_overrides", 1)
+            logger.info(
+                "Job %s execute (borne d'equite: %.0fs, %d reports)",
+                job_id, waited, entry["deferrals"],
+            )
+            return False
+
+        entry["deferrals"] += 1
+        self.redis.hset(PENDING_KEY, job_id, json.dumps(entry))
+        self.redis.hincrby(STATS_KEY, "deferrals", 1)
+        logger.debug("Job %s reporte (%s != %s)", job_id, key, self.current_key)
+        return True
+
+    def start(self, job_id: str, key: str) -> None:
+        """Enregistre le demarrage effectif d'un job sur ce worker"""
+        if self.current_key is not None:
+            if key != self.current_key:
+                self.redis.hincrby(STATS_KEY, "swaps", 1)
+            else:
+                pending = self.pending()
+                entry = pending.get(job_id)
+                if entry and any(
+                    other["key"] != key and other["enqueued_at"] < entry["enqueued_at"]
+                    for other_id, other in pending.items()
+                    if other_id != job_id
+                ):
+                    self.redis.hincrby(STATS_KEY, "swaps_avoided", 1)
+
+        self.current_key = key
+        self.redis.hincrby(STATS_KEY, "jobs_started", 1)
+
+    def finish(self, job_id: str) -> None:
+        """Retire un job termine du registre"""
+        self.redis.hdel(PENDING_KEY, job_id)
+
+    def stats(self) -> Dict[str, int]:
+        counters = {
+            "jobs_started": 0,
+            "swaps": 0,
+            "swaps_avoided": 0,
+            "deferrals": 0,
+            "fairness_overrides": 0,
+        }
+        for name, value in self.redis.hgetall(STATS_KEY).items():
+            counters[name] = int(value)
+        counters["pending"] = self.redis.hlen(PENDING_KEY)
+        return counters
+
+
+# Instance partagee (API: register/stats, worker: should_defer/start/finish)
+scheduler = AffinityScheduler()
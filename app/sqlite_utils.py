@@ -0,0 +1,73 @@
+"""
+Connexions SQLite partagees par les stockages de l'application (WAL,
+autocommit, une connexion par thread).
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+
+def connect_wal(db_path: Path, busy_timeout: float = 30.0) -> sqlite3.Connection:
+    """Connexion en mode WAL, transactions explicites (isolation_level=None)"""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(
+        str(db_path), timeout=busy_timeout, isolation_level=None, check_same_thread=False
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+class ThreadLocalDB:
+    """
+    Une connexion par thread sur la meme base ; `initialize(conn)` est appele
+    une seule fois par processus, sur la premiere connexion ouverte.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        initialize: Optional[Callable[[sqlite3.Connection], None]] = None,
+        busy_timeout: float = 30.0,
+    ):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self._initialize = initialize
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = initialize is None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect_wal(self.db_path, self.busy_timeout)
+            if not self._initialized:
+                with self._init_lock:
+                    if not self._initialized:
+                        self._initialize(conn)
+                        self._initialized = True
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Transaction d'ecriture (BEGIN IMMEDIATE : verrou pris des le debut)"""
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self) -> None:
+        """Ferme la connexion du thread courant"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
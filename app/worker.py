@@ -6,15 +6,31 @@ multiprocessing.set_start_method('spawn', force=True)
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import gc
+import hashlib
+import logging
 import uuid
 from datetime import datetime
 
 import torch
 from celery import Celery
+from celery.exceptions import Ignore
+from celery.signals import task_failure, task_success, worker_shutdown
 
 from app.config import *
 from app.pipeline import pipeline
 from app.references import ReferenceManager
+from app.admission import admission
+from app.batching import batcher
+from app.dedup import dedup
+from app.derivatives import derivatives
+from app.encoding import encode, extension
+from app.events import events
+from app.output_index import output_index, shard_path
+from app.postprocess import writer
+from app.progress import StepProgress, throughput
+from app.scheduler import affinity_key, scheduler
+
+logger = logging.getLogger(__name__)
 
 # Configuration Celery
 celery_app = Celery(
@@ -35,6 +51,297 @@ celery_app.conf.update(
     result_expires=3600,  # Résultats stockés 1h
 )
 
+# Le pipeline charge le modele par defaut au demarrage du worker
+scheduler.current_key = affinity_key(pipeline.current_model)
+
+
+def _defer_for_affinity(task, job_key: str) -> bool:
+    """
+    Re-publie le job en fin de file si un job compatible avec le modele
+    charge attend derriere lui (voir app.scheduler).
+    """
+    if not SCHEDULER_ENABLED:
+        return False
+    try:
+        if not scheduler.should_defer(task.request.id, job_key):
+            return False
+    except Exception as exc:
+        logger.warning("Scheduler indisponible, execution FIFO: %s", exc)
+        return False
+
+    _progress(task, {"step": "en_attente", "progress": 0})
+    task.apply_async(
+        args=task.request.args,
+        kwargs=task.request.kwargs,
+        task_id=task.request.id,
+    )
+    return True
+
+
+def _scheduler_call(method, *args) -> None:
+    """Appel best-effort au scheduler (Redis ne doit pas faire echouer un job)"""
+    if not SCHEDULER_ENABLED:
+        return
+    try:
+        method(*args)
+    except Exception as exc:
+        logger.warning("Scheduler indisponible: %s", exc)
+
+
+def _finish_job(job_id: str) -> None:
+    """Fin definitive d'un job : libere sa place en file et son entree scheduler"""
+    _scheduler_call(scheduler.finish, job_id)
+    try:
+        admission.release(job_id)
+    except Exception as exc:
+        logger.warning("Admission indisponible: %s", exc)
+
+
+def _publish_event(job_id: str, event_type: str, data) -> None:
+    """Publication best-effort sur le flux SSE/WebSocket du job"""
+    try:
+        events.publish(job_id, event_type, data)
+    except Exception as exc:
+        logger.warning("Evenement non publie (%s): %s", job_id, exc)
+
+
+def _progress(task, meta: dict, task_id: str = None) -> None:
+    """update_state PROGRESS + evenement 'progress' pour les abonnes"""
+    task_id = task_id or task.request.id
+    task.update_state(task_id=task_id, state="PROGRESS", meta=meta)
+    _publish_event(task_id, "progress", meta)
+
+
+def _dedup_call(method, *args) -> None:
+    """Mise a jour best-effort de l'index de deduplication"""
+    if not DEDUP_ENABLED:
+        return
+    try:
+        method(*args)
+    except Exception as exc:
+        logger.warning("Deduplication indisponible: %s", exc)
+
+
+def _announce_result(job_id: str, result: dict) -> None:
+    _dedup_call(dedup.complete, job_id, result)
+    _publish_event(job_id, "result", result)
+
+
+def _record_throughput(model: str, loras: list, progress: StepProgress) -> None:
+    """Debit mesure par appel pipeline (best-effort, voir app.progress)"""
+    try:
+        for segment in progress.segments:
+            throughput.record(
+                model,
+                IMAGE_SIZE[0],
+                IMAGE_SIZE[1],
+                len(loras or []),
+                segment["batch_size"],
+                segment["steps"],
+                segment["seconds"],
+            )
+    except Exception as exc:
+        logger.warning("Metriques de debit non enregistrees: %s", exc)
+
+
+def _batch_call(method, *args, default=None):
+    """Appel best-effort au collecteur de batch (repli: job seul)"""
+    if BATCH_MAX_SIZE <= 1:
+        return default
+    try:
+        return method(*args)
+    except Exception as exc:
+        logger.warning("Batching indisponible: %s", exc)
+        return default
+
+
+def _output_target(model: str, output_format: str = "png") -> dict:
+    """Nom et emplacement d'une nouvelle image : OUTPUTS_DIR/{YYYYMMDD}/{id[:2]}/ (nom préfixé par le modèle)"""
+    # Génération ID unique
+    file_id = str(uuid.uuid4())[:8]
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    # Nom de fichier avec préfixe du modèle
+    model_prefix = model.replace("-", "_")
+    filename = f"{model_prefix}_{timestamp}_{file_id}.{extension(output_format)}"
+    relative_path = shard_path(filename)
+
+    return {
+        "filename": filename,
+        "path": str((OUTPUTS_DIR / relative_path).relative_to(BASE_DIR)),
+        "url": f"/outputs/{relative_path}",
+    }
+
+
+def _write_image(image, saved: dict, output_format: str = "png", quality: int = None) -> str:
+    """
+    Encode et écrit une image à l'emplacement choisi par _output_target, l'indexe
+    et crée ses miniatures. Retourne le SHA-256 du fichier (ETag).
+    """
+    relative_path = shard_path(saved["filename"])
+    output_path = OUTPUTS_DIR / relative_path
+
+    data = encode(image, output_format, quality)
+    digest = hashlib.sha256(data).hexdigest()
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # Fichier temporaire caché puis rename : /outputs ne sert jamais une image partielle
+    tmp_path = output_path.with_name(f".{output_path.name}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, output_path)
+    try:
+        output_index.add(saved["filename"], len(data), path=relative_path, sha256=digest)
+    except Exception as exc:
+        logger.warning("Image %s non indexee (retention): %s", saved["filename"], exc)
+
+    # Miniatures de la galerie depuis l'image en mémoire (pas de relecture)
+    for size in THUMBNAIL_EAGER_SIZES:
+        try:
+            derivatives.thumbnail(saved["filename"], output_path, size, image=image)
+        except Exception as exc:
+            logger.warning("Miniature %dpx de %s non creee: %s", size, saved["filename"], exc)
+    return digest
+
+
+def _write_images(writes: list, results: dict) -> None:
+    """Écrit les images et ajoute le hash de chaque fichier aux résultats"""
+    hashes = {saved["filename"]: _write_image(image, saved, *options) for image, saved, *options in writes}
+    for result in results.values():
+        for entry in [result, *(result.get("images") or [])]:
+            if entry.get("filename") in hashes:
+                entry["sha256"] = hashes[entry["filename"]]
+
+
+def _build_result(saved: dict, job: dict, seed) -> dict:
+    """Résultat Celery d'un job avec metadata complète"""
+    return {
+        "status": "success",
+        **saved,
+        "metadata": {
+            "model": job["model"],
+            "loras": job["loras"],
+            "steps": job["steps"],
+            "guidance_scale": job["guidance_scale"],
+            "seed": seed,
+            "ip_strength": job["ip_strength"],
+            "output_format": job.get("output_format", "png"),
+            "quality": job.get("quality"),
+            "references": [
+                {"path": r["path"], "strength": r["strength"]}
+                for r in (job["references"] or [])
+            ],
+        }
+    }
+
+
+def _run_batch(task, batch: list) -> dict:
+    """
+    Exécute un batch de jobs compatibles en un seul appel pipeline, publie le
+    résultat de chaque job réclamé et retourne celui du job courant.
+    """
+    own_id = task.request.id
+    others = [job_id for job_id, _ in batch if job_id != own_id]
+
+    for job_id, _ in batch:
+        _progress(
+            task,
+            {"step": "generation_gpu", "progress": 10, "batch_size": len(batch)},
+            task_id=job_id,
+        )
+
+    def report(meta):
+        _batch_call(batcher.heartbeat, own_id)
+        for job_id, _ in batch:
+            _progress(task, {**meta, "batch_size": len(batch)}, task_id=job_id)
+
+    lead = batch[0][1]
+    _batch_call(batcher.heartbeat, own_id)  # chargement du modele avant la premiere etape
+    step_progress = StepProgress(report)
+    try:
+        images, seeds = pipeline.generate_batch(
+            items=[
+                {"prompt": job["prompt"], "negative_prompt": job["negative_prompt"], "seed": job["seed"]}
+                for _, job in batch
+            ],
+            model=lead["model"],
+            loras=lead["loras"],
+            steps=lead["steps"],
+            guidance_scale=lead["guidance_scale"],
+            progress=step_progress,
+        )
+    except Exception:
+        # Les jobs réclamés s'exécuteront seuls à l'arrivée de leur message
+        _batch_call(batcher.release, others)
+        raise
+
+    _record_throughput(lead["model"], lead["loras"], step_progress)
+    _progress(task, {"step": "sauvegarde", "progress": 90})
+
+    writes, results = [], {}
+    for (job_id, job), image, seed in zip(batch, images, seeds):
+        output_format = job.get("output_format", "png")
+        saved = _output_target(job["model"], output_format)
+        writes.append((image, saved, output_format, job.get("quality")))
+        results[job_id] = _build_result(saved, job, seed)
+
+    return _deliver(task, writes, results)
+
+
+def _publish_batched(job_id: str, result: dict) -> None:
+    """Résultat d'un job réclamé par le batch d'un autre job"""
+    _batch_call(batcher.publish_result, job_id, result)
+    celery_app.backend.store_result(job_id, result, "SUCCESS")
+    _publish_event(job_id, "result", result)
+    _finish_job(job_id)
+
+
+def _deliver(task, writes: list, results: dict) -> dict:
+    """
+    Écrit les images d'un appel pipeline puis publie le résultat de chaque job.
+
+    Avec le pool d'écriture (app.postprocess), la tâche rend le slot GPU sans
+    attendre l'encodage : le pool écrit les fichiers puis le résultat Celery,
+    et la tâche se termine par Ignore (Celery n'écrit pas son état).
+    """
+    own_id = task.request.id
+    if not writer.enabled:
+        _write_images(writes, results)
+        for job_id, result in results.items():
+            if job_id != own_id:
+                _publish_batched(job_id, result)
+        _progress(task, {"step": "termine", "progress": 100})
+        _finish_job(own_id)
+        return results[own_id]
+
+    # Les jobs n'occupent plus le GPU : ils sortent de la file et du scheduler.
+    # Les jobs reclames n'attendent pas l'ecriture : leur message est ignore
+    # et le pool stocke leur resultat.
+    for job_id in results:
+        _finish_job(job_id)
+    _batch_call(batcher.hand_off, [job_id for job_id in results if job_id != own_id])
+    writer.submit(_write_and_publish, own_id, writes, results)
+    raise Ignore()
+
+
+def _write_and_publish(own_id: str, writes: list, results: dict) -> None:
+    """Pool d'écriture : fichiers, puis résultats (le client ne voit jamais un fichier absent)"""
+    try:
+        _write_images(writes, results)
+    except Exception as exc:
+        # Jobs confiés au pool (hand_off) : leur message a pu être ignoré,
+        # l'échec est donc stocké pour chacun
+        for job_id in results:
+            celery_app.backend.mark_as_failure(job_id, exc)
+            _dedup_call(dedup.abandon, job_id)
+            _publish_event(job_id, "error", {"error": str(exc)})
+        raise
+
+    for job_id, result in results.items():
+        if job_id != own_id:
+            _publish_batched(job_id, result)
+    _publish_event(own_id, "progress", {"step": "termine", "progress": 100})
+    celery_app.backend.store_result(own_id, results[own_id], "SUCCESS")
+    _announce_result(own_id, results[own_id])
+
 
 @celery_app.task(bind=True, max_retries=3)
 def generate_image_task(
@@ -48,10 +355,19 @@ def generate_image_task(
     seed: int = None,
     ip_strength: float = 0.0,
     references: list = [],
+    seeds: list = None,
+    output_format: str = "png",
+    quality: int = None,
 ):
     """
     Task Celery pour génération sur GPU avec support multi-modèles, LoRA et references
 
+    Avec `seeds`, le même prompt est généré une fois par seed dans la même
+    tâche (encodage et préparation communs) et le résultat liste N fichiers.
+
+    Les jobs compatibles en attente (même modèle, LoRAs, steps, CFG, sans
+    references) sont regroupés dans un seul appel batch du pipeline.
+
     Args:
         prompt: Description de l'image
         negative_prompt: Éléments à éviter
@@ -62,21 +378,53 @@ def generate_image_task(
         seed: Seed pour reproductibilité
         ip_strength: (Legacy) Force du style transfer (0.0-1.0)
         references: Liste de references [{path, strength, embedding_path}, ...]
+        seeds: Liste de seeds pour générer plusieurs images (prioritaire sur seed)
+        output_format: Format du fichier (png, webp, jpeg, avif)
+        quality: Qualité 1-100 des formats avec perte (défaut par format)
 
     Returns:
         Dict avec status, filename, path, url et metadata
+        (+ images: [{filename, path, url, seed}, ...] si seeds)
     """
-    try:
-        self.update_state(state="PROGRESS", meta={"step": "initialisation"})
+    job = dict(
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        model=model,
+        loras=loras,
+        steps=steps,
+        guidance_scale=guidance_scale,
+        seed=seed,
+        ip_strength=ip_strength,
+        references=references,
+        seeds=seeds,
+        output_format=output_format,
+        quality=quality,
+    )
 
-        # Génération ID unique
-        job_id = str(uuid.uuid4())[:8]
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # Job déjà réclamé par le batch d'un autre job : on renvoie son résultat
+    if not _batch_call(batcher.claim, self.request.id, self.request.id, default=True):
+        result = _batch_call(batcher.wait_result, self.request.id)
+        if result is not None:
+            _finish_job(self.request.id)
+            return result
+        if _batch_call(batcher.is_handed_off, self.request.id, default=False):
+            # Image déjà générée, en cours d'écriture : le pool du propriétaire
+            # stocke le résultat, le slot GPU est rendu tout de suite
+            raise Ignore()
 
-        # Nom de fichier avec préfixe du modèle
-        model_prefix = model.replace("-", "_")
-        filename = f"{model_prefix}_{timestamp}_{job_id}.png"
-        output_path = OUTPUTS_DIR / filename
+    job_key = affinity_key(model, loras)
+    if _defer_for_affinity(self, job_key):
+        raise Ignore()
+
+    try:
+        _scheduler_call(scheduler.start, self.request.id, job_key)
+        _progress(self, {"step": "initialisation"})
+
+        batch = _batch_call(
+            batcher.collect, self.request.id, job, default=[(self.request.id, job)]
+        )
+        if len(batch) > 1:
+            return _run_batch(self, batch)
 
         # Résolution des references
         reference_images = None
@@ -87,13 +435,39 @@ def generate_image_task(
             reference_images = references
         elif ip_strength > 0:
             # Legacy: image de reference hardcodee
-            legacy_ref = REFERENCE_DIR / "electra_ref.png"
+            legacy_ref = LEGACY_REFERENCE_IMAGE
             if legacy_ref.exists():
                 ref_path = str(legacy_ref)
 
-        self.update_state(
-            state="PROGRESS", meta={"step": "generation_gpu", "progress": 10}
-        )
+        _progress(self, {"step": "generation_gpu", "progress": 10})
+        step_progress = StepProgress(lambda meta: _progress(self, meta))
+
+        if seeds:
+            # Plusieurs images du même prompt : une seule préparation
+            images = pipeline.generate_images(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                model=model,
+                loras=loras,
+                steps=steps,
+                guidance_scale=guidance_scale,
+                seeds=seeds,
+                reference_image_path=ref_path,
+                ip_strength=ip_strength,
+                reference_images=reference_images,
+                progress=step_progress,
+            )
+
+            _record_throughput(model, loras, step_progress)
+            _progress(self, {"step": "sauvegarde", "progress": 90})
+            saved = [_output_target(model, output_format) for _ in images]
+
+            # Le premier fichier reste le résultat principal (/v1/image/{job_id})
+            result = _build_result(saved[0], job, seeds[0])
+            result["images"] = [{**item, "seed": s} for item, s in zip(saved, seeds)]
+            result["metadata"]["seeds"] = seeds
+            writes = [(image, item, output_format, quality) for image, item in zip(images, saved)]
+            return _deliver(self, writes, {self.request.id: result})
 
         # Génération avec TOUS les paramètres
         image = pipeline.generate(
@@ -107,58 +481,68 @@ def generate_image_task(
             reference_image_path=ref_path,
             ip_strength=ip_strength,
             reference_images=reference_images,
+            progress=step_progress,
         )
 
-        self.update_state(state="PROGRESS", meta={"step": "sauvegarde", "progress": 90})
-
-        # Sauvegarde
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        image.save(output_path, "PNG")
-
-        self.update_state(state="PROGRESS", meta={"step": "termine", "progress": 100})
+        _record_throughput(model, loras, step_progress)
+        _progress(self, {"step": "sauvegarde", "progress": 90})
 
-        # Retour avec metadata complète
-        return {
-            "status": "success",
-            "filename": filename,
-            "path": str(output_path.relative_to(BASE_DIR)),
-            "url": f"/outputs/{filename}",
-            "metadata": {
-                "model": model,
-                "loras": loras,
-                "steps": steps,
-                "guidance_scale": guidance_scale,
-                "seed": seed,
-                "ip_strength": ip_strength,
-                "references": [
-                    {"path": r["path"], "strength": r["strength"]}
-                    for r in (references or [])
-                ],
-            }
-        }
+        # Sauvegarde (pool d'écriture) et retour avec metadata complète
+        saved = _output_target(model, output_format)
+        result = _build_result(saved, job, seed)
+        return _deliver(self, [(image, saved, output_format, quality)], {self.request.id: result})
 
+    except Ignore:
+        raise
     except Exception as exc:
         print(f"❌ Erreur task: {exc}")
+        if self.request.retries >= self.max_retries:
+            _finish_job(self.request.id)
+        else:
+            _publish_event(
+                self.request.id,
+                "progress",
+                {"step": "retry", "retries": self.request.retries + 1, "error": str(exc)},
+            )
         # Retry après 10s en cas d'OOM éventuel
         self.retry(countdown=10, exc=exc)
 
 
+# Evenements finaux : les signaux partent apres l'ecriture du resultat dans le
+# backend, un client notifie peut donc lire /v1/image/{job_id} immediatement
+@task_success.connect(sender=generate_image_task)
+def _publish_result(sender=None, result=None, **kwargs):
+    _announce_result(sender.request.id, result)
+
+
+@task_failure.connect(sender=generate_image_task)
+def _publish_failure(sender=None, task_id=None, exception=None, **kwargs):
+    _dedup_call(dedup.abandon, task_id)
+    _publish_event(task_id, "error", {"error": str(exception)})
+
+
+@worker_shutdown.connect
+def _drain_writer(**kwargs):
+    """Arrêt du worker : les images déjà générées sont écrites et leurs jobs finalisés"""
+    writer.drain(timeout=OUTPUT_WRITER_DRAIN_SECONDS)
+
+
 @celery_app.task(bind=True, max_retries=1)
 def compute_embedding_task(self, entity_name: str, subtype: str):
     """
-    Valide et marque une reference comme prete.
-    Le pre-calcul d'embeddings sera ajoute avec IP-Adapter Plus (Phase 2).
-    Pour l'instant, les images brutes sont utilisees directement.
+    Pre-calcule l'embedding IP-Adapter d'une reference ({subtype}.pt a cote de
+    l'image) et la marque comme prete. La generation lit ensuite ce fichier au
+    lieu de re-encoder l'image.
     """
     try:
         image_path = ReferenceManager.get_image_path(entity_name, subtype)
         if not image_path or not image_path.exists():
             raise ValueError(f"Image non trouvee: {entity_name}/{subtype}")
 
-        # Marquer comme pret (l'image est valide et accessible)
+        pipeline.compute_embedding(str(image_path))
         ReferenceManager.mark_embedding_cached(entity_name, subtype)
 
-        print(f"✅ Reference validee: {entity_name}/{subtype}")
+        print(f"✅ Embedding calcule: {entity_name}/{subtype}")
 
         return {
             "status": "success",
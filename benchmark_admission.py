@@ -0,0 +1,62 @@
+"""
+Benchmark latence d'admission sous une rafale de soumissions concurrentes
+(app/admission.py, quelques commandes Redis par soumission).
+
+Utilise une base Redis dediee (par defaut la 15) : la file de benchmark est
+videe a la fin, la file de production n'est pas touchee.
+
+Usage (Redis demarre):
+    python benchmark_admission.py --redis-url redis://localhost:6379/15 --submissions 500 --threads 32
+"""
+
+import argparse
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+
+from app.admission import QUEUE_KEY, AdmissionController, QueueFull
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latence d'admission sous rafale")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--submissions", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--max-size", type=int, default=100)
+    args = parser.parse_args()
+
+    client = redis.Redis.from_url(args.redis_url, decode_responses=True)
+    client.delete(QUEUE_KEY)
+    admission = AdmissionController(redis_client=client, max_size=args.max_size)
+    prefix = uuid.uuid4().hex[:8]
+
+    def submit(i):
+        start = time.perf_counter()
+        try:
+            admission.admit([f"bench-{prefix}-{i}"])
+            admitted = True
+        except QueueFull:
+            admitted = False
+        return admitted, time.perf_counter() - start
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            outcomes = list(pool.map(submit, range(args.submissions)))
+    finally:
+        client.delete(QUEUE_KEY)
+
+    admitted = sum(1 for ok, _ in outcomes if ok)
+    latencies = sorted(latency for _, latency in outcomes)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{args.submissions} soumissions, {args.threads} threads: {admitted} admises / {args.max_size}")
+    print(
+        f"p50={statistics.median(latencies) * 1000:7.2f} ms  "
+        f"p99={p99 * 1000:7.2f} ms  max={latencies[-1] * 1000:7.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
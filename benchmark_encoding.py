@@ -0,0 +1,92 @@
+"""
+Benchmark encodage des images generees : temps et taille par format/qualite.
+
+Compare PNG (plusieurs niveaux zlib), WebP, JPEG et AVIF (si disponible)
+sur une image de OUTPUTS_DIR ou, a defaut, une image synthetique 1024x1024
+(degrade + bruit, plus proche d'une generation qu'un aplat).
+
+Usage:
+    python benchmark_encoding.py --image outputs/20260130/ab/sdxl_..._ab12cd34.png --repeat 5
+"""
+
+import argparse
+import io
+import statistics
+import time
+
+from PIL import Image
+
+from app.config import IMAGE_SIZE
+from app.encoding import FORMATS, available_formats, save_options
+
+CASES = [
+    ("png", {"compress_level": 1}),
+    ("png", {"compress_level": 6}),
+    ("png", {"compress_level": 9}),
+    ("webp", 80),
+    ("webp", 90),
+    ("webp", 100),
+    ("jpeg", 85),
+    ("jpeg", 92),
+    ("avif", 60),
+    ("avif", 75),
+]
+
+
+def synthetic_image(size) -> Image.Image:
+    gradient = Image.linear_gradient("L").resize(size)
+    radial = Image.radial_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 48)
+    return Image.merge("RGB", (gradient, radial, Image.blend(gradient, noise, 0.5)))
+
+
+def measure(image: Image.Image, output_format: str, options: dict, repeat: int):
+    if output_format == "jpeg":
+        image = image.convert("RGB")
+    durations = []
+    size = 0
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        image.save(buffer, FORMATS[output_format][0], **options)
+        durations.append(time.perf_counter() - start)
+        size = buffer.tell()
+    return statistics.median(durations), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Temps d'encodage et taille par format")
+    parser.add_argument("--image", help="Image source (defaut: synthetique)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.image:
+        image = Image.open(args.image)
+        image.load()
+    else:
+        image = synthetic_image(IMAGE_SIZE)
+    available = available_formats()
+    skipped = set()
+    print(f"Image {image.size[0]}x{image.size[1]} {image.mode}, {args.repeat} repetitions")
+
+    baseline = None
+    for output_format, setting in CASES:
+        if output_format not in available:
+            if output_format not in skipped:
+                print(f"{output_format:5s} indisponible")
+                skipped.add(output_format)
+            continue
+        if isinstance(setting, dict):
+            options, label = setting, f"zlib {setting['compress_level']}"
+        else:
+            options, label = save_options(output_format, setting), f"q{setting}"
+        duration, size = measure(image, output_format, options, args.repeat)
+        baseline = baseline or size
+        print(
+            f"{output_format:5s} {label:8s} {duration * 1000:8.1f} ms  "
+            f"{size / 1024:8.1f} Ko  ({size / baseline:5.1%} du PNG zlib 1)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark latence par step UNet : LoRAs dynamiques (adapters PEFT) vs fusionnes.
+
+Usage (dans le conteneur worker, GPU requis):
+    python benchmark_lora_fusion.py --model sdxl --lora anime-style:0.8 --steps 20
+"""
+
+import argparse
+import statistics
+import time
+
+import torch
+
+import app.pipeline as pipeline_module
+from app.models_config import DEFAULT_MODEL
+
+
+def parse_lora(value):
+    name, _, weight = value.partition(":")
+    return {"name": name, "weight": float(weight or 1.0)}
+
+
+def time_unet_steps(flex, step_times):
+    """Chronometre chaque forward UNet (synchronise CUDA)"""
+    unet = flex.pipe.unet
+    forward = unet.forward
+
+    def timed_forward(*args, **kwargs):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        output = forward(*args, **kwargs)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        step_times.append(time.perf_counter() - start)
+        return output
+
+    unet.forward = timed_forward
+    return lambda: setattr(unet, "forward", forward)
+
+
+def run(flex, args, fused):
+    pipeline_module.LORA_FUSION_ENABLED = fused
+    if not fused:
+        flex.fusion.leave()
+
+    step_times = []
+    restore = time_unet_steps(flex, step_times)
+    try:
+        # Premier passage : chauffe + fusion (min_uses) exclue des mesures
+        for _ in range(pipeline_module.LORA_FUSION_MIN_USES):
+            flex.generate("benchmark", model=args.model, loras=args.loras, steps=2, seed=0)
+        step_times.clear()
+        for run_index in range(args.runs):
+            flex.generate("benchmark", model=args.model, loras=args.loras, steps=args.steps, seed=run_index)
+    finally:
+        restore()
+    return step_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--lora", dest="loras", action="append", type=parse_lora, required=True)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    flex = pipeline_module.pipeline
+    flex.load_model(args.model)
+
+    results = {}
+    for label, fused in (("dynamique", False), ("fusionne", True)):
+        times = run(flex, args, fused)
+        results[label] = times
+        print(
+            f"{label:10s} median={statistics.median(times) * 1000:.1f} ms/step "
+            f"p90={sorted(times)[int(len(times) * 0.9)] * 1000:.1f} ms "
+            f"({len(times)} steps)"
+        )
+
+    gain = 1 - statistics.median(results["fusionne"]) / statistics.median(results["dynamique"])
+    print(f"Gain fusion: {gain * 100:.1f}%")
+    print(f"Etat fusion: {flex.fusion.stats()}")
+
+
+if __name__ == "__main__":
+    main()
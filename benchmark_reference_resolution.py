@@ -0,0 +1,126 @@
+"""
+Micro-benchmark de la resolution des references sur le chemin /v1/generate.
+
+Compare, pour N entites:
+    - json      : ancien chemin (lecture + validation pydantic de metadata.json
+                  et stat de chaque image a chaque appel)
+    - sqlite    : lecture indexee des lignes + stat, sans memo
+    - memo      : ReferenceManager.resolve_references (memo par generation)
+
+Usage:
+    python benchmark_reference_resolution.py --entities 3000 --calls 2000
+"""
+
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from app import references
+from app.reference_store import ReferenceStore
+from app.references import ReferenceManager, ReferenceMetadata, ReferenceRequest
+
+SUBTYPES = ["front", "side"]
+
+
+def populate(root: Path, count: int) -> dict:
+    """Cree N entites (lignes SQLite + fichiers) et le metadata.json equivalent"""
+    store = references.get_store()
+    entities = {}
+    with store.transaction() as conn:
+        for index in range(count):
+            name = f"entity_{index:05d}"
+            created_at = "2025-01-01T00:00:00+00:00"
+            store.insert_entity(conn, name, "character", None, created_at)
+            entity_dir = ReferenceManager._entity_dir("character", name)
+            entity_dir.mkdir(parents=True, exist_ok=True)
+            images = {}
+            for subtype in SUBTYPES:
+                (entity_dir / f"{subtype}.png").write_bytes(b"png")
+                image = {
+                    "filename": f"{subtype}.png", "original_name": f"{subtype}.png",
+                    "width": 1024, "height": 1024, "uploaded_at": created_at,
+                    "embedding_cached": False,
+                }
+                store.upsert_image(conn, name, {"subtype": subtype, **image})
+                images[subtype] = image
+            entities[name] = {"category": "character", "created_at": created_at, "references": images}
+    return {"version": 1, "entities": entities}
+
+
+def resolve_json(metadata_file: Path, refs):
+    """Ancienne implementation: tout metadata.json relu et valide a chaque appel"""
+    metadata = ReferenceMetadata(**json.loads(metadata_file.read_text(encoding="utf-8")))
+    resolved = []
+    for ref in refs:
+        entity = metadata.entities[ref.entity]
+        for subtype in ref.types:
+            entity_dir = ReferenceManager._entity_dir(entity.category, ref.entity)
+            image_path = entity_dir / entity.references[subtype].filename
+            embedding_path = entity_dir / f"{subtype}.pt"
+            image_path.exists()
+            resolved.append((str(image_path), embedding_path.exists()))
+    return resolved
+
+
+def resolve_sqlite(refs):
+    store = references.get_store()
+    resolved = []
+    for ref in refs:
+        entity = store.get_entity(ref.entity)
+        for subtype in ref.types:
+            entity_dir = ReferenceManager._entity_dir(entity["category"], ref.entity)
+            image_path = entity_dir / entity["references"][subtype]["filename"]
+            embedding_path = entity_dir / f"{subtype}.pt"
+            image_path.exists()
+            resolved.append((str(image_path), embedding_path.exists()))
+    return resolved
+
+
+def measure(label, func, requests_refs):
+    latencies = []
+    for refs in requests_refs:
+        start = time.perf_counter()
+        func(refs)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{label:8s} p50={statistics.median(latencies) * 1e6:9.1f} us  "
+        f"p99={p99 * 1e6:9.1f} us"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolution des references: json vs sqlite vs memo")
+    parser.add_argument("--entities", type=int, default=3000)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--hot", type=int, default=20, help="Entites reutilisees par les appels")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        references.REFERENCE_DIR = root
+        references._store = ReferenceStore(root / "references.db")
+        metadata_file = root / "metadata.json"
+        metadata_file.write_text(json.dumps(populate(root, args.entities)), encoding="utf-8")
+
+        rng = random.Random(0)
+        hot = [f"entity_{rng.randrange(args.entities):05d}" for _ in range(args.hot)]
+        requests_refs = [
+            [ReferenceRequest(entity=rng.choice(hot), types=SUBTYPES)]
+            for _ in range(args.calls)
+        ]
+
+        print(f"{args.entities} entites, {args.calls} appels sur {args.hot} entites chaudes")
+        measure("json", lambda refs: resolve_json(metadata_file, refs), requests_refs[: max(1, args.calls // 20)])
+        measure("sqlite", resolve_sqlite, requests_refs)
+        measure("memo", ReferenceManager.resolve_references, requests_refs)
+        print(f"memo: {ReferenceManager.cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
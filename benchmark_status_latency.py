@@ -0,0 +1,96 @@
+"""
+Benchmark latence p99 de GET /v1/status pendant des uploads de references
+concurrents.
+
+Usage (API demarree):
+    python benchmark_status_latency.py --api http://localhost:8000 --key $(cat secrets/api_key.txt) \
+        --job-id <job_id existant> --uploads 8 --polls 500
+"""
+
+import argparse
+import io
+import statistics
+import threading
+import time
+
+import requests
+from PIL import Image
+
+
+def make_upload_payload(size: int) -> bytes:
+    """Image bruitee (PNG peu compressible) pour charger le decodage PIL"""
+    image = Image.effect_noise((size, size), 64).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def upload_loop(args, headers, payload, stop):
+    while not stop.is_set():
+        requests.post(
+            f"{args.api}/v1/references/{args.entity}/front",
+            headers=headers,
+            files={"file": ("bench.png", payload, "image/png")},
+            timeout=60,
+        )
+
+
+def measure_status(args, headers):
+    latencies = []
+    for _ in range(args.polls):
+        start = time.perf_counter()
+        requests.get(f"{args.api}/v1/status/{args.job_id}", headers=headers, timeout=30)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies
+
+
+def report(label, latencies):
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{label:22s} p50={statistics.median(latencies) * 1000:7.1f} ms  "
+        f"p99={p99 * 1000:7.1f} ms  max={latencies[-1] * 1000:7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="p99 /v1/status sous uploads concurrents")
+    parser.add_argument("--api", default="http://localhost:8000")
+    parser.add_argument("--key", required=True)
+    parser.add_argument("--job-id", required=True)
+    parser.add_argument("--entity", default="benchmark")
+    parser.add_argument("--uploads", type=int, default=8, help="Uploads concurrents")
+    parser.add_argument("--size", type=int, default=3000, help="Cote de l'image uploadee")
+    parser.add_argument("--polls", type=int, default=500)
+    args = parser.parse_args()
+
+    headers = {"X-API-Key": args.key}
+    requests.post(
+        f"{args.api}/v1/references/{args.entity}",
+        headers=headers,
+        json={"category": "character", "description": "benchmark"},
+        timeout=10,
+    )
+
+    report("status seul", measure_status(args, headers))
+
+    payload = make_upload_payload(args.size)
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=upload_loop, args=(args, headers, payload, stop), daemon=True)
+        for _ in range(args.uploads)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(1)
+    try:
+        report(f"status + {args.uploads} uploads", measure_status(args, headers))
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        requests.delete(f"{args.api}/v1/references/{args.entity}", headers=headers, timeout=10)
+
+
+if __name__ == "__main__":
+    main()
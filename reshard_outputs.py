@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Migration de OUTPUTS_DIR vers la disposition shardee ({YYYYMMDD}/{id[:2]}/),
+sans arret de l'API ni du worker (voir app.output_index).
+
+Usage:
+    python reshard_outputs.py --dry-run
+    python reshard_outputs.py --limit 10000 --pause 0.001
+"""
+
+import argparse
+
+from app.config import OUTPUTS_DIR
+from app.output_index import output_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reshard des images a plat de OUTPUTS_DIR")
+    parser.add_argument("--dry-run", action="store_true", help="Compte sans deplacer")
+    parser.add_argument("--limit", type=int, default=None, help="Nombre max d'images deplacees")
+    parser.add_argument("--pause", type=float, default=0.0, help="Pause (s) entre deux deplacements")
+    args = parser.parse_args()
+
+    counts = output_index.reshard(dry_run=args.dry_run, limit=args.limit, pause=args.pause)
+    action = "a deplacer" if args.dry_run else "deplacees"
+    print(f"{OUTPUTS_DIR}: {counts['moved']} images {action}, "
+          f"{counts['skipped']} ignorees, {counts['errors']} erreurs")
+    print(f"Index: {output_index.totals()}")
+
+
+if __name__ == "__main__":
+    main()
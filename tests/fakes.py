@@ -0,0 +1,137 @@
+"""
+Doublures partagees des tests : Redis en memoire et horloge manuelle.
+
+FakeRedis couvre le sous-ensemble de commandes utilise par app/ (chaines,
+hashes, sorted sets, publish, pipeline). Comme un serveur avec
+decode_responses=True, les valeurs relues sont des chaines ; chaque commande
+est atomique (verrou) pour les tests concurrents.
+"""
+import threading
+
+
+class FakeClock:
+    """Horloge avancee a la main (clock.now += ...)"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """Redis synchrone en memoire"""
+
+    def __init__(self):
+        self.strings = {}
+        self.hashes = {}
+        self.zsets = {}
+        self.channels = {}  # canal -> files des abonnes (put_nowait)
+        self.lock = threading.RLock()
+
+    # -------------------------------------------------------------- chaines
+
+    def set(self, name, value, nx=False, ex=None):
+        with self.lock:
+            if nx and name in self.strings:
+                return None
+            self.strings[name] = str(value)
+            return True
+
+    def get(self, name):
+        with self.lock:
+            return self.strings.get(name)
+
+    def delete(self, *names):
+        with self.lock:
+            return sum(
+                1 for name in names
+                if any(store.pop(name, None) is not None for store in (self.strings, self.hashes, self.zsets))
+            )
+
+    # -------------------------------------------------------------- hashes
+
+    def hset(self, name, key, value):
+        with self.lock:
+            self.hashes.setdefault(name, {})[key] = str(value)
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.hashes.get(name, {}))
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            h = self.hashes.get(name, {})
+            return sum(1 for key in keys if h.pop(key, None) is not None)
+
+    def hlen(self, name):
+        with self.lock:
+            return len(self.hashes.get(name, {}))
+
+    def hincrby(self, name, key, amount=1):
+        with self.lock:
+            h = self.hashes.setdefault(name, {})
+            value = int(h.get(key, 0)) + amount
+            h[key] = str(value)
+            return value
+
+    def hincrbyfloat(self, name, key, amount=1.0):
+        with self.lock:
+            h = self.hashes.setdefault(name, {})
+            value = float(h.get(key, 0)) + amount
+            h[key] = str(value)
+            return value
+
+    # ---------------------------------------------------------- sorted sets
+
+    def zadd(self, name, mapping):
+        with self.lock:
+            self.zsets.setdefault(name, {}).update(mapping)
+
+    def zcard(self, name):
+        with self.lock:
+            return len(self.zsets.get(name, {}))
+
+    def zrem(self, name, *members):
+        with self.lock:
+            z = self.zsets.get(name, {})
+            return sum(1 for member in members if z.pop(member, None) is not None)
+
+    def zrank(self, name, member):
+        with self.lock:
+            z = self.zsets.get(name, {})
+            if member not in z:
+                return None
+            return sorted(z, key=lambda m: (z[m], m)).index(member)
+
+    def zpopmin(self, name, count=1):
+        with self.lock:
+            z = self.zsets.get(name, {})
+            popped = sorted(z.items(), key=lambda item: (item[1], item[0]))[:count]
+            for member, _ in popped:
+                del z[member]
+            return popped
+
+    def zremrangebyscore(self, name, low, high):
+        with self.lock:
+            z = self.zsets.get(name, {})
+            expired = [m for m, score in z.items() if float(low) <= score <= float(high)]
+            for member in expired:
+                del z[member]
+            return len(expired)
+
+    # ---------------------------------------------------------------- divers
+
+    def publish(self, channel, message):
+        with self.lock:
+            queues = list(self.channels.get(channel, []))
+        for queue in queues:
+            queue.put_nowait({"type": "message", "channel": channel, "data": message})
+        return len(queues)
+
+    def pipeline(self):
+        # Commandes executees immediatement : suffisant pour des tests sequentiels
+        return self
+
+    def execute(self):
+        return []
@@ -0,0 +1,154 @@
+"""
+Tests du gestionnaire d'adapters LoRA (app/adapters.py)
+"""
+from app.adapters import AdapterManager, adapter_size_bytes
+
+
+class DummyParam:
+    def __init__(self, numel):
+        self._numel = numel
+
+    def numel(self):
+        return self._numel
+
+    def element_size(self):
+        return 2
+
+
+class DummyUNet:
+    def __init__(self):
+        self.params = {"down.0.attn.to_q.weight": DummyParam(1000)}
+
+    def named_parameters(self):
+        return iter(self.params.items())
+
+
+class FakePipe:
+    """Enregistre les appels PEFT faits par le gestionnaire."""
+
+    def __init__(self):
+        self.unet = DummyUNet()
+        self.calls = []
+
+    def load(self, name, numel=100):
+        self.unet.params[f"down.0.attn.to_q.lora_A.{name}.weight"] = DummyParam(numel)
+
+    def set_adapters(self, names, adapter_weights=None):
+        self.calls.append(("set_adapters", tuple(names), tuple(adapter_weights)))
+
+    def delete_adapters(self, names):
+        for name in names:
+            self.unet.params = {k: v for k, v in self.unet.params.items() if f".{name}." not in k}
+        self.calls.append(("delete_adapters", tuple(names)))
+
+    def disable_lora(self):
+        self.calls.append(("disable_lora",))
+
+    def enable_lora(self):
+        self.calls.append(("enable_lora",))
+
+
+class Config:
+    def __init__(self, name):
+        self.name = name
+
+
+def _manager(max_adapters=3, max_bytes=10_000):
+    pipe = FakePipe()
+    manager = AdapterManager(
+        pipe,
+        loader=lambda p, name, config: p.load(name),
+        max_adapters=max_adapters,
+        max_bytes=max_bytes,
+    )
+    return manager, pipe
+
+
+def _req(*pairs):
+    return [(name, weight, Config(name)) for name, weight in pairs]
+
+
+class TestSizeAccounting:
+
+    def test_counts_only_matching_adapter(self):
+        pipe = FakePipe()
+        pipe.load("anime", numel=100)
+        pipe.load("detail", numel=50)
+        assert adapter_size_bytes(pipe, "anime") == 200
+
+
+class TestDiff:
+
+    def test_unchanged_set_skips_set_adapters(self):
+        manager, pipe = _manager()
+        assert manager.apply(_req(("anime", 0.7), ("detail", 0.6))) is True
+        assert manager.apply(_req(("detail", 0.6), ("anime", 0.7))) is False
+
+        assert [c[0] for c in pipe.calls] == ["set_adapters"]
+        assert manager.stats()["skips"] == 1
+
+    def test_weight_change_reapplies_without_reload(self):
+        manager, pipe = _manager()
+        manager.apply(_req(("anime", 0.7)))
+        manager.apply(_req(("anime", 0.9)))
+
+        assert pipe.calls[-1] == ("set_adapters", ("anime",), (0.9,))
+        assert manager.stats()["loads"] == 1
+
+    def test_empty_set_disables_but_keeps_adapters(self):
+        manager, pipe = _manager()
+        manager.apply(_req(("anime", 0.7)))
+        manager.apply([])
+        manager.apply(_req(("anime", 0.7)))
+
+        assert [c[0] for c in pipe.calls] == ["set_adapters", "disable_lora", "enable_lora", "set_adapters"]
+        assert manager.stats()["loads"] == 1
+
+
+class TestEviction:
+
+    def test_evicts_least_recent_adapter_only(self):
+        manager, pipe = _manager(max_adapters=2)
+        manager.apply(_req(("a", 1.0)))
+        manager.apply(_req(("b", 1.0)))
+        manager.apply(_req(("a", 0.5)))  # b devient le moins recent
+        manager.apply(_req(("c", 1.0)))
+
+        assert ("delete_adapters", ("b",)) in pipe.calls
+        assert list(manager.loaded) == ["a", "c"]
+
+    def test_byte_budget(self):
+        manager, pipe = _manager(max_adapters=10, max_bytes=450)
+        manager.apply(_req(("a", 1.0)))
+        manager.apply(_req(("b", 1.0)))
+        manager.apply(_req(("c", 1.0)))
+
+        assert manager.total_bytes <= 450
+        assert "a" not in manager.loaded
+
+    def test_requested_adapters_are_never_evicted(self):
+        manager, _ = _manager(max_adapters=1)
+        manager.apply(_req(("a", 1.0), ("b", 1.0)))
+        assert set(manager.loaded) == {"a", "b"}
+
+    def test_failed_load_is_skipped(self):
+        pipe = FakePipe()
+
+        def loader(p, name, config):
+            if name == "broken":
+                raise OSError("missing file")
+            p.load(name)
+
+        manager = AdapterManager(pipe, loader=loader, max_adapters=3, max_bytes=10_000)
+        manager.apply(_req(("broken", 1.0), ("ok", 0.5)))
+
+        assert pipe.calls[-1] == ("set_adapters", ("ok",), (0.5,))
+
+    def test_disable_keeps_adapters_loaded(self):
+        manager, pipe = _manager()
+        manager.apply(_req(("a", 1.0)))
+        manager.disable()
+        manager.apply(_req(("a", 1.0)))
+
+        assert [c[0] for c in pipe.calls] == ["set_adapters", "disable_lora", "enable_lora", "set_adapters"]
+        assert manager.stats()["loads"] == 1
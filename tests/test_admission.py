@@ -0,0 +1,87 @@
+"""
+Tests du controle d'admission de la file (app/admission.py)
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.admission import AdmissionController, QueueFull
+from fakes import FakeClock, FakeRedis
+
+
+def _controller(max_size=3, entry_ttl=3600, clock=None):
+    return AdmissionController(redis_client=FakeRedis(), max_size=max_size,
+                               entry_ttl=entry_ttl, clock=clock or FakeClock())
+
+
+class TestAdmit:
+
+    def test_returns_jobs_ahead(self):
+        admission = _controller()
+        assert admission.admit(["a"]) == 0
+        assert admission.admit(["b"]) == 1
+        assert admission.depth() == 2
+
+    def test_rejects_over_capacity(self):
+        admission = _controller(max_size=2)
+        admission.admit(["a", "b"])
+
+        with pytest.raises(QueueFull) as exc:
+            admission.admit(["c"])
+        assert (exc.value.depth, exc.value.max_size) == (2, 2)
+        assert admission.depth() == 2
+
+    def test_batch_is_all_or_nothing(self):
+        admission = _controller(max_size=3)
+        admission.admit(["a", "b"])
+
+        with pytest.raises(QueueFull):
+            admission.admit(["c", "d"])
+        assert admission.position("c") is None
+
+    def test_release_frees_slot_once(self):
+        admission = _controller(max_size=1)
+        admission.admit(["a"])
+        admission.release("a")
+        admission.release("a")  # retry / resultat de batch rejoue
+
+        assert admission.admit(["b"]) == 0
+
+    def test_position(self):
+        clock = FakeClock()
+        admission = _controller(clock=clock)
+        admission.admit(["a"])
+        clock.now += 1
+        admission.admit(["b"])
+
+        assert admission.position("b") == 2
+        admission.release("a")
+        assert admission.position("b") == 1
+
+    def test_orphans_expire(self):
+        clock = FakeClock()
+        admission = _controller(max_size=1, entry_ttl=60, clock=clock)
+        admission.admit(["killed-worker-job"])
+        clock.now += 61
+
+        assert admission.admit(["b"]) == 0
+
+
+class TestBurst:
+
+    def test_burst_never_exceeds_capacity(self):
+        """500 soumissions concurrentes : au plus max_size admises (latence: benchmark_admission.py)"""
+        admission = _controller(max_size=100)
+
+        def submit(i):
+            try:
+                admission.admit([f"job-{i}"])
+                return True
+            except QueueFull:
+                return False
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            admitted = sum(pool.map(submit, range(500)))
+
+        assert 0 < admitted <= 100
+        assert admission.depth() == admitted
@@ -0,0 +1,156 @@
+"""
+Tests du regroupement de jobs compatibles (app/batching.py)
+"""
+from app.batching import BatchCollector, batch_key
+from fakes import FakeRedis
+
+
+def _job(prompt="a cat", model="sdxl", steps=30, **overrides):
+    job = dict(prompt=prompt, negative_prompt="", model=model, loras=[], steps=steps,
+               guidance_scale=7.5, seed=None, ip_strength=0.0, references=[])
+    job.update(overrides)
+    return job
+
+
+def _collector(**kwargs):
+    kwargs.setdefault("max_batch", 4)
+    kwargs.setdefault("max_wait_seconds", 0)
+    return BatchCollector(redis_client=FakeRedis(), sleep=lambda _: None, **kwargs)
+
+
+class TestBatchKey:
+
+    def test_reference_jobs_are_not_batchable(self):
+        assert batch_key(_job(references=[{"path": "x", "strength": 0.5}])) is None
+        assert batch_key(_job(ip_strength=0.4)) is None
+
+    def test_seed_sweeps_are_not_batchable(self):
+        assert batch_key(_job(seeds=[1, 2, 3])) is None
+
+    def test_lora_weights_matter(self):
+        a = _job(loras=[{"name": "anime-style", "weight": 0.7}])
+        b = _job(loras=[{"name": "anime-style", "weight": 0.9}])
+        assert batch_key(a) != batch_key(b)
+
+    def test_prompt_and_seed_do_not_matter(self):
+        assert batch_key(_job("a", seed=1)) == batch_key(_job("b", seed=2))
+
+
+class TestCollect:
+
+    def test_collects_only_compatible_jobs(self):
+        collector = _collector()
+        collector.offer("j2", _job("dog"))
+        collector.offer("j3", _job("cat", steps=50))
+        collector.offer("j4", _job("fox"))
+
+        collector.claim("j1", "j1")
+        batch = collector.collect("j1", _job("cat"))
+
+        assert [job_id for job_id, _ in batch] == ["j1", "j2", "j4"]
+
+    def test_no_candidate_returns_without_waiting(self):
+        sleeps = []
+        collector = BatchCollector(redis_client=FakeRedis(), max_batch=4, max_wait_seconds=10,
+                                   sleep=sleeps.append)
+        collector.offer("j2", _job(steps=50))
+
+        assert collector.collect("j1", _job()) == [("j1", _job())]
+        assert sleeps == []
+
+    def test_waits_while_candidates_arrive(self):
+        redis = FakeRedis()
+        collector = BatchCollector(redis_client=redis, max_batch=3, max_wait_seconds=10,
+                                   sleep=lambda _: collector.offer("j3", _job()))
+        collector.offer("j2", _job())
+
+        assert [job_id for job_id, _ in collector.collect("j1", _job())] == ["j1", "j2", "j3"]
+
+    def test_respects_max_batch(self):
+        collector = _collector(max_batch=2)
+        for job_id in ("j2", "j3", "j4"):
+            collector.offer(job_id, _job())
+
+        assert len(collector.collect("j1", _job())) == 2
+
+    def test_claimed_job_is_not_collected_twice(self):
+        collector = _collector()
+        collector.offer("j2", _job())
+
+        first = collector.collect("j1", _job())
+        second = collector.collect("j3", _job())
+
+        assert len(first) == 2 and len(second) == 1
+        assert collector.claim("j2", "j2") is False
+
+    def test_released_job_runs_alone(self):
+        collector = _collector()
+        collector.offer("j2", _job())
+        collector.collect("j1", _job())
+        collector.release(["j2"])
+
+        assert collector.claim("j2", "j2") is True
+
+    def test_withdrawn_job_is_never_collected(self):
+        collector = _collector()
+        collector.offer("j2", _job())
+
+        assert collector.withdraw("j2") is True
+        assert [job_id for job_id, _ in collector.collect("j1", _job())] == ["j1"]
+        assert collector.claim("j2", "j2") is False
+
+    def test_withdraw_after_claim_reports_it(self):
+        collector = _collector()
+        collector.offer("j2", _job())
+        collector.collect("j1", _job())
+
+        assert collector.withdraw("j2") is False
+
+    def test_claim_is_idempotent_for_owner(self):
+        collector = _collector()
+        assert collector.claim("j1", "j1") is True
+        assert collector.claim("j1", "j1") is True  # retry Celery
+
+
+class TestResults:
+
+    def test_published_result_is_returned_to_claimed_job(self):
+        collector = _collector(result_timeout=1)
+        collector.offer("j2", _job())
+        collector.collect("j1", _job())
+        collector.publish_result("j2", {"status": "success", "filename": "x.png"})
+
+        assert collector.wait_result("j2")["filename"] == "x.png"
+
+    def test_wait_stops_when_job_is_released(self):
+        collector = _collector(result_timeout=60)
+        assert collector.wait_result("unknown") is None
+
+    def test_wait_stops_when_owner_is_dead(self):
+        collector = _collector(result_timeout=60)
+        collector.offer("j2", _job())
+        collector.collect("j1", _job())
+        collector.redis.delete("imagen:batch:alive:j1")  # heartbeat expire
+
+        assert collector.wait_result("j2") is None
+
+    def test_wait_continues_while_owner_is_alive(self):
+        clock = iter(range(100)).__next__
+        collector = _collector(result_timeout=3, clock=clock)
+        collector.offer("j2", _job())
+        collector.collect("j1", _job())
+        collector.heartbeat("j1")
+
+        assert collector.wait_result("j2") is None  # expiration du delai global
+        assert collector.clock() > 3
+
+    def test_wait_stops_once_write_is_handed_off(self):
+        collector = _collector(result_timeout=60)
+        collector.offer("j2", _job())
+        collector.collect("j1", _job())
+        collector.heartbeat("j1")
+        collector.hand_off(["j2"])
+
+        assert collector.wait_result("j2") is None
+        assert collector.is_handed_off("j2") is True
+        assert collector.is_handed_off("j1") is False
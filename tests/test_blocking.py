@@ -0,0 +1,72 @@
+"""
+Tests des pools de travail bloquant des handlers (app/blocking.py)
+"""
+import asyncio
+import threading
+import time
+
+from app import blocking
+
+
+def _run(coro):
+    blocking._limiters.clear()  # Limiteurs lies a la boucle du test
+    return asyncio.run(coro)
+
+
+class TestRunBlocking:
+
+    def test_returns_result_and_kwargs(self):
+        async def main():
+            return await blocking.run_blocking("files", lambda a, b=0: a + b, 1, b=2)
+
+        assert _run(main()) == 3
+
+    def test_exceptions_propagate(self):
+        async def main():
+            try:
+                await blocking.run_blocking("files", int, "not a number")
+            except ValueError:
+                return "raised"
+
+        assert _run(main()) == "raised"
+
+    def test_pool_limit_is_respected(self, monkeypatch):
+        monkeypatch.setitem(blocking.BLOCKING_IO_LIMITS, "images", 2)
+        running, peak = [0], [0]
+        lock = threading.Lock()
+
+        def work():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+        async def main():
+            await asyncio.gather(*(blocking.run_blocking("images", work) for _ in range(6)))
+
+        _run(main())
+        assert peak[0] == 2
+
+    def test_saturated_pool_does_not_block_other_kinds(self, monkeypatch):
+        """Uploads lents en cours : les lectures de statut restent rapides"""
+        monkeypatch.setitem(blocking.BLOCKING_IO_LIMITS, "images", 1)
+
+        async def main():
+            uploads = [
+                asyncio.ensure_future(blocking.run_blocking("images", time.sleep, 0.3))
+                for _ in range(3)
+            ]
+            await asyncio.sleep(0.01)
+
+            latencies = []
+            for _ in range(20):
+                start = time.perf_counter()
+                await blocking.run_blocking("redis", lambda: "SUCCESS")
+                latencies.append(time.perf_counter() - start)
+            await asyncio.gather(*uploads)
+            return sorted(latencies)
+
+        latencies = _run(main())
+        assert latencies[-1] < 0.1  # bien en dessous d'un upload (0.3s)
@@ -0,0 +1,58 @@
+"""
+Tests du registre de composants partages (app/components.py)
+"""
+from app.components import ComponentRegistry, config_fingerprint, source_fingerprint
+
+
+class DummyPipeline:
+    def __init__(self, **components):
+        self.components = components
+
+
+class TestFingerprint:
+
+    def test_file_checksum_follows_content(self, tmp_path):
+        vae = tmp_path / "vae.safetensors"
+        vae.write_bytes(b"weights-v1")
+        first = source_fingerprint(str(vae))
+        vae.write_bytes(b"weights-v2")
+        assert source_fingerprint(str(vae)) != first
+
+    def test_config_fingerprint_ignores_key_order(self):
+        assert config_fingerprint({"a": 1, "b": 2}) == config_fingerprint({"b": 2, "a": 1})
+
+
+class TestComponentRegistry:
+
+    def test_identical_source_is_loaded_once(self, tmp_path):
+        vae_file = tmp_path / "vae.safetensors"
+        vae_file.write_bytes(b"weights")
+        registry = ComponentRegistry()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return object()
+
+        first = registry.get_or_load("vae", str(vae_file), loader)
+        second = registry.get_or_load("vae", str(vae_file), loader)
+
+        assert first is second
+        assert len(calls) == 1
+        assert registry.stats() == {"components": 1, "hits": 1, "loads": 1}
+
+    def test_different_fingerprint_loads_new_component(self):
+        registry = ComponentRegistry()
+        a = registry.get_or_load("scheduler", "Euler", object, fingerprint="cfg-a")
+        b = registry.get_or_load("scheduler", "Euler", object, fingerprint="cfg-b")
+        assert a is not b
+
+    def test_prune_keeps_components_still_in_use(self):
+        registry = ComponentRegistry()
+        vae = registry.get_or_load("vae", "shared-vae", object, fingerprint="x")
+        registry.get_or_load("tokenizer", "old", object, fingerprint="y")
+
+        removed = registry.prune([DummyPipeline(vae=vae, unet=object())])
+
+        assert removed == 1
+        assert registry.get_or_load("vae", "shared-vae", object, fingerprint="x") is vae
@@ -0,0 +1,150 @@
+"""
+Tests de la deduplication des requetes deterministes (app/dedup.py)
+"""
+import pytest
+
+from app.dedup import RequestDeduplicator, request_key, result_filenames
+from fakes import FakeClock, FakeRedis
+
+
+def _job(**overrides):
+    job = dict(prompt="a cat", negative_prompt="blurry", model="sdxl", loras=[], steps=30,
+               guidance_scale=7.5, seed=42, seeds=None, ip_strength=0.0, references=[])
+    job.update(overrides)
+    return job
+
+
+def _result(*filenames):
+    return {"status": "success", "filename": filenames[0], "url": f"/outputs/{filenames[0]}",
+            "images": [{"filename": name} for name in filenames] if len(filenames) > 1 else None}
+
+
+@pytest.fixture
+def files():
+    return set()
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def dedup(files, clock):
+    return RequestDeduplicator(
+        redis_client=FakeRedis(), ttl=3600, max_entries=2, inflight_ttl=600,
+        exists=files.__contains__, clock=clock,
+    )
+
+
+class TestRequestKey:
+
+    def test_parameters_change_the_key(self):
+        base = request_key(_job())
+        assert request_key(_job()) == base
+        assert request_key(_job(seed=43)) != base
+        assert request_key(_job(steps=31)) != base
+        assert request_key(_job(loras=[{"name": "anime", "weight": 0.7}])) != base
+
+    def test_references_are_hashed_by_content(self, tmp_path):
+        a, b, c = tmp_path / "a.png", tmp_path / "b.png", tmp_path / "c.png"
+        a.write_bytes(b"same")
+        b.write_bytes(b"same")
+        c.write_bytes(b"other")
+
+        def with_ref(path):
+            return _job(references=[{"path": str(path), "strength": 0.6, "embedding_path": None}])
+
+        assert request_key(with_ref(a)) == request_key(with_ref(b))  # chemin sans importance
+        assert request_key(with_ref(a)) != request_key(with_ref(c))
+
+        a.write_bytes(b"re-uploaded")
+        assert request_key(with_ref(a)) != request_key(with_ref(b))
+
+    def test_legacy_reference_counts_only_with_ip_strength(self, tmp_path):
+        legacy = tmp_path / "electra_ref.png"
+        legacy.write_bytes(b"v1")
+        with_ip = request_key(_job(ip_strength=0.5), legacy_reference=str(legacy))
+        assert request_key(_job(), legacy_reference=str(legacy)) == request_key(_job())
+
+        legacy.write_bytes(b"v2")
+        assert request_key(_job(ip_strength=0.5), legacy_reference=str(legacy)) != with_ip
+
+    def test_result_filenames(self):
+        assert result_filenames(_result("a.png")) == ["a.png"]
+        assert result_filenames(_result("a.png", "b.png")) == ["a.png", "b.png"]
+
+
+class TestDeduplicator:
+
+    def test_completed_result_is_reused(self, dedup, files):
+        assert dedup.lookup("k") is None
+        assert dedup.claim("k", "job-1") is None
+        files.add("a.png")
+        assert dedup.complete("job-1", _result("a.png"))
+
+        entry = dedup.lookup("k")
+        assert entry["task_id"] == "job-1"
+        assert entry["result"]["filename"] == "a.png"
+        assert dedup.stats()["hits"] == 1
+        # Reservation liberee : la cle peut etre reprise si le resultat disparait
+        assert dedup.claim("k", "job-2") is None
+
+    def test_identical_inflight_requests_are_coalesced(self, dedup):
+        assert dedup.claim("k", "job-1") is None
+        assert dedup.claim("k", "job-2") == "job-1"
+        assert dedup.claim("k", "job-3") == "job-1"
+        assert dedup.stats()["coalesced"] == 2
+
+    def test_failure_releases_the_key(self, dedup):
+        dedup.claim("k", "job-1")
+        dedup.abandon("job-1")
+        assert dedup.claim("k", "job-2") is None
+
+        dedup.release("k", "job-2")
+        assert dedup.claim("k", "job-3") is None
+
+    def test_deleted_files_invalidate_the_entry(self, dedup, files):
+        files.update({"a.png", "b.png"})
+        dedup.claim("k", "job-1")
+        dedup.complete("job-1", _result("a.png", "b.png"))
+
+        files.discard("b.png")  # retention
+        assert dedup.lookup("k") is None
+        assert dedup.stats()["entries"] == 0
+
+    def test_unclaimed_or_failed_results_are_not_stored(self, dedup, files):
+        assert not dedup.complete("job-x", _result("a.png"))  # seed aleatoire : jamais reserve
+
+        dedup.claim("k", "job-1")
+        dedup.complete("job-1", {"status": "error"})
+        assert dedup.stats()["stored"] == 0
+
+    def test_size_eviction_drops_least_recently_used(self, dedup, files, clock):
+        files.update({"a.png", "b.png", "c.png"})
+        for key, job_id, name in (("ka", "j1", "a.png"), ("kb", "j2", "b.png")):
+            clock.now += 1
+            dedup.claim(key, job_id)
+            dedup.complete(job_id, _result(name))
+        clock.now += 1
+        assert dedup.lookup("ka") is not None  # "ka" redevient le plus recent
+
+        clock.now += 1
+        dedup.claim("kc", "j3")
+        dedup.complete("j3", _result("c.png"))
+
+        assert dedup.lookup("kb") is None
+        assert dedup.lookup("ka") is not None
+        assert dedup.stats()["evicted"] == 1
+        assert dedup.stats()["entries"] == 2
+
+    def test_expired_entries_leave_the_usage_index(self, dedup, files, clock):
+        files.add("a.png")
+        dedup.claim("ka", "j1")
+        dedup.complete("j1", _result("a.png"))
+
+        clock.now += 3601
+        dedup.claim("kb", "j2")
+        dedup.complete("j2", _result("a.png"))
+
+        assert dedup.stats()["entries"] == 1
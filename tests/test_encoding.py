@@ -0,0 +1,155 @@
+"""
+Tests de l'encodage des sorties et du cache de derives (app/encoding.py, app/derivatives.py)
+"""
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from app.derivatives import DerivativeCache
+from app.encoding import available_formats, encode, format_of, save_image, save_options
+
+
+def _image(color=(200, 30, 30)):
+    return Image.new("RGB", (64, 64), color)
+
+
+def _write_png(path, color=(200, 30, 30)):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    save_image(_image(color), path, "png")
+    return path
+
+
+class TestEncoding:
+
+    def test_formats_roundtrip(self):
+        for output_format, pil_format in (("png", "PNG"), ("webp", "WEBP"), ("jpeg", "JPEG")):
+            data = encode(_image(), output_format, 80)
+            with Image.open(io.BytesIO(data)) as decoded:
+                assert decoded.format == pil_format
+                assert decoded.size == (64, 64)
+
+    def test_save_options(self):
+        assert "quality" not in save_options("png", 50)
+        assert save_options("webp")["quality"] == 90
+        assert save_options("jpeg", 95)["subsampling"] == 0
+        assert save_options("jpeg", 80) == {"quality": 80, "subsampling": 2}
+
+    def test_jpeg_drops_alpha(self):
+        data = encode(Image.new("RGBA", (8, 8)), "jpeg")
+        with Image.open(io.BytesIO(data)) as decoded:
+            assert decoded.mode == "RGB"
+
+    def test_format_of(self):
+        assert format_of("sdxl_20260130_120000_ab12cd34.png") == "png"
+        assert format_of("sdxl_20260130_120000_ab12cd34.jpg") == "jpeg"
+        assert format_of("a.WEBP") == "webp"
+        assert format_of("a.avif") == "avif"
+
+    def test_available_formats(self):
+        assert {"png", "webp", "jpeg"} <= set(available_formats())
+
+
+class TestDerivativeCache:
+
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return DerivativeCache(tmp_path / ".derivatives", max_bytes=10**9)
+
+    def test_transcode_is_cached(self, cache, tmp_path):
+        source = _write_png(tmp_path / "a.png")
+        first = cache.transcode("a.png", source, "webp", 80)
+        assert first.suffix == ".webp"
+        with Image.open(first) as decoded:
+            assert decoded.format == "WEBP"
+
+        assert cache.transcode("a.png", source, "webp", 80) == first
+        assert cache.transcode("a.png", source, "webp", 50) != first  # autre qualite
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 2
+
+    def test_newer_source_is_retranscoded(self, cache, tmp_path):
+        source = _write_png(tmp_path / "a.png")
+        target = cache.transcode("a.png", source, "jpeg", None)
+        old = os.stat(target).st_mtime - 10
+        os.utime(target, (old, old))
+
+        _write_png(source, color=(0, 0, 255))
+        cache.transcode("a.png", source, "jpeg", None)
+        with Image.open(target) as decoded:
+            assert decoded.getpixel((32, 32))[2] > 200
+        assert cache.stats()["misses"] == 2
+
+    def test_lru_eviction(self, tmp_path):
+        cache = DerivativeCache(tmp_path / ".derivatives", max_bytes=10**9)
+        sources = [_write_png(tmp_path / f"{name}.png") for name in "abc"]
+        a = cache.transcode("a.png", sources[0], "png", None)
+        cache.max_bytes = 2 * a.stat().st_size
+
+        b = cache.transcode("b.png", sources[1], "png", None)
+        cache.transcode("a.png", sources[0], "png", None)  # "a" redevient le plus recent
+        cache.transcode("c.png", sources[2], "png", None)
+
+        assert not b.exists()
+        assert a.exists()
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["bytes"] <= cache.max_bytes
+
+    def test_eviction_sees_other_processes(self, tmp_path):
+        worker = DerivativeCache(tmp_path / ".derivatives", max_bytes=10**9)
+        api = DerivativeCache(tmp_path / ".derivatives", max_bytes=10**9)
+        sources = [_write_png(tmp_path / f"{name}.png") for name in "abc"]
+        a = worker.transcode("a.png", sources[0], "png", None)
+        b = worker.transcode("b.png", sources[1], "png", None)
+        for path, age in ((a, 20), (b, 10)):
+            old = os.stat(path).st_mtime - age
+            os.utime(path, (old, old))
+
+        api.transcode("a.png", sources[0], "png", None)  # lecture par l'API : "a" redevient recent
+        api.max_bytes = 2 * a.stat().st_size
+        api.transcode("c.png", sources[2], "png", None)
+
+        assert a.exists() and not b.exists()
+        assert api.stats()["bytes"] <= api.max_bytes
+
+    def test_existing_cache_is_loaded(self, tmp_path):
+        source = _write_png(tmp_path / "a.png")
+        DerivativeCache(tmp_path / ".derivatives").transcode("a.png", source, "webp", None)
+
+        reopened = DerivativeCache(tmp_path / ".derivatives")
+        assert reopened.stats()["entries"] == 1
+        reopened.transcode("a.png", source, "webp", None)
+        assert reopened.stats()["hits"] == 1
+
+    def test_discard(self, cache, tmp_path):
+        source = _write_png(tmp_path / "a.png")
+        other = _write_png(tmp_path / "ab.png")
+        cache.transcode("a.png", source, "webp", None)
+        cache.transcode("a.png", source, "jpeg", 70)
+        kept = cache.transcode("ab.png", other, "webp", None)
+
+        assert cache.discard("a.png") == 2
+        assert kept.exists()
+        assert cache.stats()["entries"] == 1
+        assert cache.discard("a.png") == 0
+
+    def test_thumbnail_keeps_aspect_ratio(self, cache, tmp_path):
+        source = tmp_path / "wide.png"
+        Image.new("RGB", (400, 200), (10, 200, 10)).save(source)
+
+        thumb = cache.thumbnail("wide.png", source, 128)
+        with Image.open(thumb) as decoded:
+            assert decoded.format == "WEBP"
+            assert decoded.size == (128, 64)
+        assert cache.thumbnail("wide.png", source, 128) == thumb
+        assert cache.stats()["hits"] == 1
+
+    def test_thumbnail_from_image_in_memory(self, cache, tmp_path):
+        source = _write_png(tmp_path / "a.png")
+        image = _image()
+        thumb = cache.thumbnail("a.png", source, 256, image=image)
+        with Image.open(thumb) as decoded:
+            assert decoded.size == (64, 64)  # jamais agrandie
+        assert image.size == (64, 64)
+        assert cache.discard("a.png") == 1
@@ -0,0 +1,140 @@
+"""
+Tests du flux d'evenements des jobs (app/events.py)
+"""
+import asyncio
+import json
+
+from app.events import CHANNEL_KEY, LAST_KEY, JobEventBus, format_sse, make_event
+from fakes import FakeRedis
+
+
+class FakePubSub:
+    """Abonnement asynchrone aux canaux du FakeRedis partage"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.queue = asyncio.Queue()
+        self.closed = False
+
+    async def subscribe(self, channel):
+        self.redis.channels.setdefault(channel, []).append(self.queue)
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        self.closed = True
+        for queues in self.redis.channels.values():
+            if self.queue in queues:
+                queues.remove(self.queue)
+
+
+class FakeAsyncRedis:
+    """Client asynchrone branche sur le meme FakeRedis que le client synchrone"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.pubsubs = []
+
+    def pubsub(self):
+        pubsub = FakePubSub(self.redis)
+        self.pubsubs.append(pubsub)
+        return pubsub
+
+    async def get(self, key):
+        return self.redis.get(key)
+
+
+def _bus(heartbeat=5.0):
+    redis = FakeRedis()
+    return JobEventBus(redis, FakeAsyncRedis(redis), heartbeat_seconds=heartbeat)
+
+
+async def _no_initial():
+    return None
+
+
+async def _collect(bus, job_id, initial=_no_initial, limit=10):
+    collected = []
+    async for event in bus.stream(job_id, initial):
+        collected.append(event)
+        if len(collected) >= limit:
+            break
+    return collected
+
+
+class TestPublish:
+
+    def test_publish_stores_last_event(self):
+        bus = _bus()
+        bus.publish("job-1", "progress", {"step": "generation"})
+
+        last = bus.last("job-1")
+        assert last["type"] == "progress"
+        assert last["job_id"] == "job-1"
+        assert last["data"] == {"step": "generation"}
+        assert json.loads(bus.redis.get(LAST_KEY.format(job_id="job-1")))["type"] == "progress"
+
+    def test_last_unknown_job_is_none(self):
+        assert _bus().last("missing") is None
+
+    def test_format_sse(self):
+        event = make_event("job-1", "result", {"filename": "a.png"})
+        text = format_sse(event)
+        assert text.startswith("event: result\ndata: ")
+        assert text.endswith("\n\n")
+        assert json.loads(text.split("data: ", 1)[1])["data"] == {"filename": "a.png"}
+        assert format_sse(None) == ": keepalive\n\n"
+
+
+class TestStream:
+
+    def test_finished_job_yields_result_and_stops(self):
+        bus = _bus()
+        bus.publish("job-1", "result", {"filename": "a.png"})
+
+        events = asyncio.run(_collect(bus, "job-1"))
+
+        assert [e["type"] for e in events] == ["result"]
+        assert bus.async_redis.pubsubs[0].closed
+
+    def test_initial_used_when_nothing_published(self):
+        bus = _bus()
+
+        async def initial():
+            return make_event("job-1", "error", {"error": "boom"})
+
+        events = asyncio.run(_collect(bus, "job-1", initial))
+        assert [e["type"] for e in events] == ["error"]
+
+    def test_relays_published_events_until_result(self):
+        bus = _bus()
+
+        async def initial():
+            return make_event("job-1", "queued", {"position": 2})
+
+        async def main():
+            consumer = asyncio.ensure_future(_collect(bus, "job-1", initial))
+            await asyncio.sleep(0.01)
+            bus.publish("job-1", "progress", {"step": "generation"})
+            bus.publish("job-2", "progress", {"step": "autre job"})
+            bus.publish("job-1", "result", {"filename": "a.png"})
+            bus.publish("job-1", "progress", {"step": "apres la fin"})
+            return await consumer
+
+        events = asyncio.run(main())
+
+        assert [e["type"] for e in events] == ["queued", "progress", "result"]
+        assert events[1]["data"] == {"step": "generation"}
+        assert bus.async_redis.redis.channels[CHANNEL_KEY.format(job_id="job-1")] == []
+
+    def test_keepalive_when_job_is_silent(self):
+        bus = _bus(heartbeat=0.01)
+
+        events = asyncio.run(_collect(bus, "job-1", limit=2))
+
+        assert events == [None, None]
+        assert bus.async_redis.pubsubs[0].closed
@@ -0,0 +1,215 @@
+"""
+Tests du chemin rapide LoRA fusionne (app/fusion.py)
+"""
+from app.fusion import LoRAFusion, fusion_key
+
+BASE = "down.0.attn.to_q.base_layer.weight"
+OTHER = "down.0.attn.to_k.base_layer.weight"
+
+
+class FakeTensor:
+    """Tenseur scalaire : assez pour copy_/detach/to."""
+
+    def __init__(self, value):
+        self.value = value
+
+    @property
+    def data(self):
+        return self
+
+    def copy_(self, other):
+        self.value = other.value
+
+    def detach(self):
+        return self
+
+    def to(self, device, copy=False):
+        return FakeTensor(self.value)
+
+    def numel(self):
+        return 100
+
+    def element_size(self):
+        return 2
+
+
+class FakeUNet:
+    def __init__(self):
+        self.params = {BASE: FakeTensor(1.0), OTHER: FakeTensor(2.0)}
+        self.peft_config = {}
+
+    def named_parameters(self):
+        return iter(self.params.items())
+
+
+class FakePipe:
+    """fuse_lora ajoute le delta de chaque adapter, unfuse le retire (avec derive)."""
+
+    def __init__(self):
+        self.unet = FakeUNet()
+        self.text_encoder = type("TE", (), {"peft_config": {}})()
+        self.text_encoder_2 = None
+        self.deltas = {}
+        self.merged = set()
+        self.fuse_calls = 0
+
+    def add_adapter(self, name, layer=BASE, delta=0.5):
+        prefix = layer[: -len(".base_layer.weight")]
+        self.unet.params[f"{prefix}.lora_A.{name}.weight"] = FakeTensor(0.0)
+        self.unet.peft_config[name] = object()
+        self.deltas[name] = (layer, delta)
+
+    def fuse_lora(self, fuse_text_encoder=True, adapter_names=None):
+        self.fuse_calls += 1
+        for name in adapter_names:
+            layer, delta = self.deltas[name]
+            self.unet.params[layer].value += delta
+            self.merged.add(layer)
+
+    def unfuse_lora(self, unfuse_text_encoder=True):
+        # Derive volontaire : l'unfuse PEFT n'est pas exact en fp16
+        for layer in self.merged:
+            self.unet.params[layer].value += 0.001
+        self.merged.clear()
+
+
+def _fusion(pipe, **kwargs):
+    kwargs.setdefault("max_combos", 2)
+    kwargs.setdefault("max_bytes", 10_000)
+    kwargs.setdefault("min_uses", 2)
+    return LoRAFusion(pipe, **kwargs)
+
+
+def _value(pipe, layer=BASE):
+    return pipe.unet.params[layer].value
+
+
+class TestKey:
+
+    def test_order_independent_and_weight_sensitive(self):
+        a = fusion_key("sdxl", [("x", 0.7, None), ("y", 1.0, None)])
+        b = fusion_key("sdxl", [("y", 1.0, None), ("x", 0.7, None)])
+        c = fusion_key("sdxl", [("x", 0.8, None), ("y", 1.0, None)])
+        assert a == b and a != c
+
+
+class TestHotness:
+
+    def test_combo_is_hot_after_min_uses(self):
+        fusion = _fusion(FakePipe(), min_uses=3)
+        assert [fusion.record_use("k") for _ in range(3)] == [False, False, True]
+
+    def test_text_encoder_loras_are_not_eligible(self):
+        pipe = FakePipe()
+        pipe.add_adapter("style")
+        fusion = _fusion(pipe)
+        assert fusion.is_eligible(["style"]) is True
+
+        pipe.text_encoder.peft_config = {"style": object()}
+        assert fusion.is_eligible(["style"]) is False
+
+    def test_unloaded_adapter_is_not_eligible(self):
+        assert _fusion(FakePipe()).is_eligible(["missing"]) is False
+
+
+class TestFuseUnfuse:
+
+    def test_enter_applies_fused_weights(self):
+        pipe = FakePipe()
+        pipe.add_adapter("style", delta=0.5)
+        fusion = _fusion(pipe)
+        prepared = []
+
+        fusion.enter("k", ["style"], prepare=lambda: prepared.append(True))
+
+        assert prepared == [True]
+        assert _value(pipe) == 1.5
+        assert _value(pipe, OTHER) == 2.0
+
+    def test_leave_restores_exact_originals(self):
+        pipe = FakePipe()
+        pipe.add_adapter("style")
+        fusion = _fusion(pipe)
+
+        fusion.enter("k", ["style"], prepare=lambda: None)
+        fusion.leave()
+
+        assert _value(pipe) == 1.0  # pas de derive de l'unfuse
+        assert fusion.current is None
+
+    def test_switching_combo_does_not_stack_deltas(self):
+        pipe = FakePipe()
+        pipe.add_adapter("a", layer=BASE, delta=0.5)
+        pipe.add_adapter("b", layer=OTHER, delta=0.25)
+        fusion = _fusion(pipe)
+
+        fusion.enter("ka", ["a"], prepare=lambda: None)
+        fusion.enter("kb", ["b"], prepare=lambda: None)
+
+        assert _value(pipe) == 1.0
+        assert _value(pipe, OTHER) == 2.25
+
+    def test_cached_combo_skips_fuse(self):
+        pipe = FakePipe()
+        pipe.add_adapter("a", delta=0.5)
+        pipe.add_adapter("b", layer=OTHER)
+        fusion = _fusion(pipe)
+
+        fusion.enter("ka", ["a"], prepare=lambda: None)
+        fusion.enter("kb", ["b"], prepare=lambda: None)
+        fusion.enter("ka", ["a"], prepare=lambda: (_ for _ in ()).throw(AssertionError))
+
+        assert pipe.fuse_calls == 2
+        assert _value(pipe) == 1.5
+        assert fusion.stats()["hits"] == 1
+
+    def test_reentering_current_combo_is_noop(self):
+        pipe = FakePipe()
+        pipe.add_adapter("a")
+        fusion = _fusion(pipe)
+
+        fusion.enter("k", ["a"], prepare=lambda: None)
+        fusion.enter("k", ["a"], prepare=lambda: None)
+
+        assert fusion.stats()["restores"] == 0
+
+
+class TestBudget:
+
+    def test_combo_count_cap_evicts_oldest(self):
+        pipe = FakePipe()
+        for name in ("a", "b", "c"):
+            pipe.add_adapter(name)
+        fusion = _fusion(pipe, max_combos=2)
+
+        for name in ("a", "b", "c"):
+            fusion.enter(f"k{name}", [name], prepare=lambda: None)
+
+        assert list(fusion.fused) == ["kb", "kc"]
+        assert fusion.stats()["evictions"] == 1
+
+    def test_byte_cap_keeps_latest_combo(self):
+        pipe = FakePipe()
+        pipe.add_adapter("a")
+        pipe.add_adapter("b")
+        fusion = _fusion(pipe, max_bytes=100)  # moins qu'une couche
+
+        fusion.enter("ka", ["a"], prepare=lambda: None)
+        fusion.enter("kb", ["b"], prepare=lambda: None)
+
+        assert list(fusion.fused) == ["kb"]
+        assert _value(pipe) == 1.5
+
+    def test_eviction_drops_unused_originals(self):
+        pipe = FakePipe()
+        pipe.add_adapter("a", layer=BASE)
+        pipe.add_adapter("b", layer=OTHER)
+        fusion = _fusion(pipe, max_combos=1)
+
+        fusion.enter("ka", ["a"], prepare=lambda: None)
+        fusion.enter("kb", ["b"], prepare=lambda: None)
+
+        assert list(fusion.originals) == [OTHER]
+        assert fusion.total_bytes == 2 * 200  # poids fusionnes + originaux de "kb"
+        fusion.leave()
+        assert _value(pipe) == 1.0 and _value(pipe, OTHER) == 2.0
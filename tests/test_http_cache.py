@@ -0,0 +1,83 @@
+"""
+Tests des validateurs et plages HTTP des images (app/http_cache.py)
+"""
+import os
+
+import pytest
+from starlette.requests import Request
+
+from app.http_cache import (
+    FileRangeResponse,
+    RangeNotSatisfiable,
+    etag_matches,
+    file_response,
+    parse_range,
+    strong_etag,
+)
+
+ETAG = strong_etag("ab" * 32)
+
+
+def _request(**headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+class TestValidators:
+
+    def test_etag_matches(self):
+        assert etag_matches(ETAG, ETAG)
+        assert etag_matches(f'"other", W/{ETAG}', ETAG)
+        assert etag_matches("*", ETAG)
+        assert not etag_matches('"other"', ETAG)
+        assert not etag_matches(None, ETAG)
+
+    def test_parse_range(self):
+        assert parse_range("bytes=0-99", 1000) == (0, 99)
+        assert parse_range("bytes=900-", 1000) == (900, 999)
+        assert parse_range("bytes=990-2000", 1000) == (990, 999)
+        assert parse_range("bytes=-100", 1000) == (900, 999)
+        assert parse_range("bytes=-5000", 1000) == (0, 999)
+
+    def test_unsupported_ranges_serve_the_whole_file(self):
+        for header in (None, "", "bytes=0-1,5-9", "items=0-1", "bytes=9-2", "bytes=-"):
+            assert parse_range(header, 1000) is None
+
+    def test_unsatisfiable_ranges(self):
+        for header in ("bytes=1000-", "bytes=-0"):
+            with pytest.raises(RangeNotSatisfiable):
+                parse_range(header, 1000)
+
+
+class TestFileResponse:
+
+    @pytest.fixture
+    def path(self, tmp_path):
+        path = tmp_path / "a.png"
+        path.write_bytes(bytes(range(100)))
+        return path
+
+    def test_not_modified(self, path):
+        response = file_response(_request(if_none_match=ETAG), path, os.stat(path), etag=ETAG)
+        assert response.status_code == 304
+        assert response.headers["etag"] == ETAG
+
+    def test_range(self, path):
+        response = file_response(_request(range="bytes=10-19"), path, os.stat(path), etag=ETAG)
+        assert isinstance(response, FileRangeResponse)
+        assert response.headers["content-range"] == "bytes 10-19/100"
+        assert response.headers["content-length"] == "10"
+
+    def test_if_range_mismatch_serves_the_whole_file(self, path):
+        request = _request(range="bytes=10-19", if_range='"old"')
+        response = file_response(request, path, os.stat(path), etag=ETAG)
+        assert response.status_code == 200
+        assert response.headers["content-length"] == "100"
+
+    def test_unsatisfiable(self, path):
+        response = file_response(_request(range="bytes=500-"), path, os.stat(path), etag=ETAG)
+        assert response.status_code == 416
+        assert response.headers["content-range"] == "bytes */100"
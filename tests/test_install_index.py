@@ -0,0 +1,196 @@
+"""
+Tests de l'index d'installation des modeles/LoRAs (app/install_index.py)
+"""
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+from app.install_index import InstallIndex
+
+
+def fake_scan_cache_dir(models_dir: Path):
+    """Equivalent minimal de huggingface_hub.scan_cache_dir"""
+    repos = []
+    for repo_dir in sorted(models_dir.glob("models--*")):
+        revisions = []
+        for snapshot in sorted((repo_dir / "snapshots").iterdir()):
+            files = [
+                SimpleNamespace(file_path=path, file_name=path.name, size_on_disk=path.stat().st_size)
+                for path in sorted(snapshot.rglob("*"))
+                if path.is_file()
+            ]
+            revisions.append(SimpleNamespace(snapshot_path=snapshot, files=files))
+        repos.append(SimpleNamespace(repo_path=repo_dir, revisions=revisions))
+    return SimpleNamespace(repos=repos)
+
+
+class CountingScan:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, models_dir):
+        self.calls += 1
+        return fake_scan_cache_dir(models_dir)
+
+
+def _touch(path: Path, size: int = 10) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+
+
+def _bump_mtime(path: Path) -> None:
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def _setup(tmp_path):
+    models_dir = tmp_path / "models"
+    civitai_dir = models_dir / "loras" / "civitai"
+    _touch(models_dir / "models--stabilityai--sdxl" / "snapshots" / "rev1" / "unet" / "model.safetensors", 100)
+    _touch(models_dir / "models--Lylia--Pony" / "snapshots" / "rev1" / "pony.safetensors", 50)
+    _touch(models_dir / "models--Lykon--detail-lora-xl" / "snapshots" / "rev1" / "lora.safetensors", 5)
+    _touch(civitai_dir / "civitai_1" / "a.safetensors", 20)
+    (civitai_dir / "civitai_2").mkdir(parents=True)
+    return models_dir, civitai_dir
+
+
+def _index(models_dir, civitai_dir, tmp_path, scan=None, **kwargs):
+    return InstallIndex(
+        models_dir=models_dir,
+        civitai_dir=civitai_dir,
+        index_file=tmp_path / "index.json",
+        check_seconds=0,
+        scan=scan or CountingScan(),
+        **kwargs,
+    )
+
+
+class TestLookups:
+
+    def test_models(self, tmp_path):
+        models_dir, civitai_dir = _setup(tmp_path)
+        index = _index(models_dir, civitai_dir, tmp_path)
+
+        assert index.is_model_installed("stabilityai/sdxl")
+        assert index.is_model_installed("Lylia/Pony", "pony.safetensors")
+        assert not index.is_model_installed("Lylia/Pony", "other.safetensors")
+        assert not index.is_model_installed("stabilityai/sd")  # pas de correspondance partielle
+
+        installed = {m["repo_id"]: m for m in index.installed_models()}
+        assert set(installed) == {"stabilityai/sdxl", "Lylia/Pony", "Lykon/detail-lora-xl"}
+        assert installed["Lylia/Pony"]["num_files"] == 1
+
+    def test_loras(self, tmp_path, monkeypatch):
+        models_dir, civitai_dir = _setup(tmp_path)
+        monkeypatch.chdir(tmp_path)
+        index = _index(models_dir, civitai_dir, tmp_path)
+
+        assert index.is_lora_installed("./models/loras/civitai/civitai_1")
+        assert not index.is_lora_installed("./models/loras/civitai/civitai_2")
+        assert not index.is_lora_installed("./models/loras/civitai/missing")
+        assert index.is_lora_installed("Lykon/detail-lora-xl")
+
+        installed = index.installed_loras()
+        assert [l["source"] for l in installed] == ["civitai", "huggingface"]
+        assert installed[0]["files"] == ["a.safetensors"]
+        assert installed[0]["path"] == os.path.join("models", "loras", "civitai", "civitai_1")
+        assert installed[1]["reference"] == "huggingface-Lykon/detail-lora-xl"
+
+
+class TestRefresh:
+
+    def test_scanned_once_while_nothing_changes(self, tmp_path):
+        models_dir, civitai_dir = _setup(tmp_path)
+        scan = CountingScan()
+        index = _index(models_dir, civitai_dir, tmp_path, scan=scan)
+
+        for _ in range(20):
+            index.is_model_installed("stabilityai/sdxl")
+            index.installed_models()
+            index.installed_loras()
+
+        assert scan.calls == 1
+        assert index.civitai_scans == 2
+
+    def test_new_snapshot_file_triggers_rescan(self, tmp_path):
+        models_dir, civitai_dir = _setup(tmp_path)
+        scan = CountingScan()
+        index = _index(models_dir, civitai_dir, tmp_path, scan=scan)
+        version = index.refresh()
+        assert not index.is_model_installed("stabilityai/sdxl", "vae/diffusion.safetensors")
+
+        vae_dir = models_dir / "models--stabilityai--sdxl" / "snapshots" / "rev1" / "vae"
+        _touch(vae_dir / "diffusion.safetensors")
+        _bump_mtime(vae_dir)
+
+        assert index.is_model_installed("stabilityai/sdxl", "vae/diffusion.safetensors")
+        assert index.refresh() != version
+        assert scan.calls == 2
+
+    def test_only_changed_civitai_dirs_are_rescanned(self, tmp_path):
+        models_dir, civitai_dir = _setup(tmp_path)
+        scan = CountingScan()
+        index = _index(models_dir, civitai_dir, tmp_path, scan=scan)
+        index.refresh()
+        assert index.civitai_scans == 2
+
+        _touch(civitai_dir / "civitai_2" / "b.safetensors")
+        _bump_mtime(civitai_dir / "civitai_2")
+        index.refresh()
+
+        assert index.civitai_scans == 3
+        assert scan.calls == 1
+        assert len(index.installed_loras()) == 3
+
+    def test_checks_are_rate_limited(self, tmp_path):
+        models_dir, civitai_dir = _setup(tmp_path)
+        now = [0.0]
+        index = _index(models_dir, civitai_dir, tmp_path, clock=lambda: now[0])
+        index.check_seconds = 10
+        index.refresh()
+
+        _touch(civitai_dir / "civitai_2" / "b.safetensors")
+        _bump_mtime(civitai_dir / "civitai_2")
+        assert len(index.installed_loras()) == 2  # pas encore reverifie
+
+        now[0] = 11.0
+        assert len(index.installed_loras()) == 3
+
+    def test_invalidate_rescans_civitai_in_place_writes(self, tmp_path):
+        models_dir, civitai_dir = _setup(tmp_path)
+        index = _index(models_dir, civitai_dir, tmp_path)
+        index.refresh()
+        mtime = os.stat(civitai_dir / "civitai_1").st_mtime_ns
+
+        # Telechargement termine: meme fichier, plus gros, mtime du dossier inchange
+        (civitai_dir / "civitai_1" / "a.safetensors").write_bytes(b"x" * 2 * 1024**2)
+        os.utime(civitai_dir / "civitai_1", ns=(mtime, mtime))
+        assert index.installed_loras()[0]["size_mb"] == 0.0
+
+        index.invalidate()
+        assert index.installed_loras()[0]["size_mb"] == 2.0
+
+
+class TestPersistence:
+
+    def test_index_is_reused_across_processes(self, tmp_path):
+        models_dir, civitai_dir = _setup(tmp_path)
+        first = _index(models_dir, civitai_dir, tmp_path)
+        first.refresh()
+        assert (tmp_path / "index.json").exists()
+
+        scan = CountingScan()
+        second = _index(models_dir, civitai_dir, tmp_path, scan=scan)
+
+        assert second.is_model_installed("Lylia/Pony", "pony.safetensors")
+        assert second.refresh() == first.version
+        assert scan.calls == 0
+        assert second.civitai_scans == 0
+
+    def test_corrupt_index_is_rebuilt(self, tmp_path):
+        models_dir, civitai_dir = _setup(tmp_path)
+        (tmp_path / "index.json").write_text("{not json", encoding="utf-8")
+
+        index = _index(models_dir, civitai_dir, tmp_path)
+
+        assert index.is_model_installed("stabilityai/sdxl")
@@ -0,0 +1,123 @@
+"""
+Tests du cache d'embeddings IP-Adapter des references (app/ip_embeds.py)
+"""
+import os
+import pickle
+
+from app.ip_embeds import ImageEmbeddingCache, embedding_path_for, group_by_strength
+
+
+def _pickle_save(obj, path):
+    path.write_bytes(pickle.dumps(obj))
+
+
+def _pickle_load(path):
+    return pickle.loads(path.read_bytes())
+
+
+def _cache(encoder_id="ip-adapter_sdxl.bin", max_entries=4):
+    return ImageEmbeddingCache(max_entries=max_entries, encoder_id=encoder_id,
+                               save=_pickle_save, load=_pickle_load)
+
+
+def _image(tmp_path, name="face.png"):
+    path = tmp_path / name
+    path.write_bytes(b"png")
+    return str(path)
+
+
+class Encoder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, image_path):
+        self.calls.append(image_path)
+        return (f"embeds:{len(self.calls)}", "negative")
+
+
+class TestPrecompute:
+
+    def test_store_writes_pt_next_to_image(self, tmp_path):
+        image = _image(tmp_path)
+        _cache().store(image, ("embeds", "negative"))
+
+        assert embedding_path_for(image) == tmp_path / "face.pt"
+        assert (tmp_path / "face.pt").exists()
+
+    def test_precomputed_embedding_skips_encoder(self, tmp_path):
+        image = _image(tmp_path)
+        _cache().store(image, ("embeds", "negative"))
+
+        encoder = Encoder()
+        cache = _cache()  # nouveau process : memoire vide
+        assert cache.get(image, encoder) == ("embeds", "negative")
+        assert encoder.calls == []
+        assert cache.stats()["disk_hits"] == 1
+
+    def test_missing_embedding_is_computed_once(self, tmp_path):
+        image = _image(tmp_path)
+        encoder = Encoder()
+        cache = _cache()
+
+        cache.get(image, encoder)
+        cache.get(image, encoder)
+
+        assert len(encoder.calls) == 1
+        assert cache.stats()["memory_hits"] == 1
+        assert (tmp_path / "face.pt").exists()
+
+
+class TestInvalidation:
+
+    def test_reuploaded_image_is_recomputed(self, tmp_path):
+        image = _image(tmp_path)
+        cache = _cache()
+        cache.store(image, ("old", "negative"))
+
+        stat = os.stat(image)
+        os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        encoder = Encoder()
+        assert cache.get(image, encoder) == ("embeds:1", "negative")
+
+    def test_other_encoder_is_recomputed(self, tmp_path):
+        image = _image(tmp_path)
+        _cache(encoder_id="ip-adapter_sdxl.bin").store(image, ("old", "negative"))
+
+        encoder = Encoder()
+        _cache(encoder_id="ip-adapter-plus_sdxl_vit-h.bin").get(image, encoder)
+        assert len(encoder.calls) == 1
+
+    def test_corrupt_file_is_recomputed(self, tmp_path):
+        image = _image(tmp_path)
+        (tmp_path / "face.pt").write_bytes(b"not a pickle")
+
+        encoder = Encoder()
+        assert _cache().get(image, encoder) == ("embeds:1", "negative")
+
+    def test_memory_lru_bound(self, tmp_path):
+        cache = _cache(max_entries=1)
+        first, second = _image(tmp_path, "a.png"), _image(tmp_path, "b.png")
+        cache.store(first, ("a", "n"))
+        cache.store(second, ("b", "n"))
+
+        assert cache.stats()["entries"] == 1
+
+
+class TestGroupByStrength:
+
+    def test_each_strength_gets_its_own_group(self):
+        groups = group_by_strength([("char.png", 0.7), ("bg.png", 0.3)], max_groups=3)
+        assert groups == [(0.3, ["bg.png"]), (0.7, ["char.png"])]
+
+    def test_equal_strengths_share_a_group(self):
+        groups = group_by_strength([("front.png", 0.7), ("side.png", 0.7)], max_groups=3)
+        assert groups == [(0.7, ["front.png", "side.png"])]
+
+    def test_closest_strengths_are_merged_over_limit(self):
+        refs = [("a.png", 0.2), ("b.png", 0.6), ("c.png", 0.7), ("d.png", 0.7)]
+        groups = group_by_strength(refs, max_groups=2)
+
+        assert groups[0] == (0.2, ["a.png"])
+        assert groups[1][0] == 0.667  # moyenne ponderee 0.6 x1 + 0.7 x2
+        assert sorted(groups[1][1]) == ["b.png", "c.png", "d.png"]
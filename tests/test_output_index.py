@@ -0,0 +1,179 @@
+"""
+Tests de l'index de OUTPUTS_DIR et de la disposition shardee (app/output_index.py)
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from app.output_index import OutputIndex, locate_output, shard_path
+
+NAME = "sdxl_base_20260130_123456_abc12345.png"
+SHARDED = "20260130/ab/" + NAME
+
+
+@pytest.fixture
+def index(tmp_path):
+    return OutputIndex(db_path=tmp_path / ".state.db", outputs_dir=tmp_path)
+
+
+class TestOutputIndex:
+
+    def test_existing_files_are_indexed_once(self, tmp_path):
+        (tmp_path / "a.png").write_bytes(b"12345")
+        (tmp_path / ".retrieved.json").write_text("{}")
+        (tmp_path / "sub").mkdir()
+        os.utime(tmp_path / "a.png", (100, 100))
+
+        index = OutputIndex(db_path=tmp_path / ".state.db", outputs_dir=tmp_path)
+        assert index.get("a.png") == ("a.png", 5, 100.0)
+        assert index.totals() == {"files": 1, "bytes": 5}
+
+        # Pas de second scan : un fichier ajoute hors index reste ignore
+        (tmp_path / "b.png").write_bytes(b"1")
+        reopened = OutputIndex(db_path=tmp_path / ".state.db", outputs_dir=tmp_path)
+        assert reopened.get("b.png") is None
+
+    def test_totals_follow_writes(self, index):
+        index.add("a.png", 10, 1.0)
+        index.add("b.png", 20, 2.0)
+        index.add("a.png", 15, 1.0)  # re-ecriture du meme nom
+        assert index.totals() == {"files": 2, "bytes": 35}
+
+        index.remove(["a.png", "missing.png"])
+        assert index.totals() == {"files": 1, "bytes": 20}
+
+    def test_oldest_pages_by_creation_date(self, index):
+        for name, created_at in (("c.png", 3.0), ("a.png", 1.0), ("b1.png", 2.0), ("b2.png", 2.0)):
+            index.add(name, 1, created_at)
+
+        first = index.oldest(limit=2)
+        assert [row[0] for row in first] == ["a.png", "b1.png"]
+        second = index.oldest(after=(first[-1][2], first[-1][0]), limit=2)
+        assert [row[0] for row in second] == ["b2.png", "c.png"]
+        assert [row[0] for row in index.oldest(before=2.0)] == ["a.png"]
+
+    def test_content_hash_is_stored_or_computed_once(self, index, tmp_path):
+        path = tmp_path / SHARDED
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b"png")
+        index.add(NAME, 3, path=SHARDED, sha256="f" * 64)
+        assert index.locate_with_hash(NAME) == (path, "f" * 64)
+
+        # Image indexee avant le hash : calcule a la premiere lecture puis enregistre
+        index.add(NAME, 3, path=SHARDED)
+        _, digest = index.locate_with_hash(NAME)
+        assert digest == hashlib.sha256(b"png").hexdigest()
+        path.write_bytes(b"changed")
+        assert index.content_hash(NAME, path) == digest
+
+        assert index.locate_with_hash("missing.png") == (None, None)
+
+    def test_existing_index_gains_hash_column(self, tmp_path):
+        db = tmp_path / ".state.db"
+        conn = sqlite3.connect(db)
+        conn.execute("CREATE TABLE outputs (filename TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                     "created_at REAL NOT NULL, path TEXT)")
+        conn.commit()
+        conn.close()
+
+        index = OutputIndex(db_path=db, outputs_dir=tmp_path)
+        index.add("a.png", 1, sha256="a" * 64)
+        (tmp_path / "a.png").write_bytes(b"1")
+        assert index.locate_with_hash("a.png")[1] == "a" * 64
+
+
+class TestSharding:
+
+    def test_shard_path(self):
+        assert shard_path(NAME) == SHARDED
+        assert shard_path("pony_xl_v6_20260201_000000_ffee0011.webp") == "20260201/ff/pony_xl_v6_20260201_000000_ffee0011.webp"
+        assert shard_path("custom.png") is None
+
+    def test_locate_prefers_index_then_shard_then_flat(self, index, tmp_path):
+        (tmp_path / NAME).write_bytes(b"flat")
+        assert locate_output(tmp_path, NAME) == tmp_path / NAME
+
+        (tmp_path / "20260130" / "ab").mkdir(parents=True)
+        (tmp_path / SHARDED).write_bytes(b"sharded")
+        assert locate_output(tmp_path, NAME) == tmp_path / SHARDED  # chemin deduit avant l'ancien
+
+        (tmp_path / "elsewhere").mkdir()
+        (tmp_path / "elsewhere" / NAME).write_bytes(b"indexed")
+        index.add(NAME, 7, path="elsewhere/" + NAME)
+        assert index.locate(NAME) == tmp_path / "elsewhere" / NAME
+
+        # Index en retard sur un deplacement : repli sur le chemin deduit
+        (tmp_path / "elsewhere" / NAME).unlink()
+        assert index.locate(NAME) == tmp_path / SHARDED
+
+    def test_locate_rejects_paths_and_state_files(self, index, tmp_path):
+        (tmp_path / ".state.db-wal").write_bytes(b"")
+        assert index.locate(".state.db-wal") is None
+        assert index.locate("../etc/passwd") is None
+        assert locate_output(tmp_path, "missing.png") is None
+
+    def test_scan_indexes_sharded_files(self, tmp_path):
+        (tmp_path / "20260130" / "ab").mkdir(parents=True)
+        (tmp_path / SHARDED).write_bytes(b"123")
+        (tmp_path / ".cache").mkdir()
+        (tmp_path / ".cache" / "thumb.webp").write_bytes(b"1")
+
+        index = OutputIndex(db_path=tmp_path / ".state.db", outputs_dir=tmp_path)
+
+        assert index.totals() == {"files": 1, "bytes": 3}
+        assert index.locate(NAME) == tmp_path / SHARDED
+
+
+class TestReshard:
+
+    def test_flat_files_are_moved_and_indexed(self, index, tmp_path):
+        (tmp_path / NAME).write_bytes(b"flat")
+        (tmp_path / "custom.png").write_bytes(b"x")
+        index.add(NAME, 4, 1.0)  # indexe a plat avant la migration
+
+        assert index.reshard(dry_run=True) == {"moved": 1, "skipped": 1, "errors": 0}
+        assert (tmp_path / NAME).exists()
+
+        assert index.reshard() == {"moved": 1, "skipped": 1, "errors": 0}
+        assert not (tmp_path / NAME).exists()
+        assert (tmp_path / SHARDED).read_bytes() == b"flat"
+        assert index.locate(NAME) == tmp_path / SHARDED
+        assert index.locate("custom.png") == tmp_path / "custom.png"
+        assert index.totals()["files"] == 2  # custom.png indexe au scan initial
+
+        assert index.reshard() == {"moved": 0, "skipped": 1, "errors": 0}
+
+    def test_existing_target_is_not_overwritten(self, index, tmp_path):
+        (tmp_path / "20260130" / "ab").mkdir(parents=True)
+        (tmp_path / SHARDED).write_bytes(b"new")
+        (tmp_path / NAME).write_bytes(b"old")
+
+        assert index.reshard()["skipped"] == 1
+        assert (tmp_path / SHARDED).read_bytes() == b"new"
+
+    def test_readers_always_find_the_file_during_reshard(self, index, tmp_path):
+        names = [f"sdxl_base_20260130_1234{i:02d}_{i:02x}abcdef.png" for i in range(40)]
+        for name in names:
+            (tmp_path / name).write_bytes(b"png")
+        missing = []
+        done = threading.Event()
+
+        def reader():
+            while not done.is_set():
+                for name in names:
+                    if index.locate(name) is None:
+                        missing.append(name)
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        try:
+            assert index.reshard()["moved"] == 40
+        finally:
+            done.set()
+            thread.join()
+
+        assert missing == []
+        assert sorted(os.listdir(tmp_path / "20260130")) == sorted({f"{i:02x}" for i in range(40)})
@@ -0,0 +1,60 @@
+"""
+Tests du pool d'ecriture des images hors du slot GPU (app/postprocess.py)
+"""
+import threading
+
+import pytest
+
+from app.postprocess import OutputWriter
+
+
+class TestOutputWriter:
+
+    def test_synchronous_when_disabled(self):
+        writer = OutputWriter(threads=0)
+        calls = []
+        future = writer.submit(calls.append, "a")
+        assert future.done() and calls == ["a"]
+        assert writer.stats()["completed"] == 1
+
+    def test_submit_returns_before_the_write(self):
+        writer = OutputWriter(threads=1, max_pending=4)
+        release = threading.Event()
+        future = writer.submit(release.wait, 5)
+        assert not future.done()
+        assert writer.stats()["pending"] == 1
+
+        release.set()
+        assert writer.drain(timeout=5)
+        assert future.result() is True
+        assert writer.stats()["pending"] == 0
+
+    def test_backpressure_blocks_the_producer(self):
+        writer = OutputWriter(threads=1, max_pending=1)
+        release = threading.Event()
+        writer.submit(release.wait, 5)
+
+        submitted = threading.Event()
+        producer = threading.Thread(target=lambda: (writer.submit(lambda: None), submitted.set()))
+        producer.start()
+        assert not submitted.wait(0.2)  # file pleine : le GPU attendrait
+
+        release.set()
+        assert submitted.wait(5)
+        producer.join()
+        assert writer.drain(timeout=5)
+        assert writer.stats()["completed"] == 2
+
+    def test_failures_are_kept_in_the_future(self):
+        writer = OutputWriter(threads=1, max_pending=1)
+
+        def fail():
+            raise OSError("disk full")
+
+        future = writer.submit(fail)
+        with pytest.raises(OSError):
+            future.result(timeout=5)
+        # Le slot est rendu malgre l'echec
+        writer.submit(lambda: None).result(timeout=5)
+        assert writer.stats()["failed"] == 1
+        assert writer.stats()["completed"] == 1
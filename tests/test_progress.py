@@ -0,0 +1,116 @@
+"""
+Tests de la progression par etape et des metriques de debit (app/progress.py)
+"""
+from app.progress import THROUGHPUT_KEY, StepProgress, ThroughputStats, throughput_key
+from fakes import FakeClock, FakeRedis
+
+
+def _tracker(min_interval=1.0):
+    clock = FakeClock(now=100.0)
+    reports = []
+    return StepProgress(reports.append, min_interval=min_interval, clock=clock), clock, reports
+
+
+def _run_steps(tracker, clock, steps, seconds_per_step, batch_size=1):
+    tracker.begin(batch_size)
+    for index in range(steps):
+        clock.now += seconds_per_step
+        assert tracker(None, index, 999 - index, {"latents": "x"}) == {"latents": "x"}
+    tracker.end()
+
+
+class TestStepProgress:
+
+    def test_reports_are_rate_limited(self):
+        tracker, clock, reports = _tracker(min_interval=1.0)
+        tracker.expect(30)
+
+        _run_steps(tracker, clock, 30, 0.2)
+
+        # 6s de debruitage : 1er step, puis ~1 par seconde, plus le dernier
+        assert 6 <= len(reports) <= 8
+        assert reports[0]["current_step"] == 1
+        assert reports[-1]["current_step"] == 30
+
+    def test_meta_has_step_total_rate_and_eta(self):
+        tracker, clock, reports = _tracker(min_interval=0.0)
+        tracker.expect(20)
+        tracker.begin(1)
+        for index in range(5):
+            clock.now += 0.5
+            tracker(None, index, 0, {})
+
+        meta = reports[-1]
+        assert meta["step"] == "generation_gpu"
+        assert meta["current_step"] == 5
+        assert meta["total_steps"] == 20
+        assert meta["sec_per_step"] == 0.5
+        assert meta["eta_seconds"] == 7.5
+        assert meta["progress"] == 30  # 10 + 80 * 5/20
+
+    def test_last_report_is_complete(self):
+        tracker, clock, reports = _tracker(min_interval=60.0)
+        tracker.expect(10)
+
+        _run_steps(tracker, clock, 10, 0.1)
+
+        assert reports[-1]["progress"] == 90
+        assert reports[-1]["eta_seconds"] == 0.0
+
+    def test_progress_accumulates_over_calls(self):
+        tracker, clock, reports = _tracker(min_interval=0.0)
+        tracker.expect(2 * 10)
+
+        _run_steps(tracker, clock, 10, 0.4, batch_size=2)
+        assert reports[-1]["progress"] == 50
+        _run_steps(tracker, clock, 10, 0.2, batch_size=1)
+
+        assert reports[-1]["current_step"] == 20
+        assert [(s["batch_size"], s["steps"]) for s in tracker.segments] == [(2, 10), (1, 10)]
+        assert round(tracker.segments[0]["seconds"], 6) == 4.0
+        assert round(tracker.sec_per_step, 6) == 0.3
+
+    def test_interrupted_call_is_not_a_segment(self):
+        tracker, clock, _ = _tracker()
+        tracker.expect(10)
+        tracker.begin(2)
+        clock.now += 1.0
+        tracker(None, 0, 0, {})
+        # OOM : pas de end(), le repli est annonce puis relance
+        tracker.expect(20)
+        _run_steps(tracker, clock, 10, 0.1)
+
+        assert [(s["batch_size"], s["steps"]) for s in tracker.segments] == [(1, 10)]
+
+    def test_report_errors_do_not_break_generation(self):
+        def report(meta):
+            raise ConnectionError("redis down")
+
+        tracker = StepProgress(report, min_interval=0.0, clock=FakeClock())
+        tracker.expect(1)
+        assert tracker(None, 0, 0, {"latents": 1}) == {"latents": 1}
+
+
+class TestThroughputStats:
+
+    def test_record_and_stats(self):
+        redis = FakeRedis()
+        stats = ThroughputStats(redis_client=redis)
+        stats.record("pony", 1024, 1024, 2, 1, 30, 15.0)
+        stats.record("pony", 1024, 1024, 2, 1, 30, 12.0)
+        stats.record("sdxl", 1024, 1024, 0, 2, 30, 30.0)
+
+        result = stats.stats()
+
+        pony = result[throughput_key("pony", 1024, 1024, 2, 1)]
+        assert pony["runs"] == 2
+        assert pony["steps"] == 60
+        assert pony["it_per_s"] == round(60 / 27.0, 3)
+        assert pony["loras"] == 2 and pony["batch_size"] == 1
+        assert pony["resolution"] == "1024x1024"
+        assert result[throughput_key("sdxl", 1024, 1024, 0, 2)]["it_per_s"] == 1.0
+
+    def test_empty_runs_are_ignored(self):
+        redis = FakeRedis()
+        ThroughputStats(redis_client=redis).record("pony", 1024, 1024, 0, 1, 0, 0.0)
+        assert THROUGHPUT_KEY not in redis.hashes
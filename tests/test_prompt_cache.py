@@ -0,0 +1,65 @@
+"""
+Tests du cache d'embeddings de prompt (app/prompt_cache.py)
+"""
+import pickle
+
+from app.prompt_cache import PromptEmbeddingCache
+
+
+def _pickle_save(obj, path):
+    path.write_bytes(pickle.dumps(obj))
+
+
+def _pickle_load(path):
+    return pickle.loads(path.read_bytes())
+
+
+class TestMemoryTier:
+
+    def test_hit_after_put(self):
+        cache = PromptEmbeddingCache(max_entries=4)
+        assert cache.get("sdxl", "fp", "a cat") is None
+        cache.put("sdxl", "fp", "a cat", ("cond", "pooled"))
+        assert cache.get("sdxl", "fp", "a cat") == ("cond", "pooled")
+
+        stats = cache.stats()
+        assert (stats["memory_hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+    def test_encoder_change_invalidates(self):
+        cache = PromptEmbeddingCache(max_entries=4)
+        cache.put("pony", "base", "a cat", ("cond", "pooled"))
+        assert cache.get("pony", "with-te-lora", "a cat") is None
+        assert cache.get("sdxl", "base", "a cat") is None
+
+    def test_lru_bound(self):
+        cache = PromptEmbeddingCache(max_entries=2)
+        cache.put("m", "fp", "a", 1)
+        cache.put("m", "fp", "b", 2)
+        cache.get("m", "fp", "a")
+        cache.put("m", "fp", "c", 3)
+
+        assert cache.get("m", "fp", "b") is None
+        assert cache.get("m", "fp", "a") == 1
+
+
+class TestDiskTier:
+
+    def test_survives_process_restart(self, tmp_path):
+        kwargs = dict(max_entries=4, disk_dir=tmp_path, max_disk_entries=10,
+                      save=_pickle_save, load=_pickle_load)
+        PromptEmbeddingCache(**kwargs).put("sdxl", "fp", "negative", ("c", "p"))
+
+        fresh = PromptEmbeddingCache(**kwargs)
+        assert fresh.get("sdxl", "fp", "negative") == ("c", "p")
+        assert fresh.stats()["disk_hits"] == 1
+        # Promu en memoire
+        fresh.get("sdxl", "fp", "negative")
+        assert fresh.stats()["memory_hits"] == 1
+
+    def test_disk_bound(self, tmp_path):
+        cache = PromptEmbeddingCache(max_entries=1, disk_dir=tmp_path, max_disk_entries=2,
+                                     save=_pickle_save, load=_pickle_load)
+        for prompt in ("a", "b", "c"):
+            cache.put("m", "fp", prompt, prompt)
+
+        assert len(list(tmp_path.glob("*.pt"))) == 2
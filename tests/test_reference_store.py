@@ -0,0 +1,269 @@
+"""
+Tests du stockage SQLite des references (app/reference_store.py) et du
+ReferenceManager qui l'utilise
+"""
+import io
+import json
+import threading
+
+import pytest
+from PIL import Image
+
+from app import references
+from app.reference_store import ReferenceStore
+from app.references import ReferenceManager, ReferenceRequest
+
+
+def _png(color=(255, 0, 0), size=(64, 48)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ReferenceStore(tmp_path / "references.db", legacy_json=tmp_path / "metadata.json")
+    monkeypatch.setattr(references, "REFERENCE_DIR", tmp_path)
+    monkeypatch.setattr(references, "_store", store)
+    return store
+
+
+LEGACY = {
+    "version": 1,
+    "entities": {
+        "electra": {
+            "category": "character",
+            "description": "Heroine",
+            "created_at": "2025-01-01T00:00:00+00:00",
+            "references": {
+                "side": {
+                    "filename": "side.png", "original_name": "s.png", "width": 1024,
+                    "height": 1024, "uploaded_at": "2025-01-02T00:00:00+00:00",
+                    "embedding_cached": True,
+                },
+                "front": {
+                    "filename": "front.png", "original_name": "f.png", "width": 1024,
+                    "height": 1024, "uploaded_at": "2025-01-02T00:00:00+00:00",
+                },
+            },
+        },
+        "cuisine": {
+            "category": "background",
+            "created_at": "2025-01-03T00:00:00+00:00",
+            "references": {},
+        },
+    },
+}
+
+
+class TestMigration:
+
+    def test_json_is_imported_once_and_renamed(self, tmp_path):
+        legacy = tmp_path / "metadata.json"
+        legacy.write_text(json.dumps(LEGACY), encoding="utf-8")
+
+        store = ReferenceStore(tmp_path / "references.db", legacy_json=legacy)
+        electra = store.get_entity("electra")
+
+        assert electra["category"] == "character"
+        assert list(electra["references"]) == ["side", "front"]  # ordre conserve
+        assert electra["references"]["side"]["embedding_cached"] is True
+        assert electra["references"]["front"]["embedding_cached"] is False
+        assert store.counts() == {"entities": 2, "images": 2}
+        assert not legacy.exists()
+        assert (tmp_path / "metadata.json.migrated").exists()
+
+        # Un JSON reapparu n'est pas re-importe
+        legacy.write_text(json.dumps({"entities": {"autre": LEGACY["entities"]["cuisine"]}}), encoding="utf-8")
+        reopened = ReferenceStore(tmp_path / "references.db", legacy_json=legacy)
+        assert reopened.get_entity("autre") is None
+
+    def test_corrupt_json_is_skipped(self, tmp_path):
+        legacy = tmp_path / "metadata.json"
+        legacy.write_text("{broken", encoding="utf-8")
+
+        store = ReferenceStore(tmp_path / "references.db", legacy_json=legacy)
+
+        assert store.counts() == {"entities": 0, "images": 0}
+        assert legacy.exists()
+
+
+class TestReferenceManager:
+
+    def test_crud_roundtrip(self, store, tmp_path):
+        ReferenceManager.create_entity("electra", "character", "Heroine")
+        with pytest.raises(ValueError, match="existe deja"):
+            ReferenceManager.create_entity("electra", "character")
+
+        image = ReferenceManager.upload_image("electra", "front", _png(), "photo.png")
+        assert (image.width, image.height) == (1024, 1024)
+        assert (tmp_path / "characters" / "electra" / "front.png").exists()
+
+        entity = ReferenceManager.get_entity("electra")
+        assert entity.description == "Heroine"
+        assert entity.references["front"].original_name == "photo.png"
+        assert not entity.references["front"].embedding_cached
+
+        ReferenceManager.mark_embedding_cached("electra", "front")
+        assert ReferenceManager.get_entity("electra").references["front"].embedding_cached
+
+        # Re-upload: l'embedding doit etre recalcule
+        ReferenceManager.upload_image("electra", "front", _png((0, 0, 255)), "v2.png")
+        assert not ReferenceManager.get_entity("electra").references["front"].embedding_cached
+
+        ReferenceManager.delete_image("electra", "front")
+        assert ReferenceManager.get_entity("electra").references == {}
+        assert not (tmp_path / "characters" / "electra" / "front.png").exists()
+
+        assert ReferenceManager.delete_entity("electra") == 0
+        assert ReferenceManager.get_entity("electra") is None
+        assert store.counts() == {"entities": 0, "images": 0}
+
+    def test_upload_validation(self, store):
+        ReferenceManager.create_entity("cuisine", "background")
+        with pytest.raises(ValueError, match="non trouvee"):
+            ReferenceManager.upload_image("missing", "main", _png(), "a.png")
+        with pytest.raises(ValueError, match="invalide"):
+            ReferenceManager.upload_image("cuisine", "front", _png(), "a.png")
+        with pytest.raises(ValueError, match="non supporte"):
+            ReferenceManager.upload_image("cuisine", "main", _png(), "a.gif")
+
+    def test_list_by_category(self, store):
+        ReferenceManager.create_entity("electra", "character")
+        ReferenceManager.create_entity("cuisine", "background")
+        ReferenceManager.upload_image("electra", "front", _png(), "a.png")
+
+        assert list(ReferenceManager.list_entities()) == ["electra", "cuisine"]
+        characters = ReferenceManager.list_entities(category="character")
+        assert list(characters) == ["electra"]
+        assert list(characters["electra"].references) == ["front"]
+        assert ReferenceManager.list_entities(category="pose") == {}
+
+    def test_delete_entity_cascades_images(self, store):
+        ReferenceManager.create_entity("electra", "character")
+        ReferenceManager.upload_image("electra", "front", _png(), "a.png")
+        ReferenceManager.upload_image("electra", "side", _png(), "b.png")
+
+        assert ReferenceManager.delete_entity("electra") == 2
+        assert store.counts() == {"entities": 0, "images": 0}
+
+    def test_resolve_references(self, store, tmp_path):
+        ReferenceManager.create_entity("electra", "character")
+        ReferenceManager.upload_image("electra", "front", _png(), "a.png")
+
+        resolved = ReferenceManager.resolve_references(
+            [ReferenceRequest(entity="electra", types=["front"], strength=0.5)]
+        )
+        assert resolved == [{
+            "path": str(tmp_path / "characters" / "electra" / "front.png"),
+            "strength": 0.5,
+            "embedding_path": None,
+            "category": "character",
+        }]
+        with pytest.raises(ValueError, match="non trouve"):
+            ReferenceManager.resolve_references([ReferenceRequest(entity="electra", types=["side"])])
+        with pytest.raises(ValueError, match="non trouvee"):
+            ReferenceManager.resolve_references([ReferenceRequest(entity="nobody")])
+
+    def test_save_and_load_metadata_snapshot(self, store):
+        ReferenceManager.create_entity("electra", "character")
+        metadata = ReferenceManager.load_metadata()
+        metadata.entities["electra"].description = "edited"
+
+        ReferenceManager.save_metadata(metadata)
+
+        assert ReferenceManager.get_entity("electra").description == "edited"
+
+    def test_concurrent_uploads_are_not_lost(self, store):
+        """Avec metadata.json, deux read-modify-write concurrents perdaient une entree"""
+        ReferenceManager.create_entity("electra", "character")
+        subtypes = ["front", "side", "back", "full_body", "detail"]
+        errors = []
+
+        def upload(subtype):
+            try:
+                ReferenceManager.upload_image("electra", subtype, _png(), f"{subtype}.png")
+                ReferenceManager.mark_embedding_cached("electra", subtype)
+            except Exception as exc:  # pragma: no cover - remonte dans l'assert
+                errors.append(exc)
+
+        threads = [threading.Thread(target=upload, args=(s,)) for s in subtypes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        entity = ReferenceManager.get_entity("electra")
+        assert sorted(entity.references) == sorted(subtypes)
+        assert all(image.embedding_cached for image in entity.references.values())
+
+
+class TestResolutionCache:
+
+    def _resolve(self, entity="electra", types=("front",)):
+        return ReferenceManager.resolve_references([ReferenceRequest(entity=entity, types=list(types))])
+
+    def test_repeat_resolution_is_a_hit(self, store, monkeypatch):
+        ReferenceManager.create_entity("electra", "character")
+        ReferenceManager.upload_image("electra", "front", _png(), "a.png")
+        cache = references.ResolutionCache()
+        monkeypatch.setattr(references, "_resolution_cache", cache)
+
+        calls = []
+        original = store.get_entity
+        monkeypatch.setattr(store, "get_entity", lambda name: calls.append(name) or original(name))
+
+        first = self._resolve()
+        for _ in range(5):
+            assert self._resolve() == first
+
+        assert calls == ["electra"]
+        assert cache.stats()["hits"] == 5
+        assert cache.stats()["misses"] == 1
+
+    def test_writes_invalidate(self, store, monkeypatch, tmp_path):
+        ReferenceManager.create_entity("electra", "character")
+        ReferenceManager.upload_image("electra", "front", _png(), "a.png")
+        cache = references.ResolutionCache()
+        monkeypatch.setattr(references, "_resolution_cache", cache)
+        assert self._resolve()[0]["embedding_path"] is None
+
+        # Le worker ecrit l'embedding puis marque l'image
+        (tmp_path / "characters" / "electra" / "front.pt").write_bytes(b"embeds")
+        ReferenceManager.mark_embedding_cached("electra", "front")
+
+        assert self._resolve()[0]["embedding_path"].endswith("front.pt")
+        assert cache.stats()["invalidations"] == 1
+
+        ReferenceManager.delete_image("electra", "front")
+        with pytest.raises(ValueError, match="non trouve"):
+            self._resolve()
+
+    def test_write_from_another_connection_invalidates(self, store, tmp_path, monkeypatch):
+        """Un autre processus (worker) ecrit via sa propre connexion"""
+        ReferenceManager.create_entity("electra", "character")
+        monkeypatch.setattr(references, "_resolution_cache", references.ResolutionCache())
+        with pytest.raises(ValueError, match="non trouve"):
+            self._resolve()
+
+        other = ReferenceStore(tmp_path / "references.db")
+        with other.transaction() as conn:
+            other.upsert_image(conn, "electra", {
+                "subtype": "front", "filename": "front.png", "original_name": "a.png",
+                "width": 1024, "height": 1024, "uploaded_at": "now", "embedding_cached": False,
+            })
+        (tmp_path / "characters" / "electra" / "front.png").write_bytes(_png())
+
+        assert self._resolve()[0]["path"].endswith("front.png")
+
+    def test_missing_entity_is_cached_too(self, store, monkeypatch):
+        cache = references.ResolutionCache()
+        monkeypatch.setattr(references, "_resolution_cache", cache)
+        for _ in range(3):
+            assert ReferenceManager.get_image_path("ghost", "front") is None
+        assert cache.stats()["misses"] == 1
+
+        ReferenceManager.create_entity("ghost", "character")
+        assert ReferenceManager.get_image_path("ghost", "front") is None
+        assert cache.stats()["misses"] == 2
@@ -0,0 +1,129 @@
+"""
+Tests du cache de residence des pipelines (app/residency.py)
+"""
+from app.residency import (
+    PipelineResidencyCache,
+    ResidentPipeline,
+    module_size_bytes,
+    pipeline_module_sizes,
+    pipeline_size_bytes,
+)
+
+
+class DummyTensor:
+    def __init__(self, numel, element_size=2):
+        self._numel = numel
+        self._element_size = element_size
+
+    def numel(self):
+        return self._numel
+
+    def element_size(self):
+        return self._element_size
+
+
+class DummyModule:
+    def __init__(self, *numels):
+        self._params = [DummyTensor(n) for n in numels]
+
+    def parameters(self):
+        return iter(self._params)
+
+    def buffers(self):
+        return iter([])
+
+
+class DummyPipeline:
+    def __init__(self, unet=100, vae=50):
+        self.components = {
+            "unet": DummyModule(unet),
+            "vae": DummyModule(vae),
+            "tokenizer": object(),
+            "scheduler": None,
+        }
+
+
+def _entry(model_id, size):
+    return ResidentPipeline(model_id, DummyPipeline(), compel=object(), size_bytes=size)
+
+
+class TestSizeAccounting:
+
+    def test_module_size(self):
+        assert module_size_bytes(DummyModule(10, 5)) == 30
+
+    def test_pipeline_size_ignores_non_modules(self):
+        assert pipeline_size_bytes(DummyPipeline(unet=100, vae=50)) == 300
+
+    def test_shared_components_are_counted_once(self):
+        first, second = DummyPipeline(unet=100, vae=50), DummyPipeline(unet=100)
+        second.components["vae"] = first.components["vae"]
+        cache = PipelineResidencyCache(max_entries=5, max_bytes=500)
+        for model_id, pipe in (("sdxl", first), ("pony", second)):
+            sizes = pipeline_module_sizes(pipe)
+            cache.put(ResidentPipeline(model_id, pipe, compel=object(),
+                                       size_bytes=sum(sizes.values()), module_sizes=sizes))
+
+        assert cache.total_bytes == 500  # 2 UNet + 1 VAE partage
+        assert len(cache) == 2
+
+
+class TestResidencyCache:
+
+    def test_hit_miss_counters(self):
+        cache = PipelineResidencyCache(max_entries=2, max_bytes=10_000)
+        assert cache.get("sdxl") is None
+        cache.put(_entry("sdxl", 100))
+        assert cache.get("sdxl").model_id == "sdxl"
+
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 1, 0)
+
+    def test_lru_eviction_by_count(self):
+        evicted = []
+        cache = PipelineResidencyCache(max_entries=2, max_bytes=10_000, on_evict=evicted.append)
+        cache.put(_entry("sdxl", 100))
+        cache.put(_entry("pony", 100))
+        cache.get("sdxl")  # pony devient le moins recent
+        cache.put(_entry("other", 100))
+
+        assert [e.model_id for e in evicted] == ["pony"]
+        assert "sdxl" in cache and "other" in cache
+        assert cache.stats()["evictions"] == 1
+
+    def test_eviction_by_bytes(self):
+        cache = PipelineResidencyCache(max_entries=5, max_bytes=250)
+        cache.put(_entry("a", 100))
+        cache.put(_entry("b", 100))
+        cache.put(_entry("c", 100))
+
+        assert "a" not in cache
+        assert cache.total_bytes == 200
+
+    def test_most_recent_entry_is_never_evicted(self):
+        cache = PipelineResidencyCache(max_entries=2, max_bytes=50)
+        cache.put(_entry("a", 10))
+        cache.put(_entry("huge", 1000))
+
+        assert len(cache) == 1
+        assert "huge" in cache
+
+    def test_reserve_frees_a_slot_before_build(self):
+        evicted = []
+        cache = PipelineResidencyCache(max_entries=2, max_bytes=10_000, on_evict=evicted.append)
+        cache.put(_entry("a", 10))
+        cache.put(_entry("b", 10))
+        cache.reserve()
+
+        assert [e.model_id for e in evicted] == ["a"]
+        assert len(cache) == 1
+
+    def test_peek_does_not_touch_lru(self):
+        cache = PipelineResidencyCache(max_entries=2, max_bytes=10_000)
+        cache.put(_entry("a", 10))
+        cache.put(_entry("b", 10))
+        cache.peek("a")
+        cache.put(_entry("c", 10))
+
+        assert "a" not in cache
+        assert cache.stats()["hits"] == 0
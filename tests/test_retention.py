@@ -0,0 +1,123 @@
+"""
+Tests de la retention de OUTPUTS_DIR (app/retention.py)
+"""
+import pytest
+
+from app.output_index import OutputIndex
+from app.retention import RETENTION_KEY, RetentionService
+from app.retrieval import RetrievalTracker
+from fakes import FakeClock, FakeRedis
+
+HOUR = 3600
+DAY = 86400
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(now=10 * DAY)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return OutputIndex(db_path=tmp_path / ".state.db", outputs_dir=tmp_path)
+
+
+@pytest.fixture
+def tracker(tmp_path, clock):
+    tracker = RetrievalTracker(
+        db_path=tmp_path / ".state.db", legacy_json=None, outputs_dir=tmp_path,
+        flush_seconds=3600, clock=clock,
+    )
+    yield tracker
+    tracker.close()
+
+
+def _service(index, tracker, tmp_path, clock, **policy):
+    options = {"retrieved_hours": 1, "unretrieved_days": 1, "max_bytes": 0}
+    options.update(policy)
+    return RetentionService(
+        index=index, tracker=tracker, batch_size=2,
+        clock=clock, redis_client=FakeRedis(), **options,
+    )
+
+
+def _write(index, tmp_path, name, size, created_at):
+    (tmp_path / name).write_bytes(b"x" * size)
+    index.add(name, size, created_at)
+
+
+class TestRetention:
+
+    def test_retrieved_images_expire_after_n_hours(self, index, tracker, tmp_path, clock):
+        for name in ("old.png", "recent.png", "other.png"):
+            _write(index, tmp_path, name, 10, clock.now)
+        clock.now += 0.25 * HOUR
+        tracker.mark("old.png")
+        clock.now += 1 * HOUR
+        tracker.mark("recent.png")
+        clock.now += 0.5 * HOUR
+
+        deleted = _service(index, tracker, tmp_path, clock).run_once()
+
+        assert deleted["retrieved"] == {"files": 1, "bytes": 10}
+        assert not (tmp_path / "old.png").exists()
+        assert (tmp_path / "recent.png").exists()
+        assert (tmp_path / "other.png").exists()  # jamais recuperee, trop recente
+        assert index.get("old.png") is None
+        assert tracker.retrieved_at("old.png") is None
+
+    def test_unretrieved_images_expire_after_m_days(self, index, tracker, tmp_path, clock):
+        _write(index, tmp_path, "stale1.png", 10, clock.now - 3 * DAY)
+        _write(index, tmp_path, "stale2.png", 10, clock.now - 2 * DAY)
+        _write(index, tmp_path, "stale3.png", 10, clock.now - 2 * DAY)
+        _write(index, tmp_path, "kept.png", 10, clock.now - 2 * DAY)
+        _write(index, tmp_path, "fresh.png", 10, clock.now - HOUR)
+        tracker.mark("kept.png")  # recuperee a l'instant : regle "retrieved"
+
+        deleted = _service(index, tracker, tmp_path, clock).run_once()
+
+        assert deleted["unretrieved"] == {"files": 3, "bytes": 30}
+        assert sorted(p.name for p in tmp_path.glob("*.png")) == ["fresh.png", "kept.png"]
+        assert index.totals() == {"files": 2, "bytes": 20}
+
+    def test_max_bytes_evicts_oldest_first(self, index, tracker, tmp_path, clock):
+        for offset, name in enumerate(("a.png", "b.png", "c.png", "d.png", "e.png")):
+            _write(index, tmp_path, name, 100, clock.now - 60 + offset)
+
+        deleted = _service(index, tracker, tmp_path, clock, max_bytes=250).run_once()
+
+        assert deleted["max_bytes"] == {"files": 3, "bytes": 300}
+        assert sorted(p.name for p in tmp_path.glob("*.png")) == ["d.png", "e.png"]
+
+    def test_disabled_rules_keep_everything(self, index, tracker, tmp_path, clock):
+        _write(index, tmp_path, "a.png", 10, 0.0)
+        tracker.mark("a.png")
+        clock.now += 365 * DAY
+
+        service = _service(index, tracker, tmp_path, clock, retrieved_hours=0, unretrieved_days=0)
+        service.run_once()
+
+        assert (tmp_path / "a.png").exists()
+
+    def test_files_already_gone_are_dropped_without_counting(self, index, tracker, tmp_path, clock):
+        index.add("vanished.png", 10, 0.0)
+
+        deleted = _service(index, tracker, tmp_path, clock).run_once()
+
+        assert deleted["unretrieved"] == {"files": 0, "bytes": 0}
+        assert index.totals() == {"files": 0, "bytes": 0}
+
+    def test_metrics_accumulate(self, index, tracker, tmp_path, clock):
+        service = _service(index, tracker, tmp_path, clock)
+        _write(index, tmp_path, "a.png", 10, 0.0)
+        service.run_once()
+        _write(index, tmp_path, "b.png", 5, 0.0)
+        service.run_once()
+
+        stats = service.stats()
+        assert stats["runs"] == 2
+        assert stats["files_deleted"] == {"retrieved": 0, "unretrieved": 2, "max_bytes": 0}
+        assert stats["bytes_reclaimed"]["unretrieved"] == 15
+        assert stats["outputs"] == {"files": 0, "bytes": 0}
+        assert stats["last_run"]["deleted"]["unretrieved"]["files"] == 1
+        assert RETENTION_KEY in service.redis.hashes
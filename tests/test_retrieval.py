@@ -0,0 +1,159 @@
+"""
+Tests du suivi des images recuperees (app/retrieval.py)
+"""
+import json
+import threading
+
+import pytest
+
+from app.retrieval import RetrievalTracker
+from fakes import FakeClock
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def tracker(tmp_path, clock):
+    tracker = RetrievalTracker(
+        db_path=tmp_path / ".state.db",
+        legacy_json=tmp_path / ".retrieved.json",
+        outputs_dir=tmp_path,
+        flush_seconds=3600,  # flush explicite dans les tests
+        max_pending=1000,
+        clock=clock,
+    )
+    yield tracker
+    tracker.close()
+
+
+class TestBatching:
+
+    def test_mark_is_buffered_until_flush(self, tracker, tmp_path):
+        tracker.mark("a.png")
+        tracker.mark("a.png")
+        tracker.mark("b.png")
+
+        assert tracker.stats()["pending"] == 2
+        assert tracker.retrieved_at("a.png") == 1000.0  # visible avant l'ecriture
+
+        other = RetrievalTracker(db_path=tmp_path / ".state.db", legacy_json=None, outputs_dir=tmp_path)
+        assert other.retrieved_at("a.png") is None
+
+        assert tracker.flush() == 2
+        assert tracker.flush() == 0
+        assert other.retrieved_at("a.png") == 1000.0
+        assert other._db.conn.execute(
+            "SELECT count FROM retrievals WHERE filename = 'a.png'"
+        ).fetchone()[0] == 2
+        assert tracker.stats()["flushes"] == 1
+
+    def test_flush_keeps_latest_retrieval(self, tracker, clock):
+        tracker.mark("a.png")
+        tracker.flush()
+        clock.now = 500.0  # horloge d'un autre processus en retard
+        tracker.mark("a.png")
+        tracker.flush()
+
+        assert tracker.retrieved_at("a.png") == 1000.0
+
+    def test_full_batch_wakes_the_flusher(self, tmp_path):
+        tracker = RetrievalTracker(
+            db_path=tmp_path / ".state.db", legacy_json=None, outputs_dir=tmp_path,
+            flush_seconds=3600, max_pending=3,
+        )
+        try:
+            for index in range(3):
+                tracker.mark(f"{index}.png")
+            for _ in range(200):
+                if tracker.stats()["tracked"] == 3:
+                    break
+                threading.Event().wait(0.01)
+            assert tracker.stats()["tracked"] == 3
+        finally:
+            tracker.close()
+
+    def test_close_flushes_pending(self, tmp_path, clock):
+        tracker = RetrievalTracker(db_path=tmp_path / ".state.db", legacy_json=None, outputs_dir=tmp_path, clock=clock)
+        tracker.mark("a.png")
+        tracker.close()
+
+        reopened = RetrievalTracker(db_path=tmp_path / ".state.db", legacy_json=None, outputs_dir=tmp_path)
+        assert reopened.retrieved_at("a.png") == 1000.0
+
+    def test_concurrent_marks_are_not_lost(self, tracker):
+        def worker(offset):
+            for index in range(50):
+                tracker.mark(f"{offset}_{index}.png")
+                if index % 10 == 0:
+                    tracker.flush()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        tracker.flush()
+
+        assert tracker.stats()["tracked"] == 400
+
+
+class TestQueries:
+
+    def test_retrieved_before_uses_cutoff_and_order(self, tracker, clock):
+        for name, when in (("old.png", 100.0), ("mid.png", 200.0), ("new.png", 300.0)):
+            clock.now = when
+            tracker.mark(name)
+
+        # Non ecrit : retrieved_before ecrit d'abord les marques en attente
+        assert tracker.retrieved_before(250.0) == [("old.png", 100.0), ("mid.png", 200.0)]
+        assert tracker.retrieved_before(250.0, limit=1) == [("old.png", 100.0)]
+        assert tracker.retrieved_before(50.0) == []
+
+    def test_query_uses_index(self, tracker):
+        plan = tracker._db.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT filename, retrieved_at FROM retrievals "
+            "WHERE retrieved_at < ? ORDER BY retrieved_at", (1.0,)
+        ).fetchall()
+        assert "idx_retrievals_retrieved_at" in " ".join(str(row) for row in plan)
+
+
+class TestMigrationAndCompaction:
+
+    def test_legacy_json_is_imported_and_renamed(self, tmp_path, clock):
+        legacy = tmp_path / ".retrieved.json"
+        legacy.write_text(json.dumps({
+            "a.png": "1970-01-01T00:01:40+00:00",
+            "broken.png": "not a date",
+        }), encoding="utf-8")
+
+        tracker = RetrievalTracker(db_path=tmp_path / ".state.db", legacy_json=legacy, outputs_dir=tmp_path, clock=clock)
+
+        assert tracker.retrieved_at("a.png") == 100.0
+        assert tracker.retrieved_at("broken.png") is None
+        assert not legacy.exists()
+        assert (tmp_path / ".retrieved.json.migrated").exists()
+
+    def test_compact_removes_missing_files(self, tracker, tmp_path):
+        (tmp_path / "kept.png").write_bytes(b"png")
+        for name in ("kept.png", "gone1.png", "gone2.png"):
+            tracker.mark(name)
+        tracker.flush()
+
+        assert tracker.compact(batch_size=1) == 2
+        assert [name for name, _ in tracker.retrieved_before(float("inf"))] == ["kept.png"]
+        assert tracker.stats()["compacted_rows"] == 2
+
+    def test_forget(self, tracker):
+        tracker.mark("a.png")
+        tracker.mark("b.png")
+        tracker.flush()
+        tracker.mark("a.png")
+
+        tracker.forget(["a.png"])
+        tracker.flush()
+
+        assert tracker.retrieved_at("a.png") is None
+        assert tracker.retrieved_at("b.png") == 1000.0
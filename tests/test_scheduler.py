@@ -0,0 +1,105 @@
+"""
+Tests du scheduler par affinite de modele (app/scheduler.py)
+"""
+from app.scheduler import AffinityScheduler, affinity_key
+from fakes import FakeClock, FakeRedis
+
+
+def _scheduler(**kwargs):
+    clock = FakeClock()
+    sched = AffinityScheduler(redis_client=FakeRedis(), clock=clock, **kwargs)
+    return sched, clock
+
+
+class TestAffinityKey:
+
+    def test_lora_order_is_ignored(self):
+        a = affinity_key("pony", [{"name": "b", "weight": 1.0}, {"name": "a", "weight": 0.5}])
+        b = affinity_key("pony", [{"name": "a", "weight": 0.8}, {"name": "b", "weight": 0.8}])
+        assert a == b
+
+    def test_no_loras(self):
+        assert affinity_key("sdxl") == affinity_key("sdxl", []) == "sdxl|"
+
+
+class TestShouldDefer:
+
+    def test_defers_when_compatible_job_waits(self):
+        sched, _ = _scheduler(max_wait_seconds=60, max_deferrals=5)
+        sched.current_key = affinity_key("sdxl")
+        sched.register("pony-1", "pony")
+        sched.register("sdxl-1", "sdxl")
+
+        assert sched.should_defer("pony-1", affinity_key("pony")) is True
+        assert sched.pending()["pony-1"]["deferrals"] == 1
+
+    def test_runs_when_no_compatible_job(self):
+        sched, _ = _scheduler()
+        sched.current_key = affinity_key("sdxl")
+        sched.register("pony-1", "pony")
+        sched.register("pony-2", "pony")
+
+        assert sched.should_defer("pony-1", affinity_key("pony")) is False
+
+    def test_fairness_bound_on_wait_time(self):
+        sched, clock = _scheduler(max_wait_seconds=60, max_deferrals=100)
+        sched.current_key = affinity_key("sdxl")
+        sched.register("pony-1", "pony")
+        sched.register("sdxl-1", "sdxl")
+        clock.now += 61
+
+        assert sched.should_defer("pony-1", affinity_key("pony")) is False
+        assert sched.stats()["fairness_overrides"] == 1
+
+    def test_fairness_bound_on_deferrals(self):
+        sched, _ = _scheduler(max_wait_seconds=3600, max_deferrals=2)
+        sched.current_key = affinity_key("sdxl")
+        sched.register("pony-1", "pony")
+        sched.register("sdxl-1", "sdxl")
+
+        decisions = [sched.should_defer("pony-1", affinity_key("pony")) for _ in range(3)]
+        assert decisions == [True, True, False]
+
+    def test_unknown_job_is_not_deferred(self):
+        sched, _ = _scheduler()
+        sched.current_key = affinity_key("sdxl")
+        sched.register("sdxl-1", "sdxl")
+
+        assert sched.should_defer("unregistered", affinity_key("pony")) is False
+
+    def test_orphan_entries_expire(self):
+        sched, clock = _scheduler(entry_ttl=100)
+        sched.register("old", "sdxl")
+        clock.now += 101
+
+        assert sched.pending() == {}
+
+
+class TestSwapAccounting:
+
+    def test_interleaved_queue_counts_avoided_swaps(self):
+        sched, clock = _scheduler(max_wait_seconds=3600, max_deferrals=10)
+        sched.current_key = affinity_key("sdxl")
+        queue = [("j1", "sdxl"), ("j2", "pony"), ("j3", "sdxl"), ("j4", "pony")]
+        for job_id, model in queue:
+            sched.register(job_id, model)
+            clock.now += 1
+
+        # Simulation FIFO avec re-publication en fin de file
+        executed = []
+        while queue:
+            job_id, model = queue.pop(0)
+            key = affinity_key(model)
+            if sched.should_defer(job_id, key):
+                queue.append((job_id, model))
+                continue
+            sched.start(job_id, key)
+            sched.finish(job_id)
+            executed.append(model)
+
+        assert executed == ["sdxl", "sdxl", "pony", "pony"]
+        stats = sched.stats()
+        assert stats["swaps"] == 1
+        assert stats["swaps_avoided"] == 1
+        assert stats["jobs_started"] == 4
+        assert stats["pending"] == 0
@@ -77,10 +77,9 @@ class TestAC4_QueueFull:
     """AC #4: Queue full → QUEUE_FULL 503."""
 
     def test_full_queue_returns_503(self, client):
-        mock_inspector = MagicMock()
-        mock_inspector.active.return_value = {"w1": [{}] * 100}
-        mock_inspector.scheduled.return_value = {}
-        with patch("app.api.celery_app") as mock_celery:
-            mock_celery.control.inspect.return_value = mock_inspector
+        from app.admission import QueueFull
+
+        with patch("app.api.admission") as mock_admission:
+            mock_admission.admit.side_effect = QueueFull(100, 100)
             resp = client.post("/v1/generate", json={"prompt": "test"})
         _assert_error_envelope(resp, "QUEUE_FULL", 503)